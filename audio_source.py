@@ -0,0 +1,199 @@
+"""
+Audio sources of the detection. Every source is opened with open_input_stream and behaves like a
+sounddevice.InputStream: a context manager which calls callback(indata, frames, time, status) with blocks
+of float32 samples, one column per channel, and reports its latency and blocksize
+"""
+import threading
+import time
+import wave
+import numpy as np
+import pitch_detection as pd
+from pipeline import BlockTime
+
+VIRTUAL_BLOCK_SIZE = 512 # block size of a virtual device whose block_size setting is 0, a common host default
+VIRTUAL_BUFFER_BLOCKS = 4 # blocks a virtual device holds while its callback is busy, further input is lost
+
+class VirtualCallbackFlags:
+  """
+  Status of a VirtualInputStream callback, the input flags of sounddevice.CallbackFlags
+  """
+  def __init__(self, input_overflow=False):
+    self.input_overflow = input_overflow
+    self.input_underflow = False
+
+  def __bool__(self):
+    return self.input_overflow or self.input_underflow
+
+  def __repr__(self):
+    return f"VirtualCallbackFlags(input_overflow={self.input_overflow})"
+
+class VirtualInputStream:
+  """
+  Virtual input device which plays a recording into a callback on its own thread, like a sounddevice.InputStream.
+  In real time every block is delivered once its last sample would have been captured. A callback that holds
+  the device up for longer than VIRTUAL_BUFFER_BLOCKS blocks loses the samples captured meanwhile, and the next
+  block reports an input_overflow. Otherwise the blocks follow each other as fast as the callback returns.
+  Either way the time info is the stream time the recording would have had in real time
+  """
+  def __init__(self, samples, samplerate=pd.SAMPLE_FREQ, blocksize=pd.BLOCK_SIZE, channels=pd.CHANNELS, callback=None,
+               realtime=pd.AUDIO_SOURCE_REALTIME):
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+      samples = samples[:, np.newaxis]
+    if samples.shape[1] < channels:
+      raise ValueError(f"{channels} channels are needed, the recording has {samples.shape[1]}")
+    self.samples = np.ascontiguousarray(samples[:, :channels])
+    self.samplerate = samplerate
+    self.blocksize = blocksize or VIRTUAL_BLOCK_SIZE
+    self.channels = channels
+    self.callback = callback
+    self.realtime = realtime
+    self.latency = self.blocksize / samplerate # a block is captured completely before it is delivered
+    self.position = 0 # index of the next sample that is delivered
+    self.overflows = 0
+    self.lost_samples = 0
+    self.thread = None
+    self.stop_event = threading.Event()
+    self.finished = threading.Event() # set once the recording was played to the end or the stream was stopped
+
+  @property
+  def active(self):
+    return self.thread is not None and self.thread.is_alive()
+
+  @property
+  def duration(self):
+    """
+    Length of the recording in seconds
+    """
+    return len(self.samples) / self.samplerate
+
+  def start(self):
+    self.stop_event.clear()
+    self.finished.clear()
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.stop_event.set()
+    if self.thread is not None and self.thread is not threading.current_thread():
+      self.thread.join()
+
+  def abort(self):
+    self.stop()
+
+  def close(self):
+    self.stop()
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def wait(self, timeout=None):
+    """
+    Waits until the recording was played to the end or the stream was stopped
+    Returns:
+      is_finished (bool): False if the timeout passed first
+    """
+    return self.finished.wait(timeout)
+
+  def run(self):
+    """
+    Main loop of the device thread
+    """
+    clock_start = time.perf_counter()
+    status = VirtualCallbackFlags()
+    buffer_duration = VIRTUAL_BUFFER_BLOCKS * self.blocksize / self.samplerate
+    try:
+      while not self.stop_event.is_set() and self.position < len(self.samples):
+        block_start = self.position
+        block_end = min(block_start + self.blocksize, len(self.samples))
+        capture_end = block_end / self.samplerate # stream time at which the last sample of the block was captured
+        if self.realtime:
+          delay = clock_start + capture_end - time.perf_counter()
+          if delay > 0 and self.stop_event.wait(delay):
+            break
+          current_time = time.perf_counter() - clock_start
+          if current_time - capture_end > buffer_duration:
+            # the buffer overflowed, only its newest complete blocks are left
+            captured_end = int(current_time * self.samplerate) // self.blocksize * self.blocksize
+            self.position = max(block_start, min(captured_end, len(self.samples)) - VIRTUAL_BUFFER_BLOCKS*self.blocksize)
+            self.lost_samples += self.position - block_start
+            self.overflows += 1
+            status = VirtualCallbackFlags(input_overflow=True)
+            continue
+        else:
+          current_time = capture_end
+        indata = self.samples[block_start:block_end]
+        if len(indata) < self.blocksize: # the last block is padded with silence like a device that keeps running
+          indata = np.concatenate((indata, np.zeros((self.blocksize - len(indata), self.channels), dtype=np.float32)))
+        self.callback(indata, self.blocksize, BlockTime(block_start / self.samplerate, 0.0, current_time), status)
+        status = VirtualCallbackFlags()
+        self.position = block_end
+    finally:
+      self.finished.set()
+
+def load_recording(path, sample_freq=pd.SAMPLE_FREQ):
+  """
+  Loads a recording for the virtual device
+  Parameters:
+    path (str): PCM .wav file, or .npy file of samples at sample_freq with one column per channel
+    sample_freq (int): sample frequency in Hz the detection runs at
+  Returns:
+    samples (np.ndarray): float32 samples between -1 and 1, one column per channel
+  Raises:
+    ValueError: if a .wav file has another sample frequency or sample format
+  """
+  if path.endswith(".npy"):
+    return np.load(path).astype(np.float32)
+  with wave.open(path, "rb") as f:
+    if f.getframerate() != sample_freq:
+      raise ValueError(f"{path} has a sample frequency of {f.getframerate()} Hz instead of {sample_freq} Hz")
+    sample_width = f.getsampwidth()
+    frames = f.readframes(f.getnframes())
+    num_channels = f.getnchannels()
+  if sample_width == 1: # unsigned 8 bit
+    samples = np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128
+  elif sample_width == 3: # packed 24 bit, the sign comes from the top byte
+    raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+    samples = (raw[:, 0] | raw[:, 1] << 8 | raw[:, 2] << 16).astype(np.float32)
+    samples[raw[:, 2] >= 128] -= 2**24
+  elif sample_width in (2, 4):
+    samples = np.frombuffer(frames, dtype=f"<i{sample_width}").astype(np.float32)
+  else:
+    raise ValueError(f"{path} has an unsupported sample width of {sample_width} bytes")
+  return samples.reshape(-1, num_channels) / 2**(8*sample_width - 1)
+
+def open_sounddevice_stream(settings, callback):
+  import sounddevice as sd # only this source needs PortAudio
+  # input only, the block size of the device is independent of the window step of the detection
+  return sd.InputStream(device=settings["input_device"], samplerate=settings["sample_freq"],
+                        blocksize=settings["block_size"], latency=settings["input_latency"],
+                        dtype=np.float32, channels=settings["channels"], callback=callback)
+
+def open_file_stream(settings, callback):
+  samples = load_recording(settings["audio_source_path"], settings["sample_freq"])
+  return VirtualInputStream(samples, settings["sample_freq"], settings["block_size"], settings["channels"], callback,
+                            settings["audio_source_realtime"])
+
+# audio sources selectable with the audio_source setting, every function is called with (settings, callback)
+# and returns a stream that is used as a context manager and provides latency, blocksize and abort()
+AUDIO_SOURCES = {
+  "sounddevice": open_sounddevice_stream,
+  "file": open_file_stream
+}
+
+def open_input_stream(settings, callback):
+  """
+  Opens the input stream of the audio_source setting
+  Parameters:
+    settings (dict): user settings
+    callback (callable): callback(indata, frames, time, status) of every block
+  Returns:
+    stream: sounddevice.InputStream or VirtualInputStream, started when its context is entered
+  """
+  if settings["audio_source"] not in AUDIO_SOURCES:
+    raise ValueError(f"Unknown audio source: {settings['audio_source']}")
+  return AUDIO_SOURCES[settings["audio_source"]](settings, callback)
@@ -0,0 +1,524 @@
+"""
+Benchmarks for the pitch detection, run from the project directory:
+  python benchmark.py                          FFT comparison and the accuracy suite around the default settings
+  python benchmark.py --full                   sweep every combination of the FULL_SWEEP settings
+  python benchmark.py --compare previous.json  report regressions against an earlier run
+The results are written to benchmark_results.json (see --output)
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import scipy.fftpack
+import pitch_detection as pd
+from metrics import Metrics
+
+# every note from C2 to B6
+NOTE_RANGE = range(pd.CONCERT_PITCH_MIDI - 33, pd.CONCERT_PITCH_MIDI + 27)
+SIGNAL_KINDS = ("pure", "harmonic", "noise_20db", "noise_10db", "noise_0db", "hum")
+NUM_HARMONICS = 8 # harmonics of the instrument-like tones
+MAINS_FREQ = 50 # fundamental of the simulated mains hum in Hz
+SWEEP = {
+  "num_hps": [4, 6, 8],
+  "window_size": [8192, 16384, 48000],
+  "white_noise_thresh": [0.1, 0.2, 0.5],
+  "multi_resolution_windows": [[], [2048, 8192, 16384]],
+  "estimator": ["hps", "yin", "mcleod", "verify"],
+  "spectrum_engine": ["fft", "sliding_dft"],
+  "onset_gate": [True, False],
+  "precision": ["float32", "float64"],
+  "fft_backend": ["scipy", "numpy"], # scipy transforms half as many complex samples, numpy in double precision
+  "stabilizer_confidence": [0.6, 1.1] # 1.1 smooths every note
+}
+# --full sweeps every combination of these SWEEP settings, the others are still changed one at a time,
+# the grid of all of them would take days
+FULL_SWEEP = ("num_hps", "window_size", "white_noise_thresh")
+SPECTRUM_HOPS = (24, 48, 96, 240) # hop lengths in samples the spectrum engines are compared at
+ONSET_INTERVAL = 5 # the onset latency is measured on note changes of this many semitones downwards
+FEEDBACK_KINDS = ("harmonic", "noise_10db") # signal kinds the feedback latency is measured on
+NUM_ALLOCATION_HOPS = 10 # hops traced with tracemalloc per configuration, tracing slows everything down
+# a hop still creates Python objects and small arrays of one value per channel or harmonic, a buffer of a
+# window or spectrum takes more than this. Configurations above it are flagged, the default settings fail the run
+ALLOCATION_LIMIT = 16384 # bytes per hop
+# programs timed by benchmark_startup, from the start of a new interpreter until the first frame of the window
+# or the first detected hop
+STARTUP_PROGRAMS = {
+  "import gui": "import gui",
+  "first window frame": "import gui\napp = gui.App()\napp.update()",
+  "first detection": "\n".join([
+    "import numpy as np",
+    "import pitch_detection as pd",
+    "detector = pd.PitchDetector(pd.load_settings())",
+    "t = np.arange(detector.settings['window_step']) / detector.settings['sample_freq']",
+    "detector.callback(0.1*np.sin(2*np.pi*440*t)[:, np.newaxis], None, len(t), None, None, lambda *args: None)"
+  ])
+}
+
+def time_per_call(func, repeats):
+  """
+  Measures the median time of a function call
+  Parameters:
+    func (callable): function without arguments
+    repeats (int): number of timed calls
+  Returns:
+    median_time (float): median time per call in seconds
+  """
+  func() # warm up caches and FFT plans
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - start)
+  return float(np.median(times))
+
+def benchmark_fft(window_size=pd.WINDOW_SIZE, repeats=50):
+  """
+  Compares the per-hop cost of computing the magnitude spectrum with every FFT backend
+  Parameters:
+    window_size (int): window size of the DFT in samples
+    repeats (int): number of timed hops per configuration
+  Returns:
+    results (dict): median time per hop in seconds, keyed by configuration name
+  """
+  samples = np.random.default_rng(0).standard_normal(window_size).astype(np.float32)
+  hann_window = np.hanning(window_size)
+
+  # the transform as it was done before the FFT engine existed
+  def legacy():
+    hann_samples = samples.astype(np.float64) * hann_window
+    return abs(scipy.fftpack.fft(hann_samples)[:len(hann_samples)//2])
+  results = {"legacy fftpack complex float64": time_per_call(legacy, repeats)}
+
+  for backend in pd.FFT_BACKENDS:
+    for precision in ("float64", "float32"):
+      for workers in (1, -1):
+        if workers != 1 and backend != "scipy":
+          continue # only the scipy backend supports workers
+        engine = pd.FFTEngine(window_size, backend, precision, workers)
+        name = f"{backend} {precision} workers={workers}"
+        results[name] = time_per_call(lambda: engine.magnitude_spectrum(samples), repeats)
+  return results
+
+def benchmark_spectrum_engines(hops=SPECTRUM_HOPS, num_hops=200, seed=0):
+  """
+  Compares the per-hop cost of writing a hop into the detector and getting the spectrum of the window
+  with every spectrum engine. The FFT costs the same for every hop, the sliding DFT grows with the hop
+  Parameters:
+    hops (tuple): hop lengths in samples
+    num_hops (int): number of timed hops per configuration
+    seed (int): seed of the random generator
+  Returns:
+    results (dict): median time per hop in seconds, keyed by configuration name
+  """
+  rng = np.random.default_rng(seed)
+  results = {}
+  for hop in hops:
+    for engine in pd.SPECTRUM_ENGINES:
+      settings = {**pd.DEFAULT_SETTINGS, "spectrum_engine": engine, "window_step": hop}
+      detector = pd.PitchDetector(settings)
+      samples = rng.standard_normal(settings["window_size"] + num_hops * hop)
+      detector.push_samples(samples[:settings["window_size"]])
+      latencies = []
+      for i in range(num_hops):
+        start = time.perf_counter()
+        detector.push_samples(samples[settings["window_size"] + i*hop:settings["window_size"] + (i+1)*hop])
+        detector.estimator.fft_engine.magnitude_spectrum(detector.window_samples)
+        latencies.append(time.perf_counter() - start)
+      results[f"{engine} hop={hop}"] = float(np.median(latencies))
+  return results
+
+def benchmark_held_notes(kinds=("harmonic", "noise_20db"), notes=NOTE_RANGE[::4], duration=2.0, seed=0):
+  """
+  Measures the hop latency on held notes with and without the onset gate, which skips the estimator while
+  the note does not change
+  Parameters:
+    kinds (tuple): signal kinds, see generate_signal
+    notes (range): midi note numbers, every note is held for duration seconds
+    duration (float): seconds every note is held
+    seed (int): seed of the random generator
+  Returns:
+    results (dict): median and mean latency per hop in seconds, share of the hops that reused the last
+      estimate and note accuracy once the window is filled with the note, keyed by configuration name
+  """
+  rng = np.random.default_rng(seed)
+  results = {}
+  for onset_gate in (False, True):
+    settings = {**pd.DEFAULT_SETTINGS, "onset_gate": onset_gate}
+    detector = pd.PitchDetector(settings, Metrics(enabled=True)) # counts the reused hops
+    window_size, window_step = settings["window_size"], settings["window_step"]
+    latencies = []
+    num_correct = 0
+    num_hops = 0
+    for kind in kinds:
+      for midi_note in notes:
+        freq = settings["concert_pitch"] * 2**((midi_note - pd.CONCERT_PITCH_MIDI)/12)
+        signal = generate_signal(kind, freq, int(duration * settings["sample_freq"]), settings["sample_freq"], rng)
+        for hop in range(len(signal) // window_step):
+          start = time.perf_counter()
+          detector.push_samples(signal[hop*window_step:(hop+1)*window_step])
+          max_freq = detector.estimate_pitch()
+          latencies.append(time.perf_counter() - start)
+          if (hop+1) * window_step >= window_size:
+            num_hops += 1
+            num_correct += bool(max_freq and pd.find_closest_midi_note(max_freq, settings["concert_pitch"]) == midi_note)
+    results[f"onset_gate={onset_gate}"] = {
+      "latency_p50": float(np.median(latencies)),
+      "latency_mean": float(np.mean(latencies)),
+      "reused_hops": detector.metrics.counters.get("reused_hops", 0) / len(latencies),
+      "note_accuracy": num_correct / num_hops
+    }
+  return results
+
+def benchmark_startup(programs=STARTUP_PROGRAMS, repeats=5):
+  """
+  Measures the cold start, every program runs in a new interpreter in an empty directory with a copy of
+  the settings, once without the table cache (cold) and once with the cache of the previous run (warm)
+  Parameters:
+    programs (dict): source code of the programs, keyed by name
+    repeats (int): number of timed runs per program
+  Returns:
+    results (dict): median seconds from the start of the interpreter until the program finished, keyed by
+      "<name> cold" and "<name> warm", None if the program failed, e.g. the window without a display
+  """
+  project_dir = os.path.dirname(os.path.abspath(__file__))
+  env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [project_dir, os.environ.get("PYTHONPATH")]))}
+  results = {}
+  for name, program in programs.items():
+    times = {"cold": [], "warm": []}
+    for _ in range(repeats):
+      with tempfile.TemporaryDirectory() as work_dir:
+        shutil.copy(os.path.join(project_dir, "user_settings.json"), work_dir)
+        for cache in ("cold", "warm"):
+          start = time.perf_counter()
+          process = subprocess.run([sys.executable, "-c", program], cwd=work_dir, env=env, capture_output=True)
+          times[cache].append(time.perf_counter() - start if process.returncode == 0 else None)
+    for cache, cache_times in times.items():
+      results[f"{name} {cache}"] = None if None in cache_times else float(np.median(cache_times))
+  return results
+
+def generate_signal(kind, freq, num_samples, sample_freq, rng):
+  """
+  Generates a synthetic test signal
+  Parameters:
+    kind (str): one of SIGNAL_KINDS, "pure" is a sine, "harmonic" an instrument-like tone with NUM_HARMONICS
+      harmonics, "noise_<snr>db" the harmonic tone in white noise and "hum" the harmonic tone with mains hum
+    freq (float): fundamental frequency in hertz
+    num_samples (int): length of the signal in samples
+    sample_freq (int): sample frequency in Hz
+    rng (np.random.Generator): random generator for the phases and the noise
+  Returns:
+    signal (np.ndarray): float32 signal with a peak amplitude of about 0.3
+  """
+  t = np.arange(num_samples) / sample_freq
+  if kind == "pure":
+    signal = np.sin(2*np.pi*freq*t + rng.uniform(0, 2*np.pi))
+  else:
+    signal = np.zeros(num_samples)
+    for harmonic in range(1, NUM_HARMONICS+1):
+      if harmonic*freq < sample_freq / 2:
+        signal += np.sin(2*np.pi*harmonic*freq*t + rng.uniform(0, 2*np.pi)) / harmonic
+  if kind.startswith("noise_"):
+    snr_db = float(kind[len("noise_"):-len("db")])
+    noise_power = np.mean(signal**2) / 10**(snr_db/10)
+    signal += rng.standard_normal(num_samples) * noise_power**0.5
+  elif kind == "hum":
+    for harmonic in range(1, 4):
+      signal += 0.5 * np.sin(2*np.pi*harmonic*MAINS_FREQ*t + rng.uniform(0, 2*np.pi)) / harmonic
+  return (0.3 * signal / np.max(np.abs(signal))).astype(np.float32)
+
+def benchmark_config(settings, kinds=SIGNAL_KINDS, notes=NOTE_RANGE, seed=0):
+  """
+  Runs every note of every signal kind through a detector and measures its latency and accuracy
+  Parameters:
+    settings (dict): user settings of the detector
+    kinds (tuple): signal kinds, see generate_signal
+    notes (range): midi note numbers
+    seed (int): seed of the random generator
+  Returns:
+    result (dict): latency percentiles in seconds, hops per second, peak allocation per hop in bytes and the
+      number of memory blocks allocated by a hop that outlive it, e.g. its results or growing caches,
+      the note accuracy and cent errors per signal kind, the onset latency percentiles of the estimates and the
+      feedback latency percentiles of the reported notes in seconds and the share of false reports after note changes
+  """
+  rng = np.random.default_rng(seed)
+  detector = pd.PitchDetector(settings)
+  detector.set_target_notes([pd.midi_note_name(midi_note) for midi_note in notes])
+  window_size, window_step = settings["window_size"], settings["window_step"]
+  latencies = []
+  allocations = []
+  allocated_blocks = []
+  accuracy = {}
+  for kind in kinds:
+    num_correct = 0
+    cent_errors = []
+    for midi_note in notes:
+      freq = settings["concert_pitch"] * 2**((midi_note - pd.CONCERT_PITCH_MIDI)/12)
+      signal = generate_signal(kind, freq, window_size + window_step, settings["sample_freq"], rng)
+      detector.push_samples(signal[:window_size])
+
+      # one real-time hop: the newest block goes into the ring buffer and the window is analyzed
+      is_traced = len(allocations) < NUM_ALLOCATION_HOPS and len(latencies) >= 1
+      if is_traced:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+      start = time.perf_counter()
+      detector.push_samples(signal[window_size:])
+      max_freq = detector.estimate_pitch()
+      latency = time.perf_counter() - start
+      if is_traced:
+        allocations.append(tracemalloc.get_traced_memory()[1] - traced_before)
+        # tracing started right before the hop, every traced block that is still there was allocated by it
+        allocated_blocks.append(sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename")))
+        tracemalloc.stop()
+      else:
+        latencies.append(latency)
+
+      if max_freq is None or not max_freq > 0:
+        continue
+      if pd.find_closest_midi_note(max_freq, settings["concert_pitch"]) == midi_note:
+        num_correct += 1
+        cent_errors.append(abs(1200*np.log2(max_freq/freq)))
+    accuracy[kind] = {
+      "note_accuracy": num_correct / len(notes),
+      "mean_cent_error": float(np.mean(cent_errors)) if cent_errors else None,
+      "p90_cent_error": float(np.percentile(cent_errors, 90)) if cent_errors else None
+    }
+
+  # onset latency: time from a note change until the new note is detected, a missed note counts as a whole window
+  onset_latencies = []
+  max_hops = window_size // window_step + 1
+  for midi_note in notes:
+    freq = settings["concert_pitch"] * 2**((midi_note - pd.CONCERT_PITCH_MIDI)/12)
+    detector.push_samples(generate_signal("harmonic", freq * 2**(ONSET_INTERVAL/12), window_size, settings["sample_freq"], rng))
+    signal = generate_signal("harmonic", freq, max_hops * window_step, settings["sample_freq"], rng)
+    for hop in range(max_hops):
+      detector.push_samples(signal[hop*window_step:(hop+1)*window_step])
+      max_freq = detector.estimate_pitch()
+      if max_freq and pd.find_closest_midi_note(max_freq, settings["concert_pitch"]) == midi_note:
+        break
+    onset_latencies.append((hop+1) * window_step / settings["sample_freq"])
+
+  # feedback latency: time from a note change until the detector reports the new note after the NoteStabilizer,
+  # and the share of hops which report a note that was not played
+  feedback_latencies = []
+  reports = []
+  num_false_reports = 0
+  num_change_hops = 0
+  for kind in FEEDBACK_KINDS:
+    for midi_note in notes:
+      freq = settings["concert_pitch"] * 2**((midi_note - pd.CONCERT_PITCH_MIDI)/12)
+      previous_note = midi_note + ONSET_INTERVAL
+      previous = generate_signal(kind, freq * 2**(ONSET_INTERVAL/12), window_size, settings["sample_freq"], rng)
+      settle_start = max(window_size - settings["stabilizer_size"] * window_step, 0)
+      detector.push_samples(previous[:settle_start])
+      for start in range(settle_start, window_size, window_step): # the previous note settles in the stabilizer
+        detector.callback(previous[start:start+window_step, np.newaxis], None, window_step, None, None, lambda *args: None)
+      signal = generate_signal(kind, freq, max_hops * window_step, settings["sample_freq"], rng)
+      for hop in range(max_hops):
+        reports.clear()
+        detector.callback(signal[hop*window_step:(hop+1)*window_step, np.newaxis], None, window_step, None, None,
+                          lambda closest_note, is_new_note, channel: reports.append(closest_note))
+        num_change_hops += 1
+        if reports[0] == midi_note:
+          break
+        num_false_reports += reports[0] not in (None, previous_note)
+      feedback_latencies.append((hop+1) * window_step / settings["sample_freq"])
+
+  p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+  onset_p50, onset_p90 = np.percentile(onset_latencies, [50, 90])
+  feedback_p50, feedback_p90 = np.percentile(feedback_latencies, [50, 90])
+  return {
+    "settings": {key: settings[key] for key in SWEEP},
+    "latency": {"p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(np.max(latencies))},
+    "hops_per_second": float(len(latencies) / np.sum(latencies)),
+    "allocation_bytes_per_hop": {"p50": float(np.median(allocations)), "max": float(np.max(allocations))},
+    "allocated_blocks_per_hop": {"p50": float(np.median(allocated_blocks)), "max": int(np.max(allocated_blocks))},
+    "accuracy": accuracy,
+    "onset_latency": {"p50": float(onset_p50), "p90": float(onset_p90), "max": float(np.max(onset_latencies))},
+    "feedback_latency": {"p50": float(feedback_p50), "p90": float(feedback_p90), "max": float(np.max(feedback_latencies))},
+    "false_report_rate": num_false_reports / num_change_hops
+  }
+
+def benchmark_channels(channel_counts=(1, 2, 4, 8), num_hops=50, seed=0):
+  """
+  Measures the hop latency of one detector analyzing several channels in a batch, every channel
+  plays a different harmonic-rich note
+  Parameters:
+    channel_counts (tuple): numbers of channels
+    num_hops (int): number of timed hops per channel count
+    seed (int): seed of the random generator
+  Returns:
+    results (dict): median latency per hop in seconds, keyed by the number of channels
+  """
+  rng = np.random.default_rng(seed)
+  # held notes would let the onset gate reuse the estimates and the adaptive hop skip analyses, every hop
+  # has to analyze the whole batch
+  settings = {**pd.DEFAULT_SETTINGS, "onset_gate": False, "adaptive_hop": False}
+  results = {}
+  for channels in channel_counts:
+    detector = pd.PitchDetector({**settings, "channels": channels})
+    num_samples = settings["window_size"] + num_hops * settings["window_step"]
+    signal = np.stack([generate_signal("harmonic", 110 * 2**(channel/4), num_samples, settings["sample_freq"], rng)
+                       for channel in range(channels)], axis=1)
+    detector.push_samples(signal[:settings["window_size"]])
+    latencies = []
+    for hop in range(num_hops):
+      start = settings["window_size"] + hop * settings["window_step"]
+      block = signal[start:start + settings["window_step"]]
+      hop_start = time.perf_counter()
+      detector.callback(block, None, len(block), None, None, lambda *args: None)
+      latencies.append(time.perf_counter() - hop_start)
+    results[channels] = float(np.median(latencies))
+  return results
+
+def sweep_settings(full=False):
+  """
+  Lists the settings to benchmark, by default the defaults and every SWEEP value changed one at a time
+  Parameters:
+    full (bool): list every combination of the FULL_SWEEP settings instead of the defaults
+  Returns:
+    settings_list (list): user settings
+  """
+  base = dict(pd.DEFAULT_SETTINGS)
+  settings_list = [base]
+  if full:
+    settings_list = [{**base, **dict(zip(FULL_SWEEP, values))} for values in itertools.product(*(SWEEP[key] for key in FULL_SWEEP))]
+  for key, values in SWEEP.items():
+    if not full or key not in FULL_SWEEP:
+      settings_list += [{**base, key: value} for value in values if value != base[key]]
+  return settings_list
+
+def config_name(settings):
+  return " ".join(f"{key}={settings.get(key)}" for key in SWEEP)
+
+def compare_results(previous, current, latency_tolerance=0.1, accuracy_tolerance=0.01):
+  """
+  Lists the configurations which got slower or less accurate than in a previous run
+  Parameters:
+    previous (dict): results of the previous run
+    current (dict): results of the current run
+    latency_tolerance (float): allowed relative increase of the median latency
+    accuracy_tolerance (float): allowed decrease of the note accuracy
+  Returns:
+    regressions (list): descriptions of the regressions
+  """
+  previous_configs = {config_name(config["settings"]): config for config in previous["configs"]}
+  regressions = []
+  for name, t in current.get("startup", {}).items():
+    before = previous.get("startup", {}).get(name)
+    if t is not None and before is not None and t > before * (1 + latency_tolerance):
+      regressions.append(f"startup {name}: {before*1e3:.0f} -> {t*1e3:.0f} ms")
+  for config in current["configs"]:
+    name = config_name(config["settings"])
+    if name not in previous_configs:
+      continue
+    before = previous_configs[name]
+    if config["latency"]["p50"] > before["latency"]["p50"] * (1 + latency_tolerance):
+      regressions.append(f"{name}: p50 latency {before['latency']['p50']*1e3:.3f} -> {config['latency']['p50']*1e3:.3f} ms")
+    onset_before = before.get("onset_latency", {}).get("p50")
+    if onset_before is not None and config["onset_latency"]["p50"] > onset_before * (1 + latency_tolerance):
+      regressions.append(f"{name}: p50 onset latency {onset_before*1e3:.0f} -> {config['onset_latency']['p50']*1e3:.0f} ms")
+    feedback_before = before.get("feedback_latency", {}).get("p50")
+    if feedback_before is not None and config["feedback_latency"]["p50"] > feedback_before * (1 + latency_tolerance):
+      regressions.append(f"{name}: p50 feedback latency {feedback_before*1e3:.0f} -> {config['feedback_latency']['p50']*1e3:.0f} ms")
+    allocation_before = before.get("allocation_bytes_per_hop", {}).get("p50")
+    allocation = config["allocation_bytes_per_hop"]["p50"]
+    if allocation_before is not None and allocation > max(allocation_before * (1 + latency_tolerance), ALLOCATION_LIMIT):
+      regressions.append(f"{name}: allocation per hop {allocation_before/1e3:.0f} -> {allocation/1e3:.0f} kB")
+    for kind, accuracy in config["accuracy"].items():
+      accuracy_before = before["accuracy"].get(kind, {}).get("note_accuracy")
+      if accuracy_before is not None and accuracy["note_accuracy"] < accuracy_before - accuracy_tolerance:
+        regressions.append(f"{name}: {kind} note accuracy {accuracy_before:.3f} -> {accuracy['note_accuracy']:.3f}")
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmarks the pitch detection on synthetic signals")
+  parser.add_argument("--full", action="store_true", help="sweep every combination of num_hps, window_size and white_noise_thresh")
+  parser.add_argument("--output", default="benchmark_results.json", help="file the results are written to")
+  parser.add_argument("--compare", help="results of a previous run to check for regressions")
+  args = parser.parse_args()
+
+  print(f"FFT per hop, window_size={pd.WINDOW_SIZE}")
+  fft_results = benchmark_fft()
+  baseline = fft_results["legacy fftpack complex float64"]
+  for name, t in fft_results.items():
+    print(f"  {name:<36} {t*1e3:8.3f} ms  x{baseline/t:5.2f}")
+
+  print(f"\nSpectrum per hop, window_size={pd.WINDOW_SIZE}")
+  spectrum_results = benchmark_spectrum_engines()
+  for name, t in spectrum_results.items():
+    print(f"  {name:<24} {t*1e3:8.3f} ms")
+
+  print("\nStartup")
+  startup_results = benchmark_startup()
+  for name, t in startup_results.items():
+    print(f"  {name:<28} " + ("failed" if t is None else f"{t*1e3:8.1f} ms"))
+
+  print("\nHeld notes per hop")
+  held_note_results = benchmark_held_notes()
+  for name, result in held_note_results.items():
+    print(f"  {name:<18} p50 {result['latency_p50']*1e3:7.3f} ms, mean {result['latency_mean']*1e3:7.3f} ms, "
+          f"{result['reused_hops']*100:5.1f}% reused, {result['note_accuracy']*100:5.1f}% correct notes")
+
+  print("\nBatched multi-channel detection per hop")
+  channel_results = benchmark_channels()
+  for channels, t in channel_results.items():
+    print(f"  {channels} channels {t*1e3:8.3f} ms")
+
+  configs = []
+  for settings in sweep_settings(args.full):
+    config = benchmark_config(settings)
+    configs.append(config)
+    print(f"\n{config_name(settings)}")
+    print(f"  latency p50 {config['latency']['p50']*1e3:.3f} ms, p99 {config['latency']['p99']*1e3:.3f} ms, "
+          f"{config['hops_per_second']:.0f} hops/s, {config['allocation_bytes_per_hop']['p50']/1e3:.0f} kB allocated per hop, "
+          f"{config['allocated_blocks_per_hop']['p50']:.0f} blocks outlive the hop")
+    if config["allocation_bytes_per_hop"]["p50"] > ALLOCATION_LIMIT:
+      print(f"  allocates more than {ALLOCATION_LIMIT/1e3:.0f} kB per hop")
+    print(f"  onset latency p50 {config['onset_latency']['p50']*1e3:.0f} ms, p90 {config['onset_latency']['p90']*1e3:.0f} ms")
+    print(f"  feedback latency p50 {config['feedback_latency']['p50']*1e3:.0f} ms, max {config['feedback_latency']['max']*1e3:.0f} ms, "
+          f"{config['false_report_rate']*100:.1f}% false reports")
+    for kind, accuracy in config["accuracy"].items():
+      mean_cent_error = accuracy["mean_cent_error"]
+      print(f"  {kind:<12} {accuracy['note_accuracy']*100:5.1f}% correct notes, "
+            f"mean error {mean_cent_error if mean_cent_error is None else round(mean_cent_error, 2)} cents")
+
+  results = {
+    "timestamp": time.time(),
+    "python": platform.python_version(),
+    "numpy": np.__version__,
+    "fft": fft_results,
+    "startup": startup_results,
+    "spectrum_engines": spectrum_results,
+    "held_notes": held_note_results,
+    "channels": channel_results,
+    "configs": configs,
+    "allocating_configs": [config_name(config["settings"]) for config in configs
+                           if config["allocation_bytes_per_hop"]["p50"] > ALLOCATION_LIMIT]
+  }
+  with open(args.output, "w") as f:
+    json.dump(results, f, indent=2)
+  print(f"\nResults written to {args.output}")
+
+  if args.compare:
+    with open(args.compare, "r") as f:
+      regressions = compare_results(json.load(f), results)
+    print(f"{len(regressions)} regressions compared to {args.compare}")
+    for regression in regressions:
+      print(f"  {regression}")
+
+  if results["allocating_configs"]:
+    print(f"\n{len(results['allocating_configs'])} configurations allocate more than {ALLOCATION_LIMIT/1e3:.0f} kB per hop")
+    for name in results["allocating_configs"]:
+      print(f"  {name}")
+  if config_name(pd.DEFAULT_SETTINGS) in results["allocating_configs"]:
+    sys.exit("The default settings allocate on every hop")
@@ -0,0 +1,54 @@
+"""
+User settings of PitchPal. Kept free of numpy, so the interface can read them before the DSP modules are loaded
+"""
+import json
+
+SETTINGS_PATH = "user_settings.json"
+
+DEFAULT_SETTINGS = {
+  "sample_freq": 48000,
+  "window_size": 48000,
+  "window_step": 3000,
+  "num_hps": 6,
+  "power_thresh": 1e-6,
+  "concert_pitch": 440,
+  "white_noise_thresh": 0.2,
+  "fft_backend": "scipy",
+  "precision": "float32",
+  "fft_workers": 1,
+  "spectrum_engine": "fft",
+  "sliding_dft_max_freq": 12000,
+  "peak_refinement": "gaussian",
+  "multi_resolution_windows": [2048, 8192, 16384],
+  "confidence_thresh": 0.5,
+  "estimator": "hps",
+  "min_freq": 60,
+  "channels": 1,
+  "onset_gate": True,
+  "onset_gate_thresh": 0.005,
+  "adaptive_hop": True,
+  "stabilizer_size": 3,
+  "stabilizer_confidence": 0.6,
+  "max_queued_blocks": 8,
+  "overflow_policy": "drop_oldest",
+  "input_device": None,
+  "input_latency": "low",
+  "block_size": 0,
+  "audio_source": "sounddevice",
+  "audio_source_path": "",
+  "audio_source_realtime": True,
+  "profiling": False,
+  "profiling_dump_path": "profile.json",
+  "session_log_path": "session_log.bin"
+}
+
+def load_settings(path=SETTINGS_PATH):
+  """
+  Loads the user settings, settings missing from the file keep their default
+  Parameters:
+    path (str): path of the settings file
+  Returns:
+    settings (dict): user settings
+  """
+  with open(path, "r") as f:
+    return {**DEFAULT_SETTINGS, **json.load(f)}
@@ -1,65 +1,152 @@
-import sounddevice as sd
-import numpy as np
 import tkinter as tk
-import pitch_detection as pd
+import config
 from tkinter import *
 from tkinter import font, messagebox
 from threading import Thread, Event
 import json
-import os
-import sys
-import random
+import queue
+import time
+
+# numpy, PortAudio and the detection take most of the startup, they are imported by load_audio_modules
+# once the window is shown
+audio_source = np = pd = pipeline = pl = session_log = None
 
 # variables
-target_notes = []
-alternate_names = []
-current_target_note_idx = 0
 current_practice = None
-current_practice_idx = None
-practice_list = []
+compiled_practice = None # practice_library.CompiledPractice of the practice that is played
+practice_sessions = [] # one PracticeSession per input channel
+current_practice_id = None
+practice_library = None # practice_library.PracticeLibrary, opened on start
+stream_thread = None
+session_logger = None # session_log.SessionLogger of the running practice
+display_events = queue.SimpleQueue() # (widget, fg, text) posted by the detection for the main loop
+# changing these reopens the stream
+STREAM_SETTINGS = ("sample_freq", "input_device", "input_latency", "block_size", "channels", "audio_source", "audio_source_path",
+                   "audio_source_realtime")
+
+DISPLAY_REFRESH_MS = 33 # the labels are updated at most this often, ~30 frames per second
 
 class StreamThread(Thread):
-    def __init__(self):
+    def __init__(self, settings=None):
         super().__init__()
+        self.daemon = True # set Daemon thread
+        self.event = Event()
+        self.stream = None
+        self.is_terminated = False
+        self.settings = settings or config.load_settings()
+        self.detector = pd.PitchDetector(self.settings)
+        self.detector.set_target_notes(compiled_practice.note_names) # the "verify" estimator only looks for these
+        # the audio callback only queues the blocks, the detection runs on the pipeline's analysis thread
+        self.pipeline = pipeline.DetectionPipeline(self.detector, self.detection_callback, self.settings["sample_freq"],
+                                                   self.settings["max_queued_blocks"], self.settings["overflow_policy"],
+                                                   self.settings["window_step"], self.settings["adaptive_hop"])
 
     def run(self):
-        user_settings = json.load(open("user_settings.json", "r"))
-        sample_freq = user_settings["sample_freq"]
-        window_step = user_settings["window_step"]
-        self.event = Event()
-        with sd.Stream(samplerate=sample_freq, blocksize=window_step, 
-                        dtype=np.float32, channels=1,
-                        callback=lambda indata, outdata, frames, time, status, detection_callback=self.detection_callback:
-                        pd.callback(indata, outdata, frames, time, status, detection_callback)) as self.stream:
-            self.event.wait()
+        self.pipeline.start()
+        # the stream is reopened whenever reconfigure changes one of the STREAM_SETTINGS
+        while not self.is_terminated:
+            self.event.clear()
+            # the audio device, or a recording played by a virtual device
+            with audio_source.open_input_stream(self.settings, self.pipeline.audio_callback) as self.stream:
+                block_size = self.stream.blocksize or "variable"
+                display_events.put(("stream_info", None, f"Input latency: {self.stream.latency*1000:.1f} ms, block size: {block_size}"))
+                self.event.wait()
+
+    def reconfigure(self, settings):
+        # the detector swaps in the new settings at its next hop, only a new device, sample frequency,
+        # latency or block size needs the stream to be reopened
+        needs_new_stream = any(settings[key] != self.settings[key] for key in STREAM_SETTINGS)
+        self.settings = settings
+        self.detector.reconfigure(settings)
+        self.pipeline.sample_freq = settings["sample_freq"]
+        self.pipeline.max_queued_blocks = settings["max_queued_blocks"]
+        self.pipeline.overflow_policy = settings["overflow_policy"]
+        self.pipeline.set_hop_size(settings["window_step"], settings["adaptive_hop"])
+        if needs_new_stream:
+            self.event.set() # break self.event.wait()
 
     def terminate(self):
-        self.stream.abort() # abort the stream processing
+        self.is_terminated = True
+        if self.stream:
+            self.stream.abort() # abort the stream processing
+        self.pipeline.stop()
+        self.detector.metrics.dump() # no-op unless profiling is enabled
         self.event.set() # break self.event.wait()
 
-    def detection_callback(self, closest_note, is_new_note=False):
-        global app, current_target_note_idx, target_notes, alternate_names, current_practice
-
-        has_alternate_names = current_practice.get("has_alternate_names") if current_practice else False
-        is_random = current_practice.get("is_random") if current_practice else False
-
+    def detection_callback(self, closest_note, is_new_note=False, channel=0):
+        # runs on the analysis thread, every channel reports to its own practice session
+        if channel < len(practice_sessions):
+            practice_sessions[channel].on_detection(closest_note, is_new_note, self.detector.latest_freq[channel])
+
+class PracticeSession:
+    """
+    Progress of one player through the current practice, every input channel has its own session
+    """
+    def __init__(self, channel=0):
+        self.channel = channel
+        self.displayed_note = None # midi note currently shown as input note
+        self.target_order = compiled_practice.target_order() # upcoming targets as indices into the practice notes
+        self.order_idx = 0
+        self.set_target(self.target_order[0])
+        self.session_start = time.time() # set again when the practice is started
+        self.target_time = self.session_start # when the current target note was shown
+        # the first channel is shown in the big labels, the others in the channel list below them
+        self.input_widget = "input_note" if channel == 0 else f"input_note_{channel}"
+        self.target_widget = "target_note" if channel == 0 else f"target_note_{channel}"
+        self.num_hits = 0 # target notes played
+
+    def set_target(self, target_note_idx):
+        self.target_note_idx = target_note_idx
+        self.target_note = int(compiled_practice.notes[target_note_idx]) # midi note number, compared with the detected notes
+
+    def next_target(self):
+        self.order_idx += 1
+        if self.order_idx == len(self.target_order):
+            self.target_order = compiled_practice.target_order(self.target_note_idx)
+            self.order_idx = 0
+        self.set_target(self.target_order[self.order_idx])
+
+    def target_name(self):
+        return compiled_practice.display_names[self.target_note_idx]
+
+    def start(self):
+        self.session_start = time.time()
+        self.target_time = self.session_start
+
+    def on_detection(self, closest_note, is_new_note=False, freq=None):
+        # runs on the analysis thread, so it never touches tk directly but posts
+        # display events which the main loop picks up in App.poll_display_events
         if closest_note==None:
-            app.input_note.config(fg="white", text="...")
+            self.displayed_note = None
+            display_events.put((self.input_widget, "white", "..."))
             return
         
-        if app.input_note.cget("text") == closest_note and not is_new_note:
+        if self.displayed_note == closest_note and not is_new_note:
             return
         
-        if target_notes[current_target_note_idx] == closest_note:
-            app.input_note.config(fg="green", text=closest_note)
-            if is_random:
-                current_target_note_idx = get_random_list_idx(target_notes, current_target_note_idx)
-            else:
-                current_target_note_idx = (current_target_note_idx + 1) % len(target_notes)
-            app.target_note.config(text=target_notes[current_target_note_idx] if not has_alternate_names else alternate_names[current_target_note_idx])
+        self.log_attempt(closest_note, is_new_note, freq)
+        if self.target_note == closest_note:
+            self.displayed_note = closest_note
+            display_events.put((self.input_widget, "green", pd.NOTE_NAMES[closest_note]))
+            self.num_hits += 1
+            self.next_target()
+            display_events.put((self.target_widget, None, self.target_name()))
+            self.target_time = time.time()
         else:
             if not is_new_note:
-                app.input_note.config(fg="red", text=closest_note)
+                self.displayed_note = closest_note
+                display_events.put((self.input_widget, "red", pd.NOTE_NAMES[closest_note]))
+
+    def log_attempt(self, closest_note, is_new_note, freq):
+        # only queues the attempt, the session logger writes it on its own thread
+        if session_logger is None:
+            return
+        now = time.time()
+        is_correct = self.target_note == closest_note
+        session_logger.log(now, self.session_start, self.channel, self.target_note, closest_note,
+                           session_log.cents_off(freq, self.target_note, stream_thread.settings["concert_pitch"]),
+                           now - self.target_time if is_correct else np.nan, is_new_note, is_correct)
+
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -90,6 +177,9 @@ class App(tk.Tk):
         container.grid_rowconfigure(0, weight=1)
         container.grid_columnconfigure(0, weight=1)
 
+        # labels of the input channels after the first one, see PracticePage.init_channel_labels
+        self.channel_labels = {}
+
         # frames
         self.frames = {}
         for F in (HomePage, PracticePage, SettingsPage, PracticeListPage, PracticeSettingsPage):
@@ -99,6 +189,29 @@ class App(tk.Tk):
             frame.configure(bg="#252526")
 
         self.show_frame("HomePage")
+        self.after(DISPLAY_REFRESH_MS, self.poll_display_events)
+
+    def poll_display_events(self):
+        # drain the display events posted since the last frame and only apply the latest state of every widget
+        latest = {}
+        while True:
+            try:
+                widget, fg, text = display_events.get_nowait()
+            except queue.Empty:
+                break
+            latest[widget] = (fg, text)
+        if latest.pop("channel_labels", None): # the number of channels changed, see resize_practice_sessions
+            self.frames["PracticePage"].init_channel_labels()
+        labels = {"input_note": self.input_note, "target_note": self.target_note, "stream_info": self.stream_info, **self.channel_labels}
+        for widget, (fg, text) in latest.items():
+            label = labels.get(widget)
+            if label is None: # a channel whose labels are gone
+                continue
+            if fg:
+                label.config(fg=fg, text=text)
+            else:
+                label.config(text=text)
+        self.after(DISPLAY_REFRESH_MS, self.poll_display_events)
 
     def show_frame(self, page_name):
         frame = self.frames[page_name]
@@ -167,7 +280,7 @@ class SettingsPage(tk.Frame):
         menu_title.grid(row=1, column=0, sticky=NSEW, pady=(0, 50), columnspan=3)
 
         # settings
-        settings = json.load(open("user_settings.json", "r"))
+        settings = config.load_settings()
         
         sample_freq_label = Label(self.container, text="Sample Frequency: ", bg="#252526", fg="white")
         sample_freq_label.grid(row=2, column=0, sticky=NW, pady=(0, 10), padx=(0, 20), columnspan=2)
@@ -239,10 +352,20 @@ class SettingsPage(tk.Frame):
         white_noise_thresh_info_button = Button(self.container, text="?", bg="#252526", fg="white", width=1, height=1, command=lambda: messagebox.showinfo("Info", "Threshold for white noise. If you are unsure, leave it at 0.2"), relief=FLAT, cursor="hand2", activebackground="#252526", activeforeground="white", bd=0)
         white_noise_thresh_info_button.grid(row=8, column=3, sticky=NE, pady=(0, 10))
 
+        self.entries = {
+            "sample_freq": sample_freq_entry,
+            "window_size": window_size_entry,
+            "window_step": window_step_entry,
+            "num_hps": num_hps_entry,
+            "power_thresh": power_thresh_entry,
+            "concert_pitch": concert_pitch_entry,
+            "white_noise_thresh": white_noise_thresh_entry
+        }
+
         # buttons
         save_button = Button(self.container, width=15,
                             command=lambda: self.save_settings(sample_freq_entry, window_size_entry, window_step_entry, num_hps_entry, power_thresh_entry, concert_pitch_entry, white_noise_thresh_entry),
-                            text="Save & Restart", bg="#2d2d30", fg="white", cursor="hand2")
+                            text="Save", bg="#2d2d30", fg="white", cursor="hand2")
         save_button.grid(row=9, column=0, sticky=SW, pady=(30, 0))
 
         reset_button = Button(self.container, width=15,
@@ -256,14 +379,15 @@ class SettingsPage(tk.Frame):
         back_button.grid(row=9, column=2, sticky=SE, pady=(30, 0))
 
         # footer
-        info_label = Label(self.container, text="Application must be restarted for changes to take effect", bg="#252526", fg="#adadad")
+        info_label = Label(self.container, text="Changes also apply to a running practice", bg="#252526", fg="#adadad")
         info_label.grid(row=10, column=0, sticky=NSEW, columnspan=3, pady=(50, 0))
 
 
 
     def save_settings(self, sample_freq_entry, window_size_entry, window_step_entry, num_hps_entry, power_thresh_entry, concert_pitch_entry, white_noise_thresh_entry):
         try:
-            user_settings = {
+            user_settings = config.load_settings()
+            user_settings.update({
                 "sample_freq": int(sample_freq_entry.get()),
                 "window_size": int(window_size_entry.get()),
                 "window_step": int(window_step_entry.get()),
@@ -271,16 +395,14 @@ class SettingsPage(tk.Frame):
                 "power_thresh": float(power_thresh_entry.get()),
                 "concert_pitch": int(concert_pitch_entry.get()),
                 "white_noise_thresh": float(white_noise_thresh_entry.get())
-            }
+            })
 
-            with open("user_settings.json", "w") as f:
+            with open(config.SETTINGS_PATH, "w") as f:
                 json.dump(user_settings, f, indent=2)
 
+            apply_settings(user_settings)
             messagebox.showinfo("Success", "Settings saved!")
 
-            # restart the application
-            restart_program()
-
         except ValueError:
             messagebox.showerror("Failed to Save", "Please enter valid values")
 
@@ -288,24 +410,15 @@ class SettingsPage(tk.Frame):
             messagebox.showerror("Failed to Save", "An error occurred while saving settings")
 
     def reset_settings(self):
-        default_settings = {
-            "sample_freq": 48000,
-            "window_size": 48000,
-            "window_step": 3000,
-            "num_hps": 6,
-            "power_thresh": 1e-6,
-            "concert_pitch": 440,
-            "white_noise_thresh": 0.2
-        }
-
-        with open("user_settings.json", "w") as f:
-            json.dump(default_settings, f, indent=2)
+        with open(config.SETTINGS_PATH, "w") as f:
+            json.dump(config.DEFAULT_SETTINGS, f, indent=2)
 
+        for key, entry in self.entries.items():
+            entry.delete(0, END)
+            entry.insert(0, config.DEFAULT_SETTINGS[key])
+        apply_settings(dict(config.DEFAULT_SETTINGS))
         messagebox.showinfo("Success", "Settings reset to default!")
 
-        # restart the application
-        restart_program()
-
 class PracticePage(tk.Frame):
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
@@ -349,9 +462,17 @@ class PracticePage(tk.Frame):
         self.stop_button.grid(row=6, column=1, sticky=NSEW, pady=(30, 0))
 
         self.back_button = Button(self.container, width=13,
-                            command=lambda: controller.show_frame("PracticeListPage"),
+                            command=self.on_back_button_click,
                             text="Back", bg="#2d2d30", fg="white", cursor="hand2")
         self.back_button.grid(row=7, column=0, sticky=NSEW, pady=(10, 0), columnspan=2)
+
+        # effective latency reported by the input stream
+        controller.stream_info = Label(self.container, text="", bg="#252526", fg="#adadad")
+        controller.stream_info.grid(row=8, column=0, sticky=NSEW, pady=(10, 0), columnspan=2)
+
+        # target and input note of every further input channel
+        self.channels_frame = Frame(self.container, bg="#252526")
+        self.channels_frame.grid(row=9, column=0, sticky=NSEW, pady=(10, 0), columnspan=2)
     
     def on_start_button_click(self):
         start_stream_thread()
@@ -360,28 +481,54 @@ class PracticePage(tk.Frame):
 
     def on_stop_button_click(self):
         stop_stream_thread()
-        restart_program()
+        self.start_button.config(state=NORMAL, cursor="hand2")
+        self.stop_button.config(state=DISABLED, cursor="arrow")
+        self.controller.input_note.config(fg="white", text="...")
+        for widget, label in self.controller.channel_labels.items():
+            if widget.startswith("input_note"):
+                label.config(fg="white", text="...")
+
+    def on_back_button_click(self):
+        self.on_stop_button_click()
+        self.controller.show_frame("PracticeListPage")
 
     def init_practice(self):
-        global current_target_note_idx, target_notes, current_practice, alternate_names
-        has_alternate_names = current_practice.get("has_alternate_names") if current_practice else False
-        if current_practice and current_practice.get("is_random"): # random practice
-            current_target_note_idx = get_random_list_idx(target_notes)
-            self.controller.target_note.config(text=target_notes[current_target_note_idx] if not has_alternate_names else alternate_names[current_target_note_idx])
-        else:
-            current_target_note_idx = 0
-            self.controller.target_note.config(text=target_notes[current_target_note_idx] if not has_alternate_names else alternate_names[current_target_note_idx])
+        global practice_sessions
+        # every input channel practices on its own, e.g. one student per input of the audio interface
+        practice_sessions = [PracticeSession(channel) for channel in range(config.load_settings()["channels"])]
+        self.controller.target_note.config(text=practice_sessions[0].target_name())
+        self.init_channel_labels()
+        self.start_button.config(state=NORMAL, cursor="hand2")
+        self.stop_button.config(state=DISABLED, cursor="arrow")
+        self.controller.input_note.config(fg="white", text="...")
+        self.controller.stream_info.config(text="")
         self.title_label.config(text=current_practice.get("name"))
         self.description_label.config(text=current_practice.get("description"))
 
+    def init_channel_labels(self):
+        for child in self.channels_frame.winfo_children():
+            child.destroy()
+        self.controller.channel_labels = {}
+        for session in practice_sessions[1:]:
+            channel_label = Label(self.channels_frame, text=f"Channel {session.channel+1}: ", bg="#252526", fg="#adadad")
+            channel_label.grid(row=session.channel, column=0, sticky=NW, padx=(0, 10))
+            target_label = Label(self.channels_frame, text=session.target_name(), bg="#252526", fg="white", width=8)
+            target_label.grid(row=session.channel, column=1, sticky=NW)
+            input_label = Label(self.channels_frame, text="...", bg="#252526", fg="white", width=8)
+            input_label.grid(row=session.channel, column=2, sticky=NW)
+            self.controller.channel_labels[session.target_widget] = target_label
+            self.controller.channel_labels[session.input_widget] = input_label
+
 
 class PracticeListPage(tk.Frame):
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
         self.controller = controller
 
-        # load practice_list
-        practice_list = json.load(open("practice_list.json", "r"))
+        # the practices are loaded a page at a time while the listbox is scrolled, see load_next_page
+        self.practice_ids = [] # id of every listbox entry
+        self.last_entry = None # (name, id) of the last loaded practice
+        self.is_fully_loaded = False
 
         # container
         self.container = Frame(self)
@@ -394,15 +541,13 @@ class PracticeListPage(tk.Frame):
 
         # listbox
         self.listbox = Listbox(self.container, bg="#2d2d30", fg="white", selectbackground="#3d3d3d", borderwidth=0, highlightthickness=0, activestyle="none", font=controller.default_font)
-        for item in practice_list:
-            self.listbox.insert(END, item.get("name"))
         self.listbox.grid(row=3, column=0, sticky=NSEW, columnspan=3)
 
 
         # scrollbar
-        scrollbar = Scrollbar(self.container, orient="vertical", command=self.listbox.yview)
-        scrollbar.grid(row=3, column=2, sticky="nse")
-        self.listbox.config(yscrollcommand=scrollbar.set)
+        self.scrollbar = Scrollbar(self.container, orient="vertical", command=self.listbox.yview)
+        self.scrollbar.grid(row=3, column=2, sticky="nse")
+        self.listbox.config(yscrollcommand=self.on_listbox_scroll)
 
 
         # buttons
@@ -435,33 +580,35 @@ class PracticeListPage(tk.Frame):
         self.listbox.bind('<<ListboxSelect>>', self.enable_buttons)
 
     def on_start_button_click(self):
-        global current_practice, target_notes, alternate_names
-        current_practice = practice_list[self.listbox.curselection()[0]]
-        target_notes = [note.get("note") for note in current_practice.get("note_list")]
-        alternate_names = [note.get("alternate_name") for note in current_practice.get("note_list")]
+        global current_practice, compiled_practice
+        current_practice = practice_library.get(self.practice_ids[self.listbox.curselection()[0]])
+        try:
+            compiled_practice = pl.CompiledPractice(current_practice)
+        except ValueError as e: # saved before the notes were validated
+            messagebox.showerror("Failed to Start", str(e))
+            return
         self.controller.show_frame("PracticePage")
 
     def on_modify_button_click(self):
-        global current_practice, current_practice_idx
-        current_practice_idx = self.listbox.curselection()[0]
-        current_practice = practice_list[current_practice_idx]
+        global current_practice, current_practice_id
+        current_practice_id = self.practice_ids[self.listbox.curselection()[0]]
+        current_practice = practice_library.get(current_practice_id)
         self.controller.show_frame("PracticeSettingsPage")
 
     def on_delete_button_click(self):
-        global current_practice, current_practice_idx, practice_list
-        if not messagebox.askyesno("Confirmation", "Are you sure you want to delete \"" + practice_list[self.listbox.curselection()[0]].get("name") + "\"?"):
+        idx = self.listbox.curselection()[0]
+        if not messagebox.askyesno("Confirmation", "Are you sure you want to delete \"" + self.listbox.get(idx) + "\"?"):
             return
-        practice_list.pop(self.listbox.curselection()[0])
-        with open("practice_list.json", "w") as f:
-            json.dump(practice_list, f, indent=2)
-        self.refresh_listbox()
+        practice_library.delete(self.practice_ids.pop(idx))
+        self.listbox.delete(idx)
+        self.disable_buttons()
         messagebox.showinfo("Success", "Practice deleted!")
 
     
     def on_new_practice_button_click(self):
-        global current_practice, current_practice_idx, practice_list
+        global current_practice, current_practice_id
         current_practice = None
-        current_practice_idx = len(practice_list)
+        current_practice_id = None
         self.controller.show_frame("PracticeSettingsPage")
 
     def enable_buttons(self, event):
@@ -469,16 +616,34 @@ class PracticeListPage(tk.Frame):
         self.modify_button.config(state=NORMAL, cursor="hand2")
         self.delete_button.config(state=NORMAL, cursor="hand2")
     
-    def refresh_listbox(self):
-        global practice_list
-        practice_list = json.load(open("practice_list.json", "r"))
-        self.listbox.delete(0, END)
-        for item in practice_list:
-            self.listbox.insert(END, item.get("name"))
+    def disable_buttons(self):
         self.start_button.config(state=DISABLED, cursor="arrow")
         self.modify_button.config(state=DISABLED, cursor="arrow")
         self.delete_button.config(state=DISABLED, cursor="arrow")
 
+    def refresh_listbox(self):
+        self.listbox.delete(0, END)
+        self.practice_ids = []
+        self.last_entry = None
+        self.is_fully_loaded = False
+        self.load_next_page()
+        self.disable_buttons()
+
+    def load_next_page(self):
+        page = practice_library.page(self.last_entry)
+        for name, practice_id in page:
+            self.listbox.insert(END, name)
+            self.practice_ids.append(practice_id)
+        if page:
+            self.last_entry = page[-1]
+        self.is_fully_loaded = len(page) < pl.PAGE_SIZE
+
+    def on_listbox_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # load the next page before the end of the loaded practices comes into view
+        if not self.is_fully_loaded and float(last) > 0.9:
+            self.load_next_page()
+
 class PracticeSettingsPage(tk.Frame):
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
@@ -582,8 +747,9 @@ class PracticeSettingsPage(tk.Frame):
             messagebox.showerror("Failed to Save", "Alternate names cannot be empty")
             return
         # check if the target notes are in a form of a note followed by an octave number
-        target_notes = [note.strip() for note in self.target_notes_entry.get(1.0, END).split(",") if note.strip()]
-        if not all([(note[0] in pd.ALL_NOTES or note[:2] in pd.ALL_NOTES) and (note[1:].isdigit() or note[2:].isdigit()) for note in target_notes]):
+        try:
+            target_notes = pl.parse_notes(self.target_notes_entry.get(1.0, END))
+        except ValueError:
             messagebox.showerror("Failed to Save", "Target notes must be in a form of a note followed by an octave number (e.g. A4, G#3, ..) and make sure it is in capital letter")
             return
         # check if alternate names count is not equal to target notes count, ignore empty strings as elements
@@ -604,11 +770,9 @@ class PracticeSettingsPage(tk.Frame):
             "is_random": self.is_random.get()
         }
         if current_practice:
-            practice_list[current_practice_idx] = practice
+            practice_library.update(current_practice_id, practice)
         else:
-            practice_list.append(practice)
-        with open("practice_list.json", "w") as f:
-            json.dump(practice_list, f, indent=2)
+            practice_library.add(practice)
         messagebox.showinfo("Success", "Practice saved!")
         self.controller.show_frame("PracticeListPage")
 
@@ -632,28 +796,58 @@ class PracticeSettingsPage(tk.Frame):
         self.on_alternate_names_checkbox_click()
 
 # functions
-def start_stream_thread():
+def start_stream_thread(settings=None):
+    global stream_thread, session_logger
+    stream_thread = StreamThread(settings)
+    if stream_thread.settings["session_log_path"]:
+        session_logger = session_log.SessionLogger(stream_thread.settings["session_log_path"])
+    for session in practice_sessions:
+        session.start()
     stream_thread.start()
 
 def stop_stream_thread():
-    if stream_thread.is_alive():
+    global session_logger
+    if stream_thread and stream_thread.is_alive():
         stream_thread.terminate()
         stream_thread.join()
-
-def restart_program():
-    python = sys.executable
-    os.execl(python, python, * sys.argv)
-
-def get_random_list_idx(list, exclude_idx=None):
-    idx = random.randint(0, len(list)-1)
-    if exclude_idx != None:
-        while idx == exclude_idx: # make sure the new idx is different from the exclude_idx
-            idx = random.randint(0, len(list)-1)
-    return idx
+    if session_logger:
+        session_logger.close() # writes the attempts that are still queued
+        session_logger = None
+    # drop the display events of the stopped practice
+    while not display_events.empty():
+        display_events.get_nowait()
+
+def load_audio_modules():
+    global audio_source, np, pd, pipeline, pl, session_log
+    import audio_source
+    import numpy as np
+    import pitch_detection as pd
+    import pipeline
+    import practice_library as pl
+    import session_log
+
+def resize_practice_sessions(channels):
+    global practice_sessions
+    # the sessions of the remaining channels keep their progress, new channels start the practice from the beginning
+    if not practice_sessions or channels == len(practice_sessions):
+        return
+    new_sessions = [PracticeSession(channel) for channel in range(len(practice_sessions), channels)]
+    if stream_thread and stream_thread.is_alive():
+        for session in new_sessions:
+            session.start()
+    practice_sessions = practice_sessions[:channels] + new_sessions
+    display_events.put(("channel_labels", None, None))
+
+def apply_settings(settings):
+    # a running practice picks up the new settings without restarting the application
+    resize_practice_sessions(settings["channels"])
+    if stream_thread and stream_thread.is_alive():
+        stream_thread.reconfigure(settings)
 
 if __name__ == "__main__":
-    stream_thread = StreamThread()
-    stream_thread.daemon = True  # set Daemon thread
-
     app = App()
-    app.mainloop()
\ No newline at end of file
+    app.update() # draws the first frame before the audio modules are loaded
+    load_audio_modules()
+    practice_library = pl.PracticeLibrary()
+    app.mainloop()
+    practice_library.close()
\ No newline at end of file
@@ -0,0 +1,144 @@
+import atexit
+import collections
+import json
+import time
+import numpy as np
+
+# sounddevice.CallbackFlags attributes which are counted by Metrics.count_status
+STATUS_FLAGS = ("input_overflow", "input_underflow", "output_overflow", "output_underflow", "priming_output")
+live_metrics = None # the latest Metrics with a dump path, the only one dumped at exit
+
+def dump_live_metrics():
+  if live_metrics is not None:
+    live_metrics.dump()
+
+# a single hook instead of one per Metrics, the detector is rebuilt on every start of a practice and the
+# metrics of an old detector must not overwrite the dump of the live one
+atexit.register(dump_live_metrics)
+
+class RollingHistogram:
+  """
+  Keeps the last capacity values of a metric in a ring buffer
+  """
+  def __init__(self, capacity=1024):
+    self.values = np.zeros(capacity)
+    self.count = 0 # number of values ever added
+
+  def add(self, value):
+    self.values[self.count % len(self.values)] = value
+    self.count += 1
+
+  def recent(self):
+    """
+    Returns the values that are still in the ring buffer, oldest first
+    """
+    if self.count <= len(self.values):
+      return self.values[:self.count].copy()
+    return np.roll(self.values, -(self.count % len(self.values)))
+
+  def histogram(self, bins=20):
+    """
+    Returns the counts and bin edges of the recent values, see np.histogram
+    """
+    return np.histogram(self.recent(), bins=bins)
+
+  def summary(self):
+    """
+    Returns the count and the mean, median, 90th and 99th percentile and maximum of the recent values
+    """
+    recent = self.recent()
+    if not len(recent):
+      return {"count": 0}
+    p50, p90, p99 = np.percentile(recent, [50, 90, 99])
+    return {"count": self.count, "mean": float(recent.mean()), "p50": float(p50), "p90": float(p90),
+            "p99": float(p99), "max": float(recent.max())}
+
+class StageTimer:
+  """
+  Measures consecutive stages of one hop, every lap records the time since the previous one
+  """
+  def __init__(self, metrics):
+    self.metrics = metrics
+    self.start = self.last = time.perf_counter()
+
+  def lap(self, stage):
+    now = time.perf_counter()
+    self.metrics.record(stage, now - self.last)
+    self.last = now
+
+  def finish(self, stage="hop"):
+    """
+    Records the total time since the timer was created
+    """
+    self.metrics.record(stage, time.perf_counter() - self.start)
+
+class NullTimer:
+  """
+  Stand-in for StageTimer while the metrics are disabled
+  """
+  def lap(self, stage):
+    pass
+
+  def finish(self, stage="hop"):
+    pass
+
+NULL_TIMER = NullTimer()
+
+class Metrics:
+  """
+  Opt-in instrumentation of the pitch detection, rolling histograms of stage timings in seconds
+  and counters of events such as the status flags of the audio callback
+  """
+  def __init__(self, enabled=False, dump_path=None, capacity=1024):
+    self.enabled = enabled
+    self.dump_path = dump_path
+    self.capacity = capacity
+    self.timings = collections.defaultdict(lambda: RollingHistogram(self.capacity))
+    self.counters = collections.Counter()
+    if enabled and dump_path:
+      global live_metrics
+      live_metrics = self
+
+  def timer(self):
+    """
+    Returns a timer for the stages of one hop, a no-op timer if the metrics are disabled
+    """
+    return StageTimer(self) if self.enabled else NULL_TIMER
+
+  def record(self, name, value):
+    if self.enabled:
+      self.timings[name].add(value)
+
+  def count(self, name, n=1):
+    if self.enabled:
+      self.counters[name] += n
+
+  def count_status(self, status):
+    """
+    Counts the flags of the status of an audio callback
+    """
+    if not self.enabled or not status:
+      return
+    self.counters["status"] += 1
+    for flag in STATUS_FLAGS:
+      if getattr(status, flag, False):
+        self.counters[flag] += 1
+
+  def snapshot(self):
+    """
+    Returns the summaries of all timings and the counters
+    """
+    return {
+      "timings": {name: histogram.summary() for name, histogram in list(self.timings.items())},
+      "counters": dict(self.counters)
+    }
+
+  def dump(self, path=None):
+    """
+    Writes the snapshot as json to path, or to dump_path
+    """
+    path = path or self.dump_path
+    if not self.enabled or not path:
+      return
+    with open(path, "w") as f:
+      json.dump(self.snapshot(), f, indent=2)
@@ -0,0 +1,255 @@
+import collections
+import threading
+import time
+import numpy as np
+import pitch_detection as pd
+
+# "drop_oldest" discards the oldest waiting block, "coalesce" merges the new block into the newest waiting one
+# so the analysis thread catches up in one hop, "block" makes the audio callback wait for free space
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "block")
+
+# the compute governor lengthens the hop when the detection of a hop takes more than GOVERNOR_HIGH_LOAD of the
+# hop's duration, and shortens it again below GOVERNOR_LOW_LOAD
+GOVERNOR_HIGH_LOAD = 0.8
+GOVERNOR_LOW_LOAD = 0.3
+GOVERNOR_MAX_FACTOR = 4 # the hop grows to at most this many times the configured hop
+GOVERNOR_SMOOTHING = 0.2 # weight of the newest hop in the average load
+
+# copy of the time info of a sounddevice callback, which is only valid while the callback runs
+BlockTime = collections.namedtuple("BlockTime", ["inputBufferAdcTime", "outputBufferDacTime", "currentTime"])
+
+class AudioBlock:
+  """
+  Audio block waiting in the queue of a DetectionPipeline
+  """
+  def __init__(self, samples, time, status, arrival_time):
+    self.samples = samples
+    self.time = time
+    self.status = status
+    self.arrival_time = arrival_time # time.perf_counter() when the block was queued
+    self.num_blocks = 1 # number of audio callbacks merged into this block
+
+class ComputeGovernor:
+  """
+  Adapts the hop of a DetectionPipeline to the time the detection takes. A hop is doubled while the
+  detection uses up most of the hop's duration, so a slow machine analyzes less often instead of falling behind
+  """
+  def __init__(self, hop_size, sample_freq, max_factor=GOVERNOR_MAX_FACTOR):
+    self.base_hop_size = hop_size
+    self.hop_size = hop_size
+    self.sample_freq = sample_freq
+    self.max_factor = max_factor
+    self.load = 0.0 # moving average of the processing time per hop relative to the hop's duration
+    self.hop_changes = 0
+
+  def update(self, processing_time):
+    """
+    Takes the processing time of the last hop
+    Parameters:
+      processing_time (float): seconds the detection of the hop took
+    Returns:
+      hop_size (int): hop size in samples for the next hops
+    """
+    load = processing_time * self.sample_freq / self.hop_size
+    self.load += GOVERNOR_SMOOTHING * (load - self.load)
+    hop_size = self.hop_size
+    if self.load > GOVERNOR_HIGH_LOAD and hop_size < self.base_hop_size * self.max_factor:
+      hop_size = min(hop_size * 2, self.base_hop_size * self.max_factor)
+    elif self.load < GOVERNOR_LOW_LOAD and hop_size > self.base_hop_size:
+      hop_size = max(hop_size // 2, self.base_hop_size)
+    if hop_size != self.hop_size:
+      self.load *= self.hop_size / hop_size # the same processing time is a smaller share of a longer hop
+      self.hop_size = hop_size
+      self.hop_changes += 1
+    return self.hop_size
+
+class DetectionPipeline:
+  """
+  Decouples the real-time audio callback from the pitch detection. The audio callback only copies
+  its block into a bounded queue, the detection runs on a dedicated analysis thread. The blocks of the
+  audio device can have any size, the analysis thread regroups them into hops of hop_size samples.
+  With adaptive_hop a ComputeGovernor lengthens the hops while the detection can't keep up
+  """
+  def __init__(self, detector, detection_callback, sample_freq=pd.SAMPLE_FREQ,
+               max_queued_blocks=pd.MAX_QUEUED_BLOCKS, overflow_policy=pd.OVERFLOW_POLICY, hop_size=pd.WINDOW_STEP,
+               adaptive_hop=pd.ADAPTIVE_HOP):
+    if overflow_policy not in OVERFLOW_POLICIES:
+      raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+    self.detector = detector
+    self.detection_callback = detection_callback
+    self.sample_freq = sample_freq
+    self.max_queued_blocks = max_queued_blocks
+    self.overflow_policy = overflow_policy
+    self.set_hop_size(hop_size, adaptive_hop)
+    self.queue = collections.deque()
+    self.condition = threading.Condition()
+    self.is_running = False
+    self.is_busy = False # whether the analysis thread is processing a block
+    self.thread = None
+
+    # samples of the analysis thread that do not fill a whole hop yet
+    self.pending_samples = []
+    self.num_pending_samples = 0
+    self.pending_status = None
+
+    # counters
+    self.queued_blocks = 0
+    self.processed_blocks = 0
+    self.processed_hops = 0
+    self.dropped_blocks = 0 # discarded by the drop_oldest policy
+    self.coalesced_blocks = 0 # merged into another block by the coalesce policy
+    self.late_blocks = 0 # waited longer than their own duration before the analysis started
+    self.blocked_time = 0.0 # seconds the audio callback spent waiting by the block policy
+    self.max_queue_length = 0
+
+  def set_hop_size(self, hop_size, adaptive_hop=pd.ADAPTIVE_HOP):
+    """
+    Sets the configured hop size, the governor starts over from it
+    """
+    self.hop_size = hop_size
+    self.governor = ComputeGovernor(hop_size, self.sample_freq) if adaptive_hop else None
+
+  def start(self):
+    """
+    Starts the analysis thread
+    """
+    self.is_running = True
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    """
+    Stops the analysis thread, blocks still waiting in the queue are discarded
+    """
+    with self.condition:
+      self.is_running = False
+      self.queue.clear()
+      self.pending_samples = []
+      self.num_pending_samples = 0
+      self.pending_status = None
+      self.condition.notify_all()
+    if self.thread is not None and self.thread is not threading.current_thread():
+      self.thread.join()
+
+  def drain(self, timeout=None):
+    """
+    Waits until the analysis thread has processed every queued block, e.g. after a recording was played
+    Returns:
+      is_drained (bool): False if the timeout passed first
+    """
+    with self.condition:
+      return self.condition.wait_for(lambda: not self.is_running or not (self.queue or self.is_busy), timeout)
+
+  def audio_callback(self, indata, frames, time_info, status):
+    """
+    sounddevice.InputStream callback, copies the block into the queue and returns immediately
+    """
+    block = AudioBlock(indata.copy(), copy_block_time(time_info), status, time.perf_counter())
+    with self.condition:
+      if len(self.queue) >= self.max_queued_blocks:
+        if self.overflow_policy == "drop_oldest":
+          self.queue.popleft()
+          self.dropped_blocks += 1
+        elif self.overflow_policy == "coalesce" and self.queue[-1].samples.shape[1] == block.samples.shape[1]:
+          newest = self.queue[-1]
+          newest.samples = np.concatenate((newest.samples, block.samples))
+          newest.status = newest.status or block.status
+          newest.num_blocks += 1
+          self.coalesced_blocks += 1
+          self.queued_blocks += 1
+          return
+        elif self.overflow_policy == "coalesce": # a block of the previous stream has another number of channels
+          self.queue.popleft()
+          self.dropped_blocks += 1
+        else:
+          wait_start = time.perf_counter()
+          while self.is_running and len(self.queue) >= self.max_queued_blocks:
+            self.condition.wait()
+          self.blocked_time += time.perf_counter() - wait_start
+      self.queue.append(block)
+      self.queued_blocks += 1
+      self.max_queue_length = max(self.max_queue_length, len(self.queue))
+      self.condition.notify_all()
+
+  def run(self):
+    """
+    Main loop of the analysis thread
+    """
+    while True:
+      with self.condition:
+        while self.is_running and not self.queue:
+          self.condition.wait()
+        if not self.is_running:
+          return
+        block = self.queue.popleft()
+        self.is_busy = True
+        self.condition.notify_all() # wake up an audio callback waiting for space
+
+      block_duration = len(block.samples) / block.num_blocks / self.sample_freq
+      queue_wait = time.perf_counter() - block.arrival_time
+      self.detector.metrics.record("queue_wait", queue_wait)
+      if queue_wait > block_duration:
+        self.late_blocks += 1
+      self.process_block(block)
+      # from the audio callback until the detection of the block is reported
+      self.detector.metrics.record("detection_latency", time.perf_counter() - block.arrival_time)
+      with self.condition:
+        self.processed_blocks += block.num_blocks
+        self.is_busy = False
+        self.condition.notify_all() # wake up drain
+
+  def process_block(self, block):
+    """
+    Adds a block to the pending samples and runs the detection on every complete hop
+    """
+    if self.pending_samples and self.pending_samples[0].shape[1] != block.samples.shape[1]:
+      # the stream was reopened with another number of channels, its leftover samples don't fit the new ones
+      self.pending_samples = []
+      self.num_pending_samples = 0
+    self.pending_samples.append(block.samples)
+    self.num_pending_samples += len(block.samples)
+    self.pending_status = self.pending_status or block.status
+    if self.num_pending_samples < self.hop_size:
+      return
+    samples = np.concatenate(self.pending_samples) if len(self.pending_samples) > 1 else self.pending_samples[0]
+    num_hops = len(samples) // self.hop_size
+    # a coalesced block catches up in a single hop, otherwise every hop is analyzed on its own
+    hop_lengths = [num_hops * self.hop_size] if block.num_blocks > 1 else [self.hop_size] * num_hops
+    start = 0
+    for hop_length in hop_lengths:
+      status, self.pending_status = self.pending_status, None
+      hop_start = time.perf_counter()
+      self.detector.callback(samples[start:start+hop_length], None, hop_length, block.time, status, self.detection_callback)
+      if self.governor is not None:
+        self.hop_size = self.governor.update(time.perf_counter() - hop_start)
+      self.processed_hops += 1
+      start += hop_length
+    self.pending_samples = [samples[start:]] if start < len(samples) else []
+    self.num_pending_samples = len(samples) - start
+
+  def stats(self):
+    """
+    Returns the counters of the pipeline
+    """
+    return {
+      "queued_blocks": self.queued_blocks,
+      "processed_blocks": self.processed_blocks,
+      "processed_hops": self.processed_hops,
+      "dropped_blocks": self.dropped_blocks,
+      "coalesced_blocks": self.coalesced_blocks,
+      "late_blocks": self.late_blocks,
+      "blocked_time": self.blocked_time,
+      "queue_length": len(self.queue),
+      "max_queue_length": self.max_queue_length,
+      "hop_size": self.hop_size,
+      "hop_changes": 0 if self.governor is None else self.governor.hop_changes
+    }
+
+def copy_block_time(time_info):
+  """
+  Copies the time info of a sounddevice callback
+  """
+  if time_info is None:
+    return None
+  return BlockTime(getattr(time_info, "inputBufferAdcTime", None), getattr(time_info, "outputBufferDacTime", None),
+                   getattr(time_info, "currentTime", None))
@@ -1,134 +1,1607 @@
-import copy
+import bisect
+import collections
+import functools
+import importlib
 import os
 import numpy as np
-import scipy.fftpack
-import json
-
-# General settings that can be changed by the user
-user_settings = json.load(open("user_settings.json", "r"))
-SAMPLE_FREQ = user_settings["sample_freq"] # sample frequency in Hz
-WINDOW_SIZE = user_settings["window_size"] # window size of the DFT in samples
-WINDOW_STEP = user_settings["window_step"] # step size of window
-NUM_HPS = user_settings["num_hps"] # max number of harmonic product spectrums
-POWER_THRESH = user_settings["power_thresh"] # tuning is activated if the signal power exceeds this threshold
-CONCERT_PITCH = user_settings["concert_pitch"] # defining a1
-WHITE_NOISE_THRESH = user_settings["white_noise_thresh"] # everything under WHITE_NOISE_THRESH*avg_energy_per_freq is cut off
+from config import DEFAULT_SETTINGS, load_settings
+from metrics import Metrics, NULL_TIMER
+
+# defaults of the settings that can be changed by the user, the settings file is only read by load_settings,
+# so importing the module does no file I/O
+SAMPLE_FREQ = DEFAULT_SETTINGS["sample_freq"] # sample frequency in Hz
+WINDOW_SIZE = DEFAULT_SETTINGS["window_size"] # window size of the DFT in samples
+WINDOW_STEP = DEFAULT_SETTINGS["window_step"] # step size of window
+NUM_HPS = DEFAULT_SETTINGS["num_hps"] # max number of harmonic product spectrums
+POWER_THRESH = DEFAULT_SETTINGS["power_thresh"] # tuning is activated if the signal power exceeds this threshold
+CONCERT_PITCH = DEFAULT_SETTINGS["concert_pitch"] # defining a1
+WHITE_NOISE_THRESH = DEFAULT_SETTINGS["white_noise_thresh"] # everything under WHITE_NOISE_THRESH*avg_energy_per_freq is cut off
+FFT_BACKEND = DEFAULT_SETTINGS["fft_backend"] # one of FFT_BACKENDS
+PRECISION = DEFAULT_SETTINGS["precision"] # "float32" or "float64", dtype of the samples, spectrums and scratch buffers
+FFT_WORKERS = DEFAULT_SETTINGS["fft_workers"] # number of threads used by the FFT on large windows
+SPECTRUM_ENGINE = DEFAULT_SETTINGS["spectrum_engine"] # one of SPECTRUM_ENGINES, how the spectrum of the whole window is computed
+SLIDING_DFT_MAX_FREQ = DEFAULT_SETTINGS["sliding_dft_max_freq"] # the sliding DFT only tracks the bins up to this frequency in Hz
+PEAK_REFINEMENT = DEFAULT_SETTINGS["peak_refinement"] # one of PEAK_REFINEMENTS
+MULTI_RESOLUTION_WINDOWS = DEFAULT_SETTINGS["multi_resolution_windows"] # shorter windows tried before WINDOW_SIZE, empty to disable
+CONFIDENCE_THRESH = DEFAULT_SETTINGS["confidence_thresh"] # a shorter window is trusted if this share of the energy lies on the harmonics of its result
+ESTIMATOR = DEFAULT_SETTINGS["estimator"] # pitch estimation algorithm, one of ESTIMATORS
+MIN_FREQ = DEFAULT_SETTINGS["min_freq"] # lowest fundamental in Hz the time-domain estimators look for
+CHANNELS = DEFAULT_SETTINGS["channels"] # number of input channels, every channel is detected on its own
+ONSET_GATE = DEFAULT_SETTINGS["onset_gate"] # reuse the last estimate while the sound does not change
+ONSET_GATE_THRESH = DEFAULT_SETTINGS["onset_gate_thresh"] # spectral change that counts as an onset, see OnsetGate
+ADAPTIVE_HOP = DEFAULT_SETTINGS["adaptive_hop"] # lengthen the hop when the detection can't keep up, see pipeline.ComputeGovernor
+STABILIZER_SIZE = DEFAULT_SETTINGS["stabilizer_size"] # number of recent notes an uncertain note is smoothed over, see NoteStabilizer
+STABILIZER_CONFIDENCE = DEFAULT_SETTINGS["stabilizer_confidence"] # notes at least this confident are reported on their first hop
+MAX_QUEUED_BLOCKS = DEFAULT_SETTINGS["max_queued_blocks"] # number of audio blocks that may wait for the analysis thread
+OVERFLOW_POLICY = DEFAULT_SETTINGS["overflow_policy"] # what to do when the analysis falls behind, one of pipeline.OVERFLOW_POLICIES
+INPUT_DEVICE = DEFAULT_SETTINGS["input_device"] # index or name of the input device, None for the default device
+INPUT_LATENCY = DEFAULT_SETTINGS["input_latency"] # "low", "high" or the suggested input latency in seconds
+BLOCK_SIZE = DEFAULT_SETTINGS["block_size"] # samples per audio callback, 0 lets the host choose, independent of WINDOW_STEP
+AUDIO_SOURCE = DEFAULT_SETTINGS["audio_source"] # one of audio_source.AUDIO_SOURCES
+AUDIO_SOURCE_PATH = DEFAULT_SETTINGS["audio_source_path"] # recording played by the "file" audio source
+AUDIO_SOURCE_REALTIME = DEFAULT_SETTINGS["audio_source_realtime"] # play the recording at its own pace instead of as fast as possible
+PROFILING = DEFAULT_SETTINGS["profiling"] # record per-stage timings of the detection
+PROFILING_DUMP_PATH = DEFAULT_SETTINGS["profiling_dump_path"] # the timings are written to this file on exit
 
 WINDOW_T_LEN = WINDOW_SIZE / SAMPLE_FREQ # length of the window in seconds
 SAMPLE_T_LENGTH = 1 / SAMPLE_FREQ # length between two samples in seconds
 DELTA_FREQ = SAMPLE_FREQ / WINDOW_SIZE # frequency step width of the interpolated DFT
 OCTAVE_BANDS = [50, 100, 200, 400, 800, 1600, 3200, 6400, 12800, 25600]
+# "interpolate" upsamples the whole spectrum NUM_HPS times before the HPS,
+# "parabolic" and "gaussian" run the HPS at bin resolution and refine the winning peak afterwards
+PEAK_REFINEMENTS = ("interpolate", "parabolic", "gaussian")
+DSP_TABLE_CACHE_SIZE = 16 # number of (sample_freq, window_size, num_hps) configurations whose tables are kept
+TABLE_CACHE_DIR = "table_cache" # the tables derived from the settings are stored here, see cached_table
+TABLE_CACHE_VERSION = 2 # part of the file names, bump it when a table is computed differently
+MIN_BINS_PER_SEMITONE = 2 # a window is only trusted for notes whose neighbours are at least this many bins away
+MAX_FREQ = 5000 # highest fundamental in Hz the time-domain estimators look for
+YIN_THRESH = 0.15 # the first dip of the normalized difference below this is taken as the period
+YIN_MAX_APERIODICITY = 0.5 # without a dip below YIN_THRESH, the global minimum is taken if it is below this
+MCLEOD_K = 0.9 # the first key maximum of the NSDF above MCLEOD_K times the highest one is taken as the period
+MCLEOD_MIN_CLARITY = 0.5 # the signal counts as unpitched if no key maximum of the NSDF reaches this
+VERIFY_NUM_HARMONICS = 4 # harmonics of every target note the verify estimator looks at
+VERIFY_PERIODS = 34 # filter length in periods of the note, the neighbouring semitones then fall outside the main lobe
+VERIFY_THRESH = 0.35 # share of the signal power the harmonics of a target note have to explain
+VERIFY_MIN_FUNDAMENTAL = 0.1 # share of the harmonic power the fundamental needs, rejects notes an octave above a target
+ONSET_GATE_WINDOW = 2048 # samples of the short spectrum the onset gate compares
+ONSET_GATE_MAX_DRIFT = 0.25 # semitones two estimates may differ by and still count as the same sound
+ONSET_GATE_MAX_REUSE = 0.5 # seconds an estimate is reused at most before the estimator runs again
+CONFIDENCE_POWER_MARGIN = 20 # decibels above power_thresh from which the signal power no longer lowers the confidence
 
 ALL_NOTES = ["A","A#","B","C","C#","D","D#","E","F","F#","G","G#"]
-def find_closest_note(pitch):
+CONCERT_PITCH_MIDI = 69 # midi note number of a4
+def find_closest_note(pitch, concert_pitch=CONCERT_PITCH):
   """
   Finds the closest note for a given pitch
   Parameters:
     pitch (float): pitch given in hertz
+    concert_pitch (float): pitch of a4 in hertz
   Returns:
     closest_note (str): e.g. a, g#, ..
     closest_pitch (float): pitch of the closest note in hertz
   """
-  i = int(np.round(np.log2(pitch/CONCERT_PITCH)*12))
+  i = int(np.round(np.log2(pitch/concert_pitch)*12))
   closest_note = ALL_NOTES[i%12] + str(4 + (i + 9) // 12)
-  closest_pitch = CONCERT_PITCH*2**(i/12)
+  closest_pitch = concert_pitch*2**(i/12)
   return closest_note, closest_pitch
 
-HANN_WINDOW = np.hanning(WINDOW_SIZE)
-def callback(indata, outdata, frames, time, status, detection_callback):
+def find_closest_midi_note(pitch, concert_pitch=CONCERT_PITCH):
   """
-  Callback function which contains the pitch detection
+  Finds the midi note number of the closest note for the given pitches
+  Parameters:
+    pitch (float or np.ndarray): pitch given in hertz
+    concert_pitch (float): pitch of a4 in hertz
+  Returns:
+    midi_note (int or np.ndarray): midi note number, e.g. 69 for a4
   """
-  # define static variables
-  if not hasattr(callback, "window_samples"):
-    callback.window_samples = [0 for _ in range(WINDOW_SIZE)]
-  if not hasattr(callback, "noteBuffer"):
-    callback.noteBuffer = ["1","2"]
-  if not hasattr(callback, "is_note_still_playing"):
-    callback.is_note_still_playing = False
+  return CONCERT_PITCH_MIDI + np.round(np.log2(pitch/concert_pitch)*12).astype(int)
 
-  if status:
-    print(status)
-    detection_callback(None)
-    return
-  if any(indata):
-    callback.window_samples = np.concatenate((callback.window_samples, indata[:, 0])) # append new samples
-    callback.window_samples = callback.window_samples[len(indata[:, 0]):] # remove old samples
+def midi_note_name(midi_note):
+  """
+  Converts a midi note number into a note name
+  Parameters:
+    midi_note (int): midi note number
+  Returns:
+    note (str): e.g. A4, G#3, ..
+  """
+  i = int(midi_note) - CONCERT_PITCH_MIDI
+  return ALL_NOTES[i%12] + str(4 + (i + 9) // 12)
 
-    # calculate input power
-    input_power = (np.linalg.norm(indata[:, 0], ord=2)**2) / len(indata[:, 0])
+NUM_MIDI_NOTES = 128
+NOTE_NAMES = tuple(midi_note_name(midi_note) for midi_note in range(NUM_MIDI_NOTES)) # name of every midi note number
 
-    # check if the note is still playing
-    is_new_note = False
-    if input_power > POWER_THRESH:
-        if not callback.is_note_still_playing:
-            callback.is_note_still_playing = True
-            is_new_note = True
+@functools.lru_cache(maxsize=8)
+def get_note_edges(concert_pitch):
+  """
+  Precomputes the frequencies halfway between neighbouring midi notes, so the closest note of a frequency
+  is a bisection of this table instead of a logarithm
+  Parameters:
+    concert_pitch (float): pitch of a4 in hertz
+  Returns:
+    note_edges (tuple): lowest frequency of midi notes 1 to 127, bisect_right of a frequency is its closest note
+  """
+  return tuple(float(concert_pitch * 2**((midi_note - 0.5 - CONCERT_PITCH_MIDI)/12)) for midi_note in range(1, NUM_MIDI_NOTES))
+
+def note_name_midi(note):
+  """
+  Converts a note name into a midi note number, the inverse of midi_note_name
+  Parameters:
+    note (str): e.g. A4, G#3, ..
+  Returns:
+    midi_note (int): midi note number
+  """
+  name = note.rstrip("-0123456789")
+  if name not in ALL_NOTES or name == note:
+    raise ValueError(f"Not a note name: {note}")
+  k = ALL_NOTES.index(name)
+  return CONCERT_PITCH_MIDI + k + 12*(int(note[len(name):]) - 4 - (k + 9) // 12)
+
+def cached_table(name, compute, *key):
+  """
+  Memory-maps a table from the .npy cache in TABLE_CACHE_DIR, a missing table is computed and stored first.
+  Later starts only map the file, and only the pages that are actually read get loaded
+  Parameters:
+    name (str): name of the table
+    compute (callable): function without arguments which returns the table
+    key: the parameters the table is computed from, they are part of the file name
+  Returns:
+    table (np.ndarray): read-only table
+  """
+  path = os.path.join(TABLE_CACHE_DIR, f"{name}-v{TABLE_CACHE_VERSION}-{'-'.join(map(str, key))}.npy")
+  try:
+    return np.load(path, mmap_mode="r").view(np.ndarray)
+  except (OSError, ValueError): # not cached yet, or a damaged file which is replaced
+    pass
+  table = compute()
+  try:
+    os.makedirs(TABLE_CACHE_DIR, exist_ok=True)
+    # written under a temporary name first, so a concurrent start never maps a half written file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+      np.save(f, table)
+    os.replace(temp_path, path)
+  except OSError: # e.g. a read-only directory, the table is just not cached
+    pass
+  table.setflags(write=False)
+  return table
+
+def periodic_hann(size):
+  """
+  Periodic hann window, the spectrum of a window multiplied by it is the spectrum of the window mixed with the
+  neighbouring bins, which lets the sliding DFT apply it to its spectrum. Every spectrum uses this window, so
+  the spectrum engines agree
+  Parameters:
+    size (int): window size in samples
+  Returns:
+    window (np.ndarray): 0.5 - 0.5cos(2pi n/size)
+  """
+  return 0.5 - 0.5*np.cos(2*np.pi / size * np.arange(size))
+
+@functools.lru_cache(maxsize=DSP_TABLE_CACHE_SIZE)
+def get_band_tables(sample_freq, window_size):
+  """
+  Precomputes the bin indices used by the mains hum suppression and the octave band whitening
+  Parameters:
+    sample_freq (int): sample frequency in Hz
+    window_size (int): window size of the DFT in samples
+  Returns:
+    hum_end (int): every bin below this index is set to zero
+    band_edges (tuple): (ind_start, ind_end) of every non-empty octave band
+    band_of_bin (np.ndarray): band number of every bin between the first and the last band edge
+  """
+  delta_freq = sample_freq / window_size
+  spec_len = window_size // 2
+  hum_end = min(int(62/delta_freq), spec_len)
+
+  band_edges = []
+  for j in range(len(OCTAVE_BANDS)-1):
+    ind_start = int(OCTAVE_BANDS[j]/delta_freq)
+    ind_end = min(int(OCTAVE_BANDS[j+1]/delta_freq), spec_len)
+    if ind_end > ind_start:
+      band_edges.append((ind_start, ind_end))
+
+  band_of_bin = cached_table("band_of_bin", lambda: np.repeat(np.arange(len(band_edges)),
+                            [ind_end-ind_start for ind_start, ind_end in band_edges]), sample_freq, window_size)
+  return hum_end, tuple(band_edges), band_of_bin
+
+def suppress_noise(magnitude_spec, sample_freq=SAMPLE_FREQ, window_size=WINDOW_SIZE, white_noise_thresh=WHITE_NOISE_THRESH,
+                   scratch=None):
+  """
+  Suppresses mains hum and everything under white_noise_thresh*avg_energy_per_freq of its octave band, in place
+  Parameters:
+    magnitude_spec (np.ndarray): magnitude spectrum with window_size//2 bins, or one spectrum per row
+    sample_freq (int): sample frequency in Hz
+    window_size (int): window size of the DFT in samples
+    white_noise_thresh (float): threshold relative to the average energy per frequency of each band
+    scratch (SpectrumScratch): buffers for a matrix of spectrums, without them the temporaries are allocated
+  Returns:
+    magnitude_spec (np.ndarray): the same array
+  """
+  hum_end, band_edges, band_of_bin = get_band_tables(sample_freq, window_size)
+
+  # supress mains hum, set everything below 62Hz to zero
+  magnitude_spec[..., :hum_end] = 0
+  if not band_edges:
+    return magnitude_spec
+
+  # calculate average energy per frequency for the octave bands
+  # and suppress everything below it
+  if scratch is None:
+    thresholds = np.empty(magnitude_spec.shape[:-1] + (len(band_edges),), dtype=magnitude_spec.dtype)
+    band_energy = None
+  else:
+    thresholds, band_energy = scratch.band_thresholds, scratch.band_energy
+  for j, (ind_start, ind_end) in enumerate(band_edges):
+    band = magnitude_spec[..., ind_start:ind_end]
+    avg_energy_per_freq = np.einsum("...i,...i->...", band, band, out=band_energy) / (ind_end-ind_start)
+    thresholds[..., j] = white_noise_thresh*avg_energy_per_freq**0.5
+  band_spec = magnitude_spec[..., band_edges[0][0]:band_edges[-1][1]]
+  if scratch is None:
+    band_spec[~(band_spec > thresholds[..., band_of_bin])] = 0
+    return magnitude_spec
+  # the same cut band by band without temporaries, bins that are not above their threshold (also nan) are cut
+  for j, (ind_start, ind_end) in enumerate(band_edges):
+    is_cut = scratch.is_cut[..., ind_start-band_edges[0][0]:ind_end-band_edges[0][0]]
+    np.greater(magnitude_spec[..., ind_start:ind_end], thresholds[..., j:j+1], out=is_cut)
+  np.logical_not(scratch.is_cut, out=scratch.is_cut)
+  np.copyto(band_spec, 0, where=scratch.is_cut)
+  return magnitude_spec
+
+DSPTables = collections.namedtuple("DSPTables", ["hann_window", "hum_end", "band_edges", "band_of_bin", "ipol_grid"])
+
+@functools.lru_cache(maxsize=DSP_TABLE_CACHE_SIZE)
+def get_dsp_tables(sample_freq, window_size, num_hps):
+  """
+  Precomputes every table a detector needs for one configuration, the last DSP_TABLE_CACHE_SIZE
+  configurations are cached so switching between them is instant
+  Parameters:
+    sample_freq (int): sample frequency in Hz
+    window_size (int): window size of the DFT in samples
+    num_hps (int): max number of harmonic product spectrums
+  Returns:
+    tables (DSPTables): hann window, band tables (see get_band_tables) and the interpolation grid of interpolate_spectrum
+  """
+  hann_window = cached_table("hann_window", lambda: periodic_hann(window_size), window_size)
+  hum_end, band_edges, band_of_bin = get_band_tables(sample_freq, window_size)
+  spec_len = window_size // 2
+  ipol_grid = (cached_table("ipol_grid", lambda: np.arange(0, spec_len, 1/num_hps), window_size, num_hps),
+               cached_table("ipol_bins", lambda: np.arange(0, spec_len), window_size))
+  return DSPTables(hann_window, hum_end, band_edges, band_of_bin, ipol_grid)
+
+class SpectrumScratch:
+  """
+  Preallocated buffers of suppress_noise and find_hps_pitch for one matrix of spectrums, so the whitening
+  and the harmonic product spectrum of a hop write into the same memory on every hop
+  """
+  def __init__(self, tables, channels, spec_len, num_hps=NUM_HPS, peak_refinement=PEAK_REFINEMENT, precision=PRECISION):
+    dtype = np.dtype(precision)
+    band_len = tables.band_edges[-1][1] - tables.band_edges[0][0] if tables.band_edges else 0
+    self.band_energy = np.empty(channels, dtype=dtype)
+    self.band_thresholds = np.empty((channels, len(tables.band_edges)), dtype=dtype)
+    self.is_cut = np.empty((channels, band_len), dtype=bool)
+    self.norms = np.empty(channels, dtype=dtype)
+    hps_len = spec_len
+    if peak_refinement == "interpolate":
+      hps_len = spec_len * num_hps
+      self.slope = np.empty((channels, spec_len), dtype=dtype)
+      self.ipol_steps = (np.arange(num_hps) / num_hps).astype(dtype)
+    self.normalized = np.empty((channels, hps_len), dtype=dtype)
+    # the products of the harmonic product spectrum alternate between two buffers
+    self.products = (np.empty((channels, hps_len), dtype=dtype), np.empty((channels, hps_len), dtype=dtype))
+    self.decimated = np.empty((channels, (hps_len+1) // 2), dtype=dtype)
+
+FFT_WORKERS_MIN_SIZE = 16384 # below this window size the thread overhead outweighs the gain of extra workers
+# scipy is imported where it is used, it takes longer to import than numpy and the rest of the module together
+
+# every backend is called as fft(samples, workers, out), out is a preallocated buffer for the spectrum
+# which only the numpy backend can write into, the others return a new array. FFTEngine runs the scipy
+# backend through a PackedRealFFT instead, and numpy in double precision, so neither allocates on a hop
+
+def scipy_rfft(samples, workers, out=None):
+  import scipy.fft
+  return scipy.fft.rfft(samples, workers=workers, overwrite_x=True)
+
+# numpy.fft only takes out from numpy 2.0 on, older versions return a new spectrum that is copied into out
+NUMPY_FFT_HAS_OUT = int(np.__version__.split(".")[0]) >= 2
+
+def numpy_rfft(samples, workers, out=None):
+  if NUMPY_FFT_HAS_OUT or out is None:
+    return np.fft.rfft(samples, out=out)
+  out[...] = np.fft.rfft(samples)
+  return out
+
+def fftpack_fft(samples, workers, out=None):
+  import scipy.fftpack
+  return scipy.fftpack.fft(samples) # complex transform, kept as reference
+
+FFT_BACKENDS = {
+  "scipy": scipy_rfft,
+  "numpy": numpy_rfft,
+  "fftpack": fftpack_fft
+}
+
+class PackedRealFFT:
+  """
+  Real FFT of an even number of samples as a complex FFT of half the length. The even samples are the real
+  and the odd samples the imaginary parts, and the spectrums of both halves are separated again with their
+  conjugate symmetry. scipy's real transform returns a new spectrum on every call, its complex transform
+  with overwrite_x works in place, so the whole transform runs in preallocated buffers
+  """
+  def __init__(self, window_size, channels=1, precision=PRECISION):
+    import scipy.fft
+    self.fft = scipy.fft.fft
+    self.num_bins = window_size // 2
+    complex_dtype = np.result_type(precision, np.complex64)
+    self.packed = np.empty((channels, self.num_bins), dtype=complex_dtype)
+    self.mirrored = np.empty((channels, self.num_bins), dtype=complex_dtype) # conj(Z[-k]) of the packed spectrum Z
+    self.odd = np.empty((channels, self.num_bins), dtype=complex_dtype)
+    self.twiddles = (-0.5j * np.exp(-2j*np.pi * np.arange(self.num_bins) / window_size)).astype(complex_dtype)
+
+  def __call__(self, samples, workers, out):
+    """
+    Called like the FFT_BACKENDS
+    Parameters:
+      samples (np.ndarray): C-contiguous samples, one row of window_size samples per channel
+      workers (int): number of threads of the transform
+      out (np.ndarray): complex buffer of window_size//2 + 1 bins per row the spectrum is written into
+    Returns:
+      out (np.ndarray): the spectrum
+    """
+    np.copyto(self.packed, samples.view(self.packed.dtype))
+    spectrum = self.fft(self.packed, workers=workers, overwrite_x=True)
+    np.conjugate(spectrum[:, :1], out=self.mirrored[:, :1])
+    np.conjugate(spectrum[:, :0:-1], out=self.mirrored[:, 1:])
+    # spectrum of the odd samples, shifted by their offset of one sample
+    np.subtract(spectrum, self.mirrored, out=self.odd)
+    np.multiply(self.odd, self.twiddles, out=self.odd)
+    # plus the spectrum of the even samples
+    even = out[:, :self.num_bins]
+    np.add(spectrum, self.mirrored, out=even)
+    np.multiply(even, 0.5, out=even)
+    np.add(even, self.odd, out=even)
+    np.subtract(spectrum[:, 0].real, spectrum[:, 0].imag, out=out[:, self.num_bins].real)
+    out[:, self.num_bins].imag = 0.0
+    return out
+
+class FFTEngine:
+  """
+  Computes the magnitude spectrum of a real signal, or of several channels in one batched transform,
+  with one of the FFT_BACKENDS, reusing its hann window and scratch buffers across hops
+  """
+  def __init__(self, window_size=WINDOW_SIZE, backend=FFT_BACKEND, precision=PRECISION, workers=FFT_WORKERS, hann_window=None,
+               channels=1):
+    if backend not in FFT_BACKENDS:
+      raise ValueError(f"Unknown FFT backend: {backend}")
+    self.window_size = window_size
+    self.backend = backend
+    self.dtype = np.dtype(precision)
+    self.workers = workers if window_size >= FFT_WORKERS_MIN_SIZE else 1
+    self.fft = FFT_BACKENDS[backend]
+    self.fft(np.zeros(2), 1) # imports the backend now instead of on the first hop
+    if backend == "scipy" and window_size % 2 == 0:
+      self.fft = PackedRealFFT(window_size, channels, self.dtype)
+    # numpy transforms in double precision whatever the samples, it only writes into out without a
+    # temporary copy when it gets double precision
+    transform_dtype = np.dtype(np.float64) if backend == "numpy" else self.dtype
+    self.hann_window = (periodic_hann(window_size) if hann_window is None else hann_window).astype(transform_dtype)
+    self.hann_samples = np.empty((channels, window_size), dtype=transform_dtype)
+    self.spectrum = np.empty((channels, window_size // 2 + 1), dtype=np.result_type(transform_dtype, np.complex64))
+    self.magnitude_spec = np.empty((channels, window_size // 2), dtype=self.dtype)
+    # magnitudes of a transform in another precision, copied into magnitude_spec
+    self.transform_magnitude = None if transform_dtype == self.dtype else np.empty((channels, window_size // 2), dtype=transform_dtype)
+
+  def magnitude_spectrum(self, samples):
+    """
+    Applies the hann window and returns the magnitude of the first window_size//2 bins
+    Parameters:
+      samples (np.ndarray): window_size samples, or one row of window_size samples per channel
+    Returns:
+      magnitude_spec (np.ndarray): scratch buffer holding the spectrum of every row, overwritten on the next call
+    """
+    # avoid spectral leakage by multiplying the signal with a hann window, samples of another precision
+    # are converted first, a mixed multiplication would buffer the conversion
+    if samples.dtype == self.hann_samples.dtype:
+      np.multiply(samples, self.hann_window, out=self.hann_samples)
+    else:
+      np.copyto(self.hann_samples, samples)
+      np.multiply(self.hann_samples, self.hann_window, out=self.hann_samples)
+    spectrum = self.fft(self.hann_samples, self.workers, self.spectrum)
+    if self.transform_magnitude is None:
+      np.abs(spectrum[..., :self.window_size // 2], out=self.magnitude_spec)
     else:
-        callback.is_note_still_playing = False
+      np.abs(spectrum[..., :self.window_size // 2], out=self.transform_magnitude)
+      np.copyto(self.magnitude_spec, self.transform_magnitude)
+    return self.magnitude_spec[0] if samples.ndim == 1 else self.magnitude_spec
 
+SPECTRUM_ENGINES = ("fft", "sliding_dft")
+SLIDING_DFT_MAX_HOP = 480 # longer writes always recompute the sliding DFT with one FFT
+# time of sliding one twiddle in operations of the FFT per precision, measured with benchmark.py. Sliding streams
+# the twiddle table from memory, in double precision it is twice as large
+SLIDING_DFT_TWIDDLE_COST = {"float32": 1.1, "float64": 1.5}
 
-    # skip if signal power is too low
-    signal_power = (np.linalg.norm(callback.window_samples, ord=2)**2) / len(callback.window_samples)
-    if signal_power < POWER_THRESH:
-      os.system('cls' if os.name=='nt' else 'clear')
-      print("Closest note: ...")
-      detection_callback(None)
+class SlidingDFTEngine:
+  """
+  Keeps the spectrum of the window up to date while samples are written to the ring buffer of a PitchDetector,
+  so a short hop costs in proportion to its length and the tracked bins instead of a whole FFT. Only the bins up
+  to max_freq are tracked, the bins above come out as zero. Writing L samples removes the L oldest ones, so every
+  bin k gains the DFT of written minus evicted samples and is then shifted by W^(-kL). The hann window is
+  applied in the frequency domain. Hops longer than max_hop, where sliding would cost more than the FFT,
+  are handed to an FFTEngine until a short write resyncs the tracked spectrum
+  """
+  def __init__(self, window_size=WINDOW_SIZE, sample_freq=SAMPLE_FREQ, max_freq=SLIDING_DFT_MAX_FREQ,
+               max_hop=SLIDING_DFT_MAX_HOP, backend=FFT_BACKEND, precision=PRECISION, workers=FFT_WORKERS,
+               hann_window=None, channels=1):
+    self.window_size = window_size
+    self.fft_engine = FFTEngine(window_size, backend, precision, workers, hann_window, channels)
+    self.dtype = self.fft_engine.dtype
+    complex_dtype = np.result_type(self.dtype, np.complex64)
+    self.num_bins = min(int(np.ceil(max_freq * window_size / sample_freq)) + 2, window_size // 2 + 1)
+    self.bins = np.arange(self.num_bins)
+    # sliding a write of length L takes L*num_bins twiddles through one matrix product, the FFT of the window
+    # about window_size*log2(window_size) operations. Longer writes are left to the FFT, which is cheaper then
+    fft_cost = window_size * np.log2(window_size) / SLIDING_DFT_TWIDDLE_COST[self.dtype.name]
+    self.max_hop = max(1, min(max_hop, SLIDING_DFT_MAX_HOP, int(fft_cost / self.num_bins)))
+    # W^(km) with the real and imaginary parts side by side, so the real samples go through a real matrix
+    # product whose result is already the complex spectrum
+    twiddles = np.exp(-2j*np.pi / window_size * np.outer(np.arange(self.max_hop), self.bins)).astype(complex_dtype)
+    self.twiddle_table = twiddles.view(self.dtype)
+    self.shifts = {} # length of a write -> W^(-k*length)
+    # the tracked spectrum collects the rounding errors of every update until the next resync, which happens
+    # at least once per turn of the ring buffer. In single precision they reach about 4e-5 of the peak by then
+    self.spectrum = np.zeros((channels, self.num_bins), dtype=complex_dtype)
+    self.needs_resync = True # set when the spectrum has to be recomputed with resync
+    self.magnitude_spec = np.zeros((channels, window_size // 2), dtype=self.dtype)
+    # scratch buffers of update and magnitude_spectrum
+    self.delta = np.empty((channels, self.max_hop), dtype=self.dtype)
+    self.spectrum_delta = np.empty((channels, 2*self.num_bins), dtype=self.dtype)
+    self.windowed = np.empty((channels, self.num_bins - 1), dtype=complex_dtype)
+    self.neighbours = np.empty((channels, self.num_bins - 2), dtype=complex_dtype)
+    # buffers of resync
+    self.resync_samples = np.empty((channels, window_size), dtype=self.dtype)
+    self.resync_spectrum = np.empty((channels, window_size // 2 + 1), dtype=complex_dtype)
+    self.rfft = PackedRealFFT(window_size, channels, self.dtype) if window_size % 2 == 0 else None
+
+  def update(self, written, evicted):
+    """
+    Slides the tracked spectrum over a write to the ring buffer
+    Parameters:
+      written (np.ndarray): samples written to the ring buffer, one row per channel
+      evicted (np.ndarray): samples they replace
+    """
+    length = written.shape[-1]
+    if self.needs_resync:
       return
+    if length > self.max_hop:
+      self.needs_resync = True
+      return
+    shift = self.shifts.get(length)
+    if shift is None:
+      shift = self.shifts[length] = np.exp(2j*np.pi / self.window_size * length * self.bins).astype(self.spectrum.dtype)
+    delta = np.subtract(written, evicted, out=self.delta[:, :length])
+    spectrum_delta = np.matmul(delta, self.twiddle_table[:length], out=self.spectrum_delta)
+    self.spectrum += spectrum_delta.view(self.spectrum.dtype)
+    self.spectrum *= shift
 
-    # avoid spectral leakage by multiplying the signal with a hann window
-    hann_samples = callback.window_samples * HANN_WINDOW
-    magnitude_spec = abs(scipy.fftpack.fft(hann_samples)[:len(hann_samples)//2])
-
-    # supress mains hum, set everything below 62Hz to zero
-    for i in range(int(62/DELTA_FREQ)):
-      magnitude_spec[i] = 0
-
-    # calculate average energy per frequency for the octave bands
-    # and suppress everything below it
-    for j in range(len(OCTAVE_BANDS)-1):
-      ind_start = int(OCTAVE_BANDS[j]/DELTA_FREQ)
-      ind_end = int(OCTAVE_BANDS[j+1]/DELTA_FREQ)
-      ind_end = ind_end if len(magnitude_spec) > ind_end else len(magnitude_spec)
-      avg_energy_per_freq = (np.linalg.norm(magnitude_spec[ind_start:ind_end], ord=2)**2) / (ind_end-ind_start)
-      avg_energy_per_freq = avg_energy_per_freq**0.5
-      for i in range(ind_start, ind_end):
-        magnitude_spec[i] = magnitude_spec[i] if magnitude_spec[i] > WHITE_NOISE_THRESH*avg_energy_per_freq else 0
+  def resync(self, window_samples):
+    """
+    Recomputes the tracked spectrum, which also clears the rounding errors of the updates
+    Parameters:
+      window_samples (np.ndarray): the window in chronological order, one row per channel
+    """
+    if self.rfft is None:
+      import scipy.fft
+      self.spectrum[:] = scipy.fft.rfft(window_samples, axis=-1)[:, :self.num_bins]
+    else:
+      np.copyto(self.resync_samples, window_samples)
+      self.spectrum[:] = self.rfft(self.resync_samples, 1, self.resync_spectrum)[:, :self.num_bins]
+    self.needs_resync = False
 
-    # interpolate spectrum
-    mag_spec_ipol = np.interp(np.arange(0, len(magnitude_spec), 1/NUM_HPS), np.arange(0, len(magnitude_spec)),
-                              magnitude_spec)
-    mag_spec_ipol = mag_spec_ipol / np.linalg.norm(mag_spec_ipol, ord=2) #normalize it
+  def magnitude_spectrum(self, samples):
+    """
+    Returns the magnitude of the hann windowed spectrum of the window, like FFTEngine.magnitude_spectrum
+    Parameters:
+      samples (np.ndarray): the window, transformed by the FFTEngine while the tracked spectrum is out of date
+    Returns:
+      magnitude_spec (np.ndarray): scratch buffer holding the spectrum of every channel, overwritten on the next call
+    """
+    if self.needs_resync:
+      return self.fft_engine.magnitude_spectrum(samples)
+    # the periodic hann window multiplies the samples by 0.5 - 0.5cos, which mixes every bin with its neighbours
+    spectrum = self.spectrum
+    num_windowed = self.num_bins - 1
+    windowed = np.multiply(spectrum[:, :num_windowed], 0.5, out=self.windowed)
+    neighbours = np.add(spectrum[:, :num_windowed-1], spectrum[:, 2:], out=self.neighbours)
+    neighbours *= 0.25
+    windowed[:, 1:] -= neighbours
+    windowed[:, 0] -= 0.5*spectrum[:, 1].real # bin -1 is the conjugate of bin 1
+    np.abs(windowed, out=self.magnitude_spec[:, :num_windowed])
+    return self.magnitude_spec[0] if samples.ndim == 1 else self.magnitude_spec
 
-    hps_spec = copy.deepcopy(mag_spec_ipol)
+def max_decimate(spec, factor, out=None):
+  """
+  Downsamples a spectrum by taking the maximum of the bins around every factor-th bin
+  Parameters:
+    spec (np.ndarray): magnitude spectrum, or one spectrum per row
+    factor (int): downsampling factor
+    out (np.ndarray): buffer of the shape of spec[..., ::factor] the result is written to
+  Returns:
+    decimated_spec (np.ndarray): element k is the maximum of spec[k*factor-factor//2 : k*factor+factor//2+1]
+  """
+  if out is None:
+    decimated_spec = spec[..., ::factor].copy()
+  else:
+    decimated_spec = out
+    np.copyto(decimated_spec, spec[..., ::factor])
+  num_bins = decimated_spec.shape[-1]
+  for offset in range(1, factor//2+1):
+    right = spec[..., offset::factor]
+    num_right = right.shape[-1]
+    np.maximum(decimated_spec[..., :num_right], right, out=decimated_spec[..., :num_right])
+    left = spec[..., factor-offset::factor][..., :num_bins-1]
+    num_left = left.shape[-1]
+    np.maximum(decimated_spec[..., 1:num_left+1], left, out=decimated_spec[..., 1:num_left+1])
+  return decimated_spec
 
-    # calculate the HPS
-    for i in range(NUM_HPS):
-      tmp_hps_spec = np.multiply(hps_spec[:int(np.ceil(len(mag_spec_ipol)/(i+1)))], mag_spec_ipol[::(i+1)])
-      if not any(tmp_hps_spec):
+def find_hps_peak(spec, num_hps, use_max_decimate=False, scratch=None):
+  """
+  Calculates the harmonic product spectrum and finds its peak
+  Parameters:
+    spec (np.ndarray): normalized magnitude spectrum, or one spectrum per row
+    num_hps (int): max number of harmonic product spectrums
+    use_max_decimate (bool): downsample by taking the maximum of the neighbouring bins instead of every n-th bin,
+      so harmonics which fall between bins still line up with their fundamental
+    scratch (SpectrumScratch): buffers for the products of a matrix of spectrums
+  Returns:
+    max_ind (int or np.ndarray): index of the peak of the harmonic product spectrum
+    num_harmonics (int or np.ndarray): number of harmonics that went into the harmonic product spectrum
+  """
+  hps_spec = spec
+  num_harmonics = np.zeros(spec.shape[:-1], dtype=int)
+  max_ind = np.zeros(spec.shape[:-1], dtype=int)
+  is_active = np.ones(spec.shape[:-1], dtype=bool) # spectrums whose product hasn't vanished yet
+  for i in range(num_hps):
+    hps_len = int(np.ceil(spec.shape[-1]/(i+1)))
+    if use_max_decimate and i:
+      decimated_spec = max_decimate(spec, i+1, None if scratch is None else scratch.decimated[:, :hps_len])
+    else:
+      decimated_spec = spec[..., ::(i+1)]
+    out = None if scratch is None else scratch.products[i % 2][:, :hps_len]
+    tmp_hps_spec = np.multiply(hps_spec[..., :hps_len], decimated_spec, out=out)
+    # the products are not negative, the max of a vanished one is zero, unlike any it needs no cast to bool
+    has_vanished = is_active & (tmp_hps_spec.max(axis=-1) == 0)
+    if has_vanished.any():
+      max_ind[has_vanished] = np.argmax(hps_spec, axis=-1)[has_vanished]
+      is_active &= ~has_vanished
+      if not is_active.any():
         break
-      hps_spec = tmp_hps_spec
+    hps_spec = tmp_hps_spec
+    num_harmonics[is_active] = i+1
+  else:
+    max_ind[is_active] = np.argmax(hps_spec, axis=-1)[is_active]
+  if spec.ndim == 1:
+    return int(max_ind), int(num_harmonics)
+  return max_ind, num_harmonics
+
+def peak_offset(left, center, right, method="gaussian"):
+  """
+  Estimates the sub-bin offset of peaks by fitting a parabola through them and their neighbours
+  Parameters:
+    left (np.ndarray): magnitudes of the bins left of the peaks
+    center (np.ndarray): magnitudes of the peaks
+    right (np.ndarray): magnitudes of the bins right of the peaks
+    method (str): "parabolic" fits the magnitudes, "gaussian" fits their logarithm
+  Returns:
+    offset (np.ndarray): offset of the true peaks from their bins, zero where there is no local maximum
+  """
+  with np.errstate(divide="ignore", invalid="ignore"):
+    if method == "gaussian":
+      left, center, right = np.log(left), np.log(center), np.log(right)
+    curvature = left - 2*center + right
+    offset = 0.5*(left - right)/curvature
+  return np.where(curvature < 0, offset, 0.0)
+
+def refine_fundamental(magnitude_spec, fundamental_ind, num_harmonics, method="gaussian"):
+  """
+  Refines the fundamental found by the HPS by locating every harmonic that went into it
+  Parameters:
+    magnitude_spec (np.ndarray): magnitude spectrum at bin resolution, or one spectrum per row
+    fundamental_ind (int or np.ndarray): index of the HPS peak of every spectrum
+    num_harmonics (int or np.ndarray): number of harmonics that went into the HPS of every spectrum
+    method (str): peak refinement method, see peak_offset
+  Returns:
+    fundamental_ind (float or np.ndarray): refined index of the fundamental
+  """
+  spec = np.atleast_2d(magnitude_spec)
+  spec_len = spec.shape[-1]
+  rows = np.arange(len(spec))[:, None]
+  coarse_ind = np.broadcast_to(fundamental_ind, (len(spec),))
+  num_harmonics = np.maximum(np.broadcast_to(num_harmonics, (len(spec),)), 1)
+  harmonics = np.arange(1, int(num_harmonics.max())+1)
 
-    max_ind = np.argmax(hps_spec)
-    max_freq = max_ind * (SAMPLE_FREQ/WINDOW_SIZE) / NUM_HPS
+  # the true harmonic lies within one bin per harmonic number of the coarse estimate,
+  # search all harmonics at once in rows of 2*max_harmonic+1 bins padded with -inf
+  offsets = np.arange(2*harmonics[-1]+1)
+  search_ind = harmonics[:, None]*(coarse_ind[:, None, None]-1) + offsets
+  is_searched = (offsets <= 2*harmonics[:, None]) & (search_ind >= 0) & (search_ind < spec_len)
+  search_ind = np.clip(search_ind, 0, spec_len-1)
+  candidates = np.where(is_searched, spec[rows[..., None], search_ind], -np.inf)
+  peak_ind = np.take_along_axis(search_ind, np.argmax(candidates, axis=-1)[..., None], axis=-1)[..., 0]
 
-    closest_note, closest_pitch = find_closest_note(max_freq)
-    max_freq = round(max_freq, 1)
-    closest_pitch = round(closest_pitch, 1)
+  # harmonics cut off by the noise suppression are skipped, their shape can't be trusted
+  left = spec[rows, np.maximum(peak_ind-1, 0)]
+  center = spec[rows, peak_ind]
+  right = spec[rows, np.minimum(peak_ind+1, spec_len-1)]
+  is_valid = ((harmonics <= num_harmonics[:, None]) & (peak_ind > 0) & (peak_ind < spec_len-1)
+              & (left > 0) & (center > 0) & (right > 0))
+  estimates = np.where(is_valid, (peak_ind + peak_offset(left, center, right, method)) / harmonics, 0.0)
+  weights = np.where(is_valid, center, 0.0)
 
-    callback.noteBuffer.insert(0, closest_note) # note that this is a ringbuffer
-    callback.noteBuffer.pop()
+  weight_sum = weights.sum(axis=-1)
+  has_estimate = weight_sum > 0
+  refined_ind = np.where(has_estimate, (weights*estimates).sum(axis=-1) / np.where(has_estimate, weight_sum, 1), coarse_ind)
+  if np.ndim(magnitude_spec) == 1:
+    return float(refined_ind[0])
+  return refined_ind
 
-    os.system('cls' if os.name=='nt' else 'clear')
-    if callback.noteBuffer.count(callback.noteBuffer[0]) == len(callback.noteBuffer):
-      print(f"Closest note: {closest_note} {max_freq}/{closest_pitch}")
-      if is_new_note:
-        print("New note detected")
-      detection_callback(closest_note, is_new_note)
-    else:
-      print(f"Closest note: ...")
-      detection_callback(None)
+def interpolate_spectrum(spec, num_hps, ipol_grid=None, scratch=None):
+  """
+  Linearly interpolates a spectrum to num_hps times its resolution
+  Parameters:
+    spec (np.ndarray): magnitude spectrum, or one spectrum per row
+    num_hps (int): interpolation factor
+    ipol_grid (tuple): precomputed (positions, bins) of the interpolation, see get_dsp_tables
+    scratch (SpectrumScratch): buffers of an "interpolate" estimator, the result is written to scratch.normalized
+  Returns:
+    mag_spec_ipol (np.ndarray): interpolated spectrum
+  """
+  if spec.ndim == 1:
+    positions, bins = ipol_grid or (np.arange(0, len(spec), 1/num_hps), np.arange(0, len(spec)))
+    return np.interp(positions, bins, spec)
+  # every bin is followed by num_hps-1 points on the line to the next bin, the last bin is held
+  if scratch is None:
+    slope = np.diff(spec, axis=-1, append=spec[..., -1:])
+    mag_spec_ipol = spec[..., None] + slope[..., None]*(np.arange(num_hps)/num_hps)
+    return mag_spec_ipol.reshape(spec.shape[:-1] + (-1,))
+  slope = scratch.slope
+  np.subtract(spec[..., 1:], spec[..., :-1], out=slope[..., :-1])
+  slope[..., -1] = 0
+  mag_spec_ipol = scratch.normalized.reshape(spec.shape + (num_hps,))
+  # one step of every bin at a time, broadcasting over the short last axis would make numpy buffer the operands
+  for step in range(num_hps):
+    points = mag_spec_ipol[..., step]
+    np.multiply(slope, scratch.ipol_steps[step], out=points)
+    np.add(points, spec, out=points)
+  return scratch.normalized
+
+def normalize(spec, scratch=None):
+  """
+  Scales a spectrum, or every row of a matrix of spectrums, to unit length. With a SpectrumScratch the
+  result is written to scratch.normalized
+  """
+  if scratch is not None:
+    norms = np.einsum("ij,ij->i", spec, spec, out=scratch.norms)
+    np.sqrt(norms, out=norms)
+    return np.divide(spec, norms[:, np.newaxis], out=scratch.normalized[:, :spec.shape[-1]])
+  if spec.ndim == 1:
+    return spec / np.linalg.norm(spec, ord=2)
+  return spec / np.linalg.norm(spec, ord=2, axis=-1, keepdims=True)
+
+def find_hps_pitch(magnitude_spec, sample_freq=SAMPLE_FREQ, window_size=WINDOW_SIZE, num_hps=NUM_HPS, peak_refinement=PEAK_REFINEMENT,
+                   timer=NULL_TIMER, ipol_grid=None, scratch=None):
+  """
+  Finds the fundamental frequency of a whitened magnitude spectrum with the harmonic product spectrum
+  Parameters:
+    magnitude_spec (np.ndarray): magnitude spectrum with window_size//2 bins, or one spectrum per row
+    sample_freq (int): sample frequency in Hz
+    window_size (int): window size of the DFT in samples
+    num_hps (int): max number of harmonic product spectrums
+    peak_refinement (str): one of PEAK_REFINEMENTS
+    timer (metrics.StageTimer): records the interpolation, hps and peak_refinement stages
+    ipol_grid (tuple): precomputed interpolation grid, see interpolate_spectrum
+    scratch (SpectrumScratch): buffers for a matrix of spectrums, without them the temporaries are allocated
+  Returns:
+    max_freq (float or np.ndarray): fundamental frequency in hertz
+  """
+  delta_freq = sample_freq / window_size
+  if peak_refinement == "interpolate":
+    # interpolate spectrum
+    mag_spec_ipol = normalize(interpolate_spectrum(magnitude_spec, num_hps, ipol_grid, scratch), scratch)
+    timer.lap("interpolation")
+    max_ind, _ = find_hps_peak(mag_spec_ipol, num_hps, scratch=scratch)
+    timer.lap("hps")
+    return max_ind * delta_freq / num_hps
+
+  if peak_refinement not in PEAK_REFINEMENTS:
+    raise ValueError(f"Unknown peak refinement: {peak_refinement}")
+  max_ind, num_harmonics = find_hps_peak(normalize(magnitude_spec, scratch), num_hps, use_max_decimate=True, scratch=scratch)
+  timer.lap("hps")
+  max_ind = refine_fundamental(magnitude_spec, max_ind, num_harmonics, peak_refinement)
+  timer.lap("peak_refinement")
+  return max_ind * delta_freq
 
+def harmonic_confidence(magnitude_spec, fundamental_freq, sample_freq, window_size, num_harmonics):
+  """
+  Measures how well a fundamental explains a whitened magnitude spectrum
+  Parameters:
+    magnitude_spec (np.ndarray): magnitude spectrum with window_size//2 bins
+    fundamental_freq (float): fundamental frequency in hertz
+    sample_freq (int): sample frequency in Hz
+    window_size (int): window size of the DFT in samples
+    num_harmonics (int): number of harmonics taken into account
+  Returns:
+    confidence (float): share of the spectral energy within one bin of the first num_harmonics harmonics
+  """
+  harmonic_bins = fundamental_freq * window_size / sample_freq * np.arange(1, num_harmonics+1)
+  harmonic_bins = np.rint(harmonic_bins[harmonic_bins < len(magnitude_spec) - 2]).astype(int)
+  total_energy = np.dot(magnitude_spec, magnitude_spec)
+  if not len(harmonic_bins) or not total_energy > 0:
+    return 0.0
+  # only the bins around the harmonics are gathered, the energy of the whole spectrum is never materialized
+  harmonic_spec = magnitude_spec[np.concatenate((harmonic_bins-1, harmonic_bins, harmonic_bins+1))]
+  return float(np.dot(harmonic_spec, harmonic_spec) / total_energy)
+
+def hps_prominence(magnitude_spec, fundamental_freq, sample_freq, window_size, num_harmonics):
+  """
+  Measures how clearly the harmonic product spectrum prefers a fundamental over its octave competitors,
+  the harmonic product is only evaluated at their harmonics instead of over the whole spectrum
+  Parameters:
+    magnitude_spec (np.ndarray): magnitude spectrum with window_size//2 bins
+    fundamental_freq (float): fundamental frequency in hertz
+    sample_freq (int): sample frequency in Hz
+    window_size (int): window size of the DFT in samples
+    num_harmonics (int): number of harmonics in the product
+  Returns:
+    prominence (float): 1 - product of the strongest competitor / product of the fundamental, 0 if the
+      fundamental has no harmonic product
+  """
+  fundamental_bin = fundamental_freq * window_size / sample_freq
+  candidate_bins = fundamental_bin * np.array([1, 1/2, 1/3, 2])[:, np.newaxis] * np.arange(1, num_harmonics+1)
+  candidate_bins = np.rint(candidate_bins).astype(int)
+  # harmonics above the spectrum count as missing, so a competitor an octave up can't hide them
+  harmonics = np.where(candidate_bins < len(magnitude_spec), magnitude_spec[np.minimum(candidate_bins, len(magnitude_spec)-1)], 0.0)
+  scale = harmonics.max()
+  if not scale > 0:
+    return 0.0
+  products = np.prod(harmonics / scale, axis=1) # scaled, so the products of many harmonics don't underflow
+  if not products[0] > 0:
+    return 0.0
+  return float(max(0.0, 1 - products[1:].max() / products[0]))
 
+def hps_confidence(magnitude_spec, fundamental_freq, sample_freq, window_size, num_harmonics):
+  """
+  Confidence of a harmonic product spectrum result between 0 and 1, the product of how much of the
+  spectrum its harmonics explain (harmonic_confidence) and how clearly it beats its octaves (hps_prominence)
+  """
+  return (harmonic_confidence(magnitude_spec, fundamental_freq, sample_freq, window_size, num_harmonics)
+          * hps_prominence(magnitude_spec, fundamental_freq, sample_freq, window_size, num_harmonics))
+
+def min_resolved_freq(sample_freq, window_size):
+  """
+  Returns the lowest frequency in hertz at which neighbouring notes are MIN_BINS_PER_SEMITONE bins apart
+  """
+  return MIN_BINS_PER_SEMITONE * sample_freq / window_size / (2**(1/12) - 1)
+
+# shorter window of a multi-resolution HPSEstimator, trusted for results of at least min_freq hertz
+Resolution = collections.namedtuple("Resolution", ["window_size", "tables", "fft_engine", "min_freq", "scratch"])
+
+def yin_difference(samples, max_lag):
+  """
+  Computes the difference function of YIN with one FFT cross-correlation
+  Parameters:
+    samples (np.ndarray): 1-D array of at least 2*max_lag samples, the first len(samples)-max_lag are the integration window
+    max_lag (int): number of lags
+  Returns:
+    difference (np.ndarray): squared difference between the integration window and its copy shifted by every lag
+  """
+  import scipy.fft
+  window = len(samples) - max_lag
+  n = scipy.fft.next_fast_len(len(samples) + window, real=True)
+  cross_spec = scipy.fft.rfft(samples, n) * np.conj(scipy.fft.rfft(samples[:window], n))
+  correlation = scipy.fft.irfft(cross_spec, n)[:max_lag]
+  energy = np.concatenate(([0.0], np.cumsum(samples**2)))
+  return energy[window] + energy[window:window+max_lag] - energy[:max_lag] - 2*correlation
+
+def find_yin_lag(samples, min_lag, max_lag):
+  """
+  Finds the period of a signal with YIN (de Cheveigné and Kawahara, 2002)
+  Parameters:
+    samples (np.ndarray): 1-D array of 2*max_lag samples
+    min_lag (int): shortest period in samples
+    max_lag (int): longest period in samples
+  Returns:
+    lag (float): period in samples, None if the signal is not periodic
+  """
+  difference = yin_difference(samples, max_lag)
+  cumulative = np.cumsum(difference[1:])
+  normalized = np.ones(max_lag)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    normalized[1:] = np.where(cumulative > 0, difference[1:] * np.arange(1, max_lag) / cumulative, 1.0)
+
+  below_thresh = np.flatnonzero(normalized[min_lag:max_lag-1] < YIN_THRESH)
+  if len(below_thresh):
+    # walk down from the first lag below the threshold to the bottom of its dip
+    lag = below_thresh[0] + min_lag
+    rising = np.flatnonzero(np.diff(normalized[lag:]) >= 0)
+    lag += rising[0] if len(rising) else 0
   else:
-    pass
\ No newline at end of file
+    lag = np.argmin(normalized[min_lag:max_lag-1]) + min_lag
+    if normalized[lag] > YIN_MAX_APERIODICITY:
+      return None
+  if lag >= max_lag - 1:
+    return None
+  return lag + float(peak_offset(-normalized[lag-1], -normalized[lag], -normalized[lag+1], "parabolic"))
+
+def normalized_square_difference(samples, max_lag):
+  """
+  Computes the normalized square difference function (NSDF) of McLeod with one FFT autocorrelation
+  Parameters:
+    samples (np.ndarray): 1-D array of samples
+    max_lag (int): number of lags
+  Returns:
+    nsdf (np.ndarray): NSDF for every lag, between -1 and 1
+  """
+  import scipy.fft
+  n = len(samples)
+  size = scipy.fft.next_fast_len(2*n, real=True)
+  spec = scipy.fft.rfft(samples, size)
+  autocorrelation = scipy.fft.irfft(spec.real**2 + spec.imag**2, size)[:max_lag]
+  energy = np.concatenate(([0.0], np.cumsum(samples**2)))
+  lags = np.arange(max_lag)
+  total_energy = energy[n-lags] + energy[n] - energy[lags]
+  with np.errstate(divide="ignore", invalid="ignore"):
+    return np.where(total_energy > 0, 2*autocorrelation / total_energy, 0.0)
+
+def find_mcleod_lag(samples, min_lag, max_lag):
+  """
+  Finds the period of a signal with the McLeod pitch method (McLeod and Wyvill, 2005)
+  Parameters:
+    samples (np.ndarray): 1-D array of 2*max_lag samples
+    min_lag (int): shortest period in samples
+    max_lag (int): longest period in samples
+  Returns:
+    lag (float): period in samples, None if the signal is not periodic
+  """
+  nsdf = normalized_square_difference(samples, max_lag)
+  # the key maxima are the maxima after the NSDF first drops below zero
+  non_positive = np.flatnonzero(nsdf <= 0)
+  if not len(non_positive):
+    return None
+  start = max(non_positive[0], min_lag, 1)
+  center, left, right = nsdf[start:-1], nsdf[start-1:-2], nsdf[start+1:]
+  maxima = np.flatnonzero((center > left) & (center >= right) & (center > 0))
+  if not len(maxima) or center[maxima].max() < MCLEOD_MIN_CLARITY:
+    return None
+  lag = maxima[np.argmax(center[maxima] >= MCLEOD_K * center[maxima].max())] + start
+  return lag + float(peak_offset(nsdf[lag-1], nsdf[lag], nsdf[lag+1], "parabolic"))
+
+ANALYSIS_BATCH_SAMPLES = 2**18 # batches larger than this fall out of the cpu cache and get slower again
+ANALYSIS_DTYPE = np.dtype([("time", np.float64), ("frequency", np.float32), ("note", np.int16), ("power", np.float32)])
+
+def analyze(samples, sample_rate, window_size=WINDOW_SIZE, window_step=WINDOW_STEP, num_hps=NUM_HPS,
+            power_thresh=POWER_THRESH, white_noise_thresh=WHITE_NOISE_THRESH, peak_refinement=PEAK_REFINEMENT,
+            concert_pitch=CONCERT_PITCH, min_freq=MIN_FREQ, batch_size=None):
+  """
+  Runs the pitch detection over a whole recording, processing batch_size hops at once as matrices
+  Parameters:
+    samples (np.ndarray): the recording, multi-channel recordings are analyzed on their first channel
+    sample_rate (int): sample frequency of the recording in Hz
+    window_size (int): window size of the DFT in samples
+    window_step (int): step size of window
+    num_hps (int): max number of harmonic product spectrums
+    power_thresh (float): hops with a lower signal power are not analyzed
+    white_noise_thresh (float): everything under white_noise_thresh*avg_energy_per_freq is cut off
+    peak_refinement (str): one of PEAK_REFINEMENTS
+    concert_pitch (float): pitch of a4 in hertz the notes are named by
+    min_freq (float): lowest frequency in hertz that is reported
+    batch_size (int): number of hops processed at once, by default as many as fit into ANALYSIS_BATCH_SAMPLES
+  Returns:
+    analysis (np.ndarray): structured array of ANALYSIS_DTYPE with one row per hop, time is the end of the hop in
+      seconds, note is the midi note number like in PitchDetector.report_note. frequency is nan and note is -1
+      where the power is below power_thresh or no pitch of at least min_freq was found
+  """
+  batch_size = batch_size or max(1, ANALYSIS_BATCH_SAMPLES // window_size)
+  samples = np.asarray(samples)
+  if samples.ndim > 1:
+    samples = samples[:, 0]
+  dtype = np.dtype(PRECISION)
+  num_hops = len(samples) // window_step
+
+  analysis = np.zeros(num_hops, dtype=ANALYSIS_DTYPE)
+  analysis["time"] = np.arange(1, num_hops+1) * window_step / sample_rate
+  analysis["frequency"] = np.nan
+  analysis["note"] = -1
+  if num_hops == 0:
+    return analysis
+
+  # hop k covers the window_size samples before (k+1)*window_step, the hops which reach back before the start
+  # of the recording see zeros like the ring buffer of the real-time detector. both are zero-copy views
+  num_head_hops = min(num_hops, window_size // window_step)
+  head = np.concatenate((np.zeros(window_size, dtype=samples.dtype), samples[:window_size]))
+  frame_views = [np.lib.stride_tricks.sliding_window_view(head, window_size)[window_step::window_step][:num_head_hops]]
+  if num_hops > num_head_hops:
+    first_start = (num_head_hops+1)*window_step - window_size
+    frame_views.append(np.lib.stride_tricks.sliding_window_view(samples, window_size)[first_start::window_step][:num_hops-num_head_hops])
+
+  hann_window = periodic_hann(window_size).astype(dtype)
+  fft = FFT_BACKENDS[FFT_BACKEND]
+  note_edges = np.array(get_note_edges(concert_pitch)) # the same notes as the real-time detection
+  hop_idx = 0
+  for frames in frame_views:
+    for batch_start in range(0, len(frames), batch_size):
+      batch = frames[batch_start:batch_start+batch_size]
+      batch_hops = analysis[hop_idx:hop_idx+len(batch)]
+      hop_idx += len(batch)
+
+      power = np.einsum("ij,ij->i", batch, batch, dtype=np.float64) / window_size
+      batch_hops["power"] = power
+      is_loud = power >= power_thresh
+      if not is_loud.any():
+        continue
+
+      # window, transform, whiten and search all loud hops of the batch at once
+      hann_samples = np.multiply(batch[is_loud], hann_window, dtype=dtype)
+      magnitude_spec = np.abs(fft(hann_samples, FFT_WORKERS)[..., :window_size//2])
+      suppress_noise(magnitude_spec, sample_rate, window_size, white_noise_thresh)
+      with np.errstate(divide="ignore", invalid="ignore"):
+        max_freq = find_hps_pitch(magnitude_spec, sample_rate, window_size, num_hps, peak_refinement)
+        is_pitched = max_freq >= min_freq # also false for nan
+        loud_hops = np.flatnonzero(is_loud)
+        batch_hops["frequency"][loud_hops[is_pitched]] = max_freq[is_pitched]
+        batch_hops["note"][loud_hops[is_pitched]] = np.searchsorted(note_edges, max_freq[is_pitched], side="right")
+  return analysis
+
+class HPSEstimator:
+  """
+  Harmonic product spectrum of the whitened spectrum, the shorter windows of multi_resolution_windows
+  are tried before the whole window
+  """
+  def __init__(self, settings, metrics):
+    self.metrics = metrics
+    self.sample_freq = settings["sample_freq"]
+    self.window_size = settings["window_size"]
+    self.power_thresh = settings["power_thresh"]
+    self.num_hps = settings["num_hps"]
+    self.white_noise_thresh = settings["white_noise_thresh"]
+    self.peak_refinement = settings["peak_refinement"]
+    self.confidence_thresh = settings["confidence_thresh"]
+    self.tables = get_dsp_tables(settings["sample_freq"], settings["window_size"], settings["num_hps"])
+    if settings["spectrum_engine"] not in SPECTRUM_ENGINES:
+      raise ValueError(f"Unknown spectrum engine: {settings['spectrum_engine']}")
+    self.sliding_dft = None # the PitchDetector feeds the samples it writes into a SlidingDFTEngine
+    if settings["spectrum_engine"] == "sliding_dft":
+      self.sliding_dft = SlidingDFTEngine(settings["window_size"], settings["sample_freq"], settings["sliding_dft_max_freq"],
+                                          settings["window_step"], settings["fft_backend"], settings["precision"],
+                                          settings["fft_workers"], self.tables.hann_window, settings["channels"])
+      self.fft_engine = self.sliding_dft
+    else:
+      self.fft_engine = FFTEngine(settings["window_size"], settings["fft_backend"], settings["precision"],
+                                  settings["fft_workers"], self.tables.hann_window, settings["channels"])
+    self.scratch = SpectrumScratch(self.tables, settings["channels"], settings["window_size"] // 2, settings["num_hps"],
+                                   settings["peak_refinement"], self.fft_engine.magnitude_spec.dtype)
+    self.confidence = 0.0 # of the latest estimate, see hps_confidence
+    self.resolutions = []
+    for window_size in sorted(set(settings["multi_resolution_windows"])):
+      if window_size < settings["window_size"]:
+        tables = get_dsp_tables(settings["sample_freq"], window_size, settings["num_hps"])
+        fft_engine = FFTEngine(window_size, settings["fft_backend"], settings["precision"],
+                               settings["fft_workers"], tables.hann_window, settings["channels"])
+        scratch = SpectrumScratch(tables, settings["channels"], window_size // 2, settings["num_hps"],
+                                  settings["peak_refinement"], settings["precision"])
+        self.resolutions.append(Resolution(window_size, tables, fft_engine, min_resolved_freq(self.sample_freq, window_size), scratch))
+
+  def estimate(self, window_samples, timer=NULL_TIMER):
+    """
+    Estimates the fundamental frequency of the latest window, all channels are processed in one batched pass
+    Parameters:
+      window_samples (np.ndarray): the latest window_size samples, or one row of them per channel
+      timer (metrics.StageTimer): records the stages of the estimation
+    Returns:
+      max_freq (float or np.ndarray): fundamental frequency in hertz, one per row for 2-D input
+    """
+    channel_samples = np.atleast_2d(window_samples)
+    max_freq = np.full(len(channel_samples), np.nan)
+    confidence = np.zeros(len(channel_samples))
+    is_undecided = np.ones(len(channel_samples), dtype=bool)
+    # spectrums of channels that are silent or lack a result come out as nan, they are masked below
+    with np.errstate(divide="ignore", invalid="ignore"):
+      # the newest samples are tried with the shortest window first, the first confident result wins,
+      # so higher notes are detected as soon as a short window is filled with them
+      for resolution in self.resolutions:
+        samples = channel_samples[:, -resolution.window_size:]
+        power = np.einsum("ij,ij->i", samples, samples) / resolution.window_size
+        is_loud = is_undecided & (power >= self.power_thresh)
+        if not is_loud.any():
+          continue
+        magnitude_spec = resolution.fft_engine.magnitude_spectrum(samples)
+        suppress_noise(magnitude_spec, self.sample_freq, resolution.window_size, self.white_noise_thresh, resolution.scratch)
+        resolution_freq = find_hps_pitch(magnitude_spec, self.sample_freq, resolution.window_size, self.num_hps,
+                                         self.peak_refinement, ipol_grid=resolution.tables.ipol_grid, scratch=resolution.scratch)
+        for channel in np.flatnonzero(is_loud):
+          freq = resolution_freq[channel]
+          if not freq >= resolution.min_freq:
+            continue
+          agreement = harmonic_confidence(magnitude_spec[channel], freq, self.sample_freq, resolution.window_size, self.num_hps)
+          if agreement >= self.confidence_thresh:
+            max_freq[channel] = freq
+            confidence[channel] = agreement * hps_prominence(magnitude_spec[channel], freq, self.sample_freq,
+                                                             resolution.window_size, self.num_hps)
+            is_undecided[channel] = False
+            self.metrics.count(f"window_{resolution.window_size}")
+        if not is_undecided.any():
+          break
+      if self.resolutions:
+        timer.lap("short_windows")
+
+      if is_undecided.any():
+        magnitude_spec = self.fft_engine.magnitude_spectrum(channel_samples)
+        timer.lap("fft")
+
+        suppress_noise(magnitude_spec, self.sample_freq, self.window_size, self.white_noise_thresh, self.scratch)
+        timer.lap("whitening")
+
+        self.metrics.count(f"window_{self.window_size}", int(is_undecided.sum()))
+        full_freq = find_hps_pitch(magnitude_spec, self.sample_freq, self.window_size, self.num_hps, self.peak_refinement,
+                                   timer, self.tables.ipol_grid, self.scratch)
+        max_freq[is_undecided] = full_freq[is_undecided]
+        for channel in np.flatnonzero(is_undecided & (max_freq > 0)):
+          confidence[channel] = hps_confidence(magnitude_spec[channel], max_freq[channel], self.sample_freq,
+                                               self.window_size, self.num_hps)
+        timer.lap("confidence")
+    self.confidence = confidence if window_samples.ndim == 2 else float(confidence[0])
+    return max_freq if window_samples.ndim == 2 else float(max_freq[0])
+
+def estimate_channels(estimator, window_samples, timer=NULL_TIMER):
+  """
+  Runs an estimator that works on one channel at a time on every row of window_samples
+  Returns:
+    max_freq (np.ndarray): fundamental frequency in hertz of every row, nan where there is none
+  """
+  max_freq = [estimator.estimate(samples, timer) for samples in window_samples]
+  return np.array([np.nan if freq is None else freq for freq in max_freq])
+
+class AutocorrelationEstimator:
+  """
+  Base of the time-domain estimators, they only look at the newest 2*max_lag samples, where max_lag
+  is the period of min_freq, so they need a far shorter window than the HPS for the same notes
+  """
+  find_lag = None # function(samples, min_lag, max_lag) returning the period in samples or None
+
+  def __init__(self, settings, metrics):
+    self.metrics = metrics
+    self.sample_freq = settings["sample_freq"]
+    self.max_lag = min(int(np.ceil(self.sample_freq / settings["min_freq"])) + 1, settings["window_size"] // 2)
+    self.min_lag = max(2, int(self.sample_freq // MAX_FREQ))
+    importlib.import_module("scipy.fft") # loaded with the estimator instead of on the first hop
+
+  def estimate(self, window_samples, timer=NULL_TIMER):
+    """
+    Estimates the fundamental frequency of the newest samples
+    Parameters:
+      window_samples (np.ndarray): the latest window_size samples
+      timer (metrics.StageTimer): records the stages of the estimation
+    Returns:
+      max_freq (float): fundamental frequency in hertz, None if the signal is not periodic
+    """
+    if window_samples.ndim == 2:
+      return estimate_channels(self, window_samples, timer)
+    lag = self.find_lag(window_samples[-2*self.max_lag:], self.min_lag, self.max_lag)
+    timer.lap("autocorrelation")
+    return None if lag is None else self.sample_freq / lag
+
+class YINEstimator(AutocorrelationEstimator):
+  """
+  YIN on an FFT cross-correlation, see find_yin_lag
+  """
+  find_lag = staticmethod(find_yin_lag)
+
+class McLeodEstimator(AutocorrelationEstimator):
+  """
+  McLeod pitch method on an FFT autocorrelation, see find_mcleod_lag
+  """
+  find_lag = staticmethod(find_mcleod_lag)
+
+@functools.lru_cache(maxsize=128)
+def get_note_filter(midi_note, sample_freq, concert_pitch, max_length):
+  """
+  Builds the sparse DFT filter of one note, the hann windowed cosines and sines of its first
+  VERIFY_NUM_HARMONICS harmonics over VERIFY_PERIODS periods
+  Parameters:
+    midi_note (int): midi note number
+    sample_freq (int): sample frequency in Hz
+    concert_pitch (float): pitch of a4 in hertz
+    max_length (int): longest filter in samples
+  Returns:
+    note_filter (np.ndarray): read-only matrix with one row per cosine and sine, scaled so that the
+      sum of squares of note_filter @ samples is the power of the harmonics in the newest samples
+  """
+  freq = concert_pitch * 2**((midi_note - CONCERT_PITCH_MIDI)/12)
+  length = min(int(np.ceil(VERIFY_PERIODS * sample_freq / freq)), max_length)
+  harmonics = np.arange(1, VERIFY_NUM_HARMONICS+1)
+  harmonics = harmonics[harmonics*freq < sample_freq/2]
+
+  def compute():
+    hann_window = periodic_hann(length)
+    phase = 2*np.pi * freq / sample_freq * np.outer(harmonics, np.arange(length))
+    return np.concatenate((np.cos(phase), np.sin(phase))) * hann_window * (2**0.5 / hann_window.sum())
+  return cached_table("note_filter", compute, midi_note, sample_freq, concert_pitch, length)
+
+class VerifyEstimator:
+  """
+  Only checks which of the target notes is playing, with a bank of sparse DFT filters on their harmonics
+  instead of a whole spectrum. Notes outside the targets are rejected instead of being named
+  """
+  def __init__(self, settings, metrics):
+    self.metrics = metrics
+    self.sample_freq = settings["sample_freq"]
+    self.concert_pitch = settings["concert_pitch"]
+    self.window_size = settings["window_size"]
+    self.dtype = np.dtype(settings["precision"])
+    self.note_filters = []
+
+  def set_target_notes(self, midi_notes):
+    """
+    Compiles the filter bank of the expected notes
+    Parameters:
+      midi_notes (list): midi note numbers
+    """
+    # in the precision of the samples, so the filters are applied without converting the samples
+    self.note_filters = [(midi_note, get_note_filter(midi_note, self.sample_freq, self.concert_pitch, self.window_size).astype(self.dtype))
+                         for midi_note in sorted(set(midi_notes))]
+
+  def estimate(self, window_samples, timer=NULL_TIMER):
+    """
+    Finds the target note whose harmonics explain the largest share of the signal power
+    Parameters:
+      window_samples (np.ndarray): the latest window_size samples
+      timer (metrics.StageTimer): records the stages of the estimation
+    Returns:
+      max_freq (float): frequency of the target note in hertz, None if no target note is playing
+    """
+    if window_samples.ndim == 2:
+      return estimate_channels(self, window_samples, timer)
+    best_note, best_share = None, 0.0
+    for midi_note, note_filter in self.note_filters:
+      samples = window_samples[-note_filter.shape[1]:]
+      signal_energy = np.dot(samples, samples)
+      if not signal_energy > 0:
+        continue
+      harmonic_amplitudes = note_filter @ samples
+      harmonic_power = np.dot(harmonic_amplitudes, harmonic_amplitudes)
+      num_harmonics = len(harmonic_amplitudes) // 2
+      fundamental_power = harmonic_amplitudes[0]**2 + harmonic_amplitudes[num_harmonics]**2
+      if fundamental_power < VERIFY_MIN_FUNDAMENTAL * harmonic_power:
+        continue
+      share = harmonic_power * len(samples) / signal_energy
+      if share > best_share:
+        best_note, best_share = midi_note, share
+    timer.lap("note_filters")
+    if best_share < VERIFY_THRESH:
+      self.metrics.count("rejected_hops")
+      return None
+    return self.concert_pitch * 2**((best_note - CONCERT_PITCH_MIDI)/12)
+
+# pitch estimation algorithms selectable with the estimator setting, every class is created with
+# (settings, metrics) and provides estimate(window_samples, timer) returning a frequency or None.
+# Estimators that only verify the expected notes also provide set_target_notes(midi_notes), estimators that
+# track the spectrum while samples are written provide a SlidingDFTEngine as sliding_dft
+ESTIMATORS = {
+  "hps": HPSEstimator,
+  "yin": YINEstimator,
+  "mcleod": McLeodEstimator,
+  "verify": VerifyEstimator
+}
+
+class OnsetGate:
+  """
+  Cheap front-end of the estimator which tells when the last estimate can be reused. Every hop the spectrum
+  of the newest samples is compared with the one at the last estimate, a change of more than thresh is an onset.
+  The estimate is only reused once a whole window has passed since the last onset, so the estimator sees
+  nothing but the new sound, and the last two estimates agree
+  """
+  def __init__(self, window_size=WINDOW_SIZE, sample_freq=SAMPLE_FREQ, thresh=ONSET_GATE_THRESH, channels=1):
+    self.window_size = window_size
+    self.thresh = thresh
+    gate_size = min(ONSET_GATE_WINDOW, window_size)
+    self.hann_window = periodic_hann(gate_size)
+    self.max_reused_samples = int(ONSET_GATE_MAX_REUSE * sample_freq)
+    # scratch buffers, the short spectrums of every hop are computed in place. They stay in double
+    # precision, numpy only transforms doubles without temporaries
+    self.hann_samples = np.empty((channels, gate_size))
+    self.fft_spectrum = np.empty((channels, gate_size // 2 + 1), dtype=complex)
+    self.spectrum = np.empty((channels, gate_size // 2 + 1)) # normalized short spectrum of the current hop
+    self.reference = np.empty_like(self.spectrum) # normalized short spectrum at the last estimate
+    self.difference = np.empty_like(self.spectrum)
+    self.norms = np.empty(channels)
+    self.changes = np.empty(channels)
+    self.reset()
+
+  def reset(self):
+    """
+    Forgets the last estimate, e.g. after silence
+    """
+    self.has_reference = False # whether reference holds the spectrum of the last estimate
+    self.freq = None # last estimate
+    self.is_settled = False # whether the last two estimates agree
+    self.samples_since_onset = 0
+    self.reused_samples = 0
+
+  def is_steady(self, window_samples, num_new_samples):
+    """
+    Checks whether the sound has stayed the same since the last estimate
+    Parameters:
+      window_samples (np.ndarray): the latest window_size samples, or one row of them per channel
+      num_new_samples (int): samples written since the previous hop
+    Returns:
+      is_steady (bool): whether the last estimate can be reused, otherwise the estimator has to run
+        and its result has to be passed to update
+    """
+    self.samples_since_onset += num_new_samples
+    channel_samples = np.atleast_2d(window_samples)
+    np.copyto(self.hann_samples, channel_samples[:, -len(self.hann_window):])
+    self.hann_samples *= self.hann_window
+    np.abs(numpy_rfft(self.hann_samples, 1, self.fft_spectrum), out=self.spectrum)
+    norms = np.einsum("ij,ij->i", self.spectrum, self.spectrum, out=self.norms)
+    np.sqrt(norms, out=norms)
+    with np.errstate(divide="ignore", invalid="ignore"):
+      np.divide(self.spectrum, norms[:, np.newaxis], out=self.spectrum)
+    if not self.has_reference:
+      return False
+    # half the squared distance of the normalized spectrums is one minus their cosine similarity
+    difference = np.subtract(self.spectrum, self.reference, out=self.difference)
+    change = 0.5*np.max(np.einsum("ij,ij->i", difference, difference, out=self.changes))
+    if not change <= self.thresh:
+      self.samples_since_onset = 0
+      return False
+    if (not self.is_settled or self.samples_since_onset < self.window_size
+        or self.reused_samples + num_new_samples > self.max_reused_samples):
+      return False
+    self.reused_samples += num_new_samples
+    return True
+
+  def update(self, freq):
+    """
+    Takes the estimate of a hop on which is_steady returned False
+    Parameters:
+      freq (float or np.ndarray): estimated fundamental frequency, None or nan where there is none
+    """
+    freq = np.nan if freq is None else freq
+    if self.freq is not None:
+      with np.errstate(divide="ignore", invalid="ignore"):
+        drift = np.abs(12*np.log2(np.asarray(freq) / self.freq))
+      self.is_settled = bool(np.all((drift <= ONSET_GATE_MAX_DRIFT) | (np.isnan(freq) & np.isnan(self.freq))))
+    self.freq = np.copy(freq)
+    np.copyto(self.reference, self.spectrum)
+    self.has_reference = True
+    self.reused_samples = 0
+
+  @property
+  def estimate(self):
+    """
+    The last estimate in the format of the estimators
+    """
+    if self.freq.ndim:
+      return self.freq.copy()
+    return None if np.isnan(self.freq) else float(self.freq)
+
+class NoteStabilizer:
+  """
+  Decides which note of a channel is reported. A confident estimate is reported on its first hop, a less
+  confident one only once it is the median and the majority of the last size notes. The reported note
+  is kept as long as it still holds half of them, so an uncertain hop doesn't make it flicker
+  """
+  def __init__(self, size=STABILIZER_SIZE, confidence_thresh=STABILIZER_CONFIDENCE):
+    self.size = size
+    self.confidence_thresh = confidence_thresh
+    self.notes = collections.deque(maxlen=size) # midi note numbers of the latest hops
+    self.freqs = collections.deque(maxlen=size) # frequencies behind them
+    self.note = None # reported note
+    self.freq = None # latest frequency of the reported note
+
+  def reset(self):
+    """
+    Forgets the latest notes, e.g. after silence
+    """
+    self.notes.clear()
+    self.freqs.clear()
+    self.note = None
+    self.freq = None
+
+  def update(self, note, freq, confidence):
+    """
+    Takes the note of the latest hop
+    Parameters:
+      note (int): midi note number
+      freq (float): estimated frequency in hertz
+      confidence (float): confidence of the estimate between 0 and 1
+    Returns:
+      note (int): midi note number to report, None if the note is still uncertain
+    """
+    self.notes.append(note)
+    self.freqs.append(freq)
+    if confidence >= self.confidence_thresh:
+      self.note = note
+    elif self.note is None or 2*self.notes.count(self.note) < self.size:
+      median = sorted(self.notes)[len(self.notes)//2]
+      self.note = median if 2*self.notes.count(median) > self.size else None
+    if self.note is None:
+      self.freq = None
+    elif self.note == note:
+      self.freq = freq
+    else: # a kept note reports its own latest frequency, not the one of the uncertain hop
+      latest_idx = max(i for i, buffered_note in enumerate(self.notes) if buffered_note == self.note)
+      self.freq = self.freqs[latest_idx]
+    return self.note
+
+class PitchDetector:
+  """
+  Pitch detector which owns its own sample buffer, note buffer and settings,
+  so several detectors can run side by side in one process
+  """
+  def __init__(self, settings=None, metrics=None):
+    # without settings the detector reads the settings file, missing settings keep their default
+    settings = load_settings() if settings is None else {**DEFAULT_SETTINGS, **settings}
+    self.metrics = metrics or Metrics(settings["profiling"], settings["profiling_dump_path"])
+    self.window_size = 0
+    self.channels = 0
+    self.dtype = None # of the ring buffer, see the precision setting
+    self.write_idx = 0
+    self.pending_settings = None
+    self.target_notes = [] # midi note numbers the practice expects
+    self.samples_since_estimate = 0
+    self.apply_settings(settings)
+
+  def reconfigure(self, settings):
+    """
+    Swaps in new settings, they take effect at the start of the next hop, so this can be called
+    from any thread while a stream is running
+    Parameters:
+      settings (dict): user settings, missing keys keep their current value
+    """
+    self.pending_settings = {**self.settings, **settings}
+
+  def apply_settings(self, settings):
+    """
+    Applies new settings right away, the tables of the estimator come from the get_dsp_tables cache
+    Parameters:
+      settings (dict): complete user settings
+    """
+    if settings["estimator"] not in ESTIMATORS:
+      raise ValueError(f"Unknown estimator: {settings['estimator']}")
+    self.settings = settings
+    self.sample_freq = settings["sample_freq"]
+    self.power_thresh = settings["power_thresh"]
+    self.concert_pitch = settings["concert_pitch"]
+    self.note_edges = get_note_edges(self.concert_pitch)
+    self.estimator = ESTIMATORS[settings["estimator"]](settings, self.metrics)
+    if hasattr(self.estimator, "set_target_notes"):
+      self.estimator.set_target_notes(self.target_notes)
+    self.sliding_dft = getattr(self.estimator, "sliding_dft", None)
+    self.onset_gate = None
+    if settings["onset_gate"]:
+      self.onset_gate = OnsetGate(settings["window_size"], self.sample_freq, settings["onset_gate_thresh"], settings["channels"])
+    self.stabilizers = [NoteStabilizer(settings["stabilizer_size"], settings["stabilizer_confidence"]) for _ in range(settings["channels"])]
+    dtype = np.dtype(settings["precision"])
+    if (settings["window_size"], settings["channels"], dtype) != (self.window_size, self.channels, self.dtype):
+      self.dtype = dtype
+      self.resize_window(settings["window_size"], settings["channels"])
+
+  def set_target_notes(self, notes):
+    """
+    Tells the detector which notes the practice expects, estimators like "verify" only look for these
+    Parameters:
+      notes (list): note names, e.g. C4, G#3, .. names that are no notes are ignored
+    """
+    self.target_notes = []
+    for note in notes:
+      try:
+        self.target_notes.append(note_name_midi(note))
+      except ValueError:
+        pass
+    if hasattr(self.estimator, "set_target_notes"):
+      self.estimator.set_target_notes(self.target_notes)
+      if self.onset_gate is not None:
+        self.onset_gate.reset() # the last estimate was looking for other notes
+
+  def resize_window(self, window_size, channels=None):
+    """
+    Replaces the ring buffer by one of a new size, keeping as many of the latest samples as fit.
+    A new number of channels starts from an empty buffer
+    """
+    channels = channels or self.channels
+    latest_samples = self.ring_buffer[:, self.write_idx:self.write_idx + self.window_size].copy() if self.window_size else None
+    if channels != self.channels:
+      latest_samples = None
+      self.is_note_still_playing = [False] * channels
+      self.latest_freq = [None] * channels # frequency behind the latest report of every channel
+      self.latest_power = [0.0] * channels # power of the latest block of every channel
+    self.window_size = window_size
+    self.channels = channels
+    # the ring buffer of every channel is stored twice back to back, so the latest window_size
+    # samples are always available as one contiguous view without copying
+    self.ring_buffer = np.zeros((channels, 2*window_size), dtype=self.dtype)
+    self.write_idx = 0
+    # the running sums are kept in double precision whatever the precision of the samples
+    self.sum_of_squares = np.zeros(channels) # running sum of squares of the samples in the window of every channel
+    self.chunk_energy = np.empty(channels, dtype=self.dtype) # scratch buffer of push_samples
+    self.writes_since_resync = 0
+    if latest_samples is not None:
+      self.push_samples(latest_samples[:, -window_size:].T)
+
+  @property
+  def window_samples(self):
+    """
+    The latest window_size samples in chronological order (a view into the ring buffer),
+    one row per channel if there are several channels
+    """
+    samples = self.ring_buffer[:, self.write_idx:self.write_idx + self.window_size]
+    return samples[0] if self.channels == 1 else samples
+
+  @property
+  def signal_power(self):
+    """
+    Mean power of the samples currently in the window, one per channel if there are several channels
+    """
+    power = np.maximum(self.sum_of_squares, 0.0) / self.window_size
+    return float(power[0]) if self.channels == 1 else power
+
+  def push_samples(self, samples):
+    """
+    Writes new samples into the ring buffer in place, dropping the oldest ones
+    Parameters:
+      samples (np.ndarray): 1-D array of new samples of a single channel, or one column per channel
+    """
+    samples = samples[np.newaxis] if samples.ndim == 1 else samples.T
+    self.samples_since_estimate += samples.shape[1]
+    n = self.window_size
+    if samples.shape[1] >= n: # the whole window is replaced
+      samples = samples[:, -n:]
+      self.ring_buffer[:, :n] = samples
+      self.ring_buffer[:, n:] = samples
+      self.write_idx = 0
+      self.sum_of_squares[:] = np.einsum("ij,ij->i", self.ring_buffer[:, :n], self.ring_buffer[:, :n], out=self.chunk_energy)
+      self.writes_since_resync = 0
+      if self.sliding_dft is not None:
+        self.sliding_dft.needs_resync = True
+      return
+
+    # after a write the sliding DFT couldn't follow, it is resynced from the window before the next short one
+    if self.sliding_dft is not None and self.sliding_dft.needs_resync and samples.shape[1] <= self.sliding_dft.max_hop:
+      self.sliding_dft.resync(self.ring_buffer[:, self.write_idx:self.write_idx + n])
+
+    # write the block in at most two chunks, wrapping around the end of the buffer
+    written = 0
+    while written < samples.shape[1]:
+      chunk_len = min(samples.shape[1] - written, n - self.write_idx)
+      chunk = self.ring_buffer[:, self.write_idx:self.write_idx + chunk_len]
+      self.sum_of_squares -= np.einsum("ij,ij->i", chunk, chunk, out=self.chunk_energy) # evict the oldest samples
+      if self.sliding_dft is not None:
+        self.sliding_dft.update(samples[:, written:written + chunk_len], chunk)
+      chunk[:] = samples[:, written:written + chunk_len]
+      self.sum_of_squares += np.einsum("ij,ij->i", chunk, chunk, out=self.chunk_energy)
+      self.ring_buffer[:, self.write_idx + n:self.write_idx + n + chunk_len] = chunk
+      self.write_idx = (self.write_idx + chunk_len) % n
+      written += chunk_len
+
+    # resync the running sums once per full buffer turn to stop rounding errors from piling up
+    self.writes_since_resync += samples.shape[1]
+    if self.writes_since_resync >= n:
+      window = self.ring_buffer[:, self.write_idx:self.write_idx + n]
+      self.sum_of_squares[:] = np.einsum("ij,ij->i", window, window, out=self.chunk_energy)
+      self.writes_since_resync = 0
+      if self.sliding_dft is not None:
+        self.sliding_dft.needs_resync = True
+
+  def estimate_pitch(self, timer=NULL_TIMER):
+    """
+    Runs the pitch detection on the samples currently in the window
+    Parameters:
+      timer (metrics.StageTimer): records the stages of the detection
+    Returns:
+      max_freq (float or np.ndarray): fundamental frequency in hertz, None if the signal power is too low or the
+        estimator finds no pitch. With several channels an array with one frequency per channel, nan instead of None
+    """
+    is_too_quiet = self.signal_power < self.power_thresh
+    num_new_samples, self.samples_since_estimate = self.samples_since_estimate, 0
+    timer.lap("power_gate")
+    if np.all(is_too_quiet):
+      if self.onset_gate is not None:
+        self.onset_gate.reset()
+      return None if self.channels == 1 else np.full(self.channels, np.nan)
+
+    # all channels go through the estimator in one batch, the quiet ones are masked afterwards
+    if self.onset_gate is None:
+      max_freq = self.estimator.estimate(self.window_samples, timer)
+    elif self.onset_gate.is_steady(self.window_samples, num_new_samples):
+      timer.lap("onset_gate")
+      self.metrics.count("reused_hops")
+      max_freq = self.onset_gate.estimate
+    else:
+      timer.lap("onset_gate")
+      max_freq = self.estimator.estimate(self.window_samples, timer)
+      self.onset_gate.update(max_freq)
+    if self.channels > 1:
+      max_freq[is_too_quiet] = np.nan
+    return max_freq
+
+  def callback(self, indata, outdata, frames, time, status, detection_callback):
+    """
+    Callback function which contains the pitch detection, detection_callback(closest_note, is_new_note, channel)
+    is called once per channel with the midi note number of the detected note, None if there is none
+    """
+    if self.pending_settings is not None:
+      settings, self.pending_settings = self.pending_settings, None
+      self.apply_settings(settings)
+    self.metrics.count_status(status)
+    if status:
+      for channel in range(self.channels):
+        detection_callback(None, False, channel)
+      return
+    if indata.shape[1] < self.channels:
+      # a block of the old stream queued before the number of channels was raised
+      self.metrics.count("mismatched_blocks")
+      return
+    new_samples = indata[:, :self.channels]
+    if new_samples.any():
+      timer = self.metrics.timer()
+      self.push_samples(new_samples)
+      timer.lap("buffer_update")
+
+      # calculate input power
+      input_power = np.einsum("ij,ij->j", new_samples, new_samples) / len(new_samples)
+
+      max_freq = self.estimate_pitch(timer)
+      confidence = np.broadcast_to(self.estimate_confidence(), self.channels)
+      if self.channels == 1:
+        max_freq = [max_freq]
+      else:
+        max_freq = [None if np.isnan(freq) else freq for freq in max_freq]
+      for channel in range(self.channels):
+        self.report_note(channel, max_freq[channel], input_power[channel], confidence[channel], detection_callback)
+      timer.lap("note_lookup")
+      timer.finish()
+
+    else:
+      pass
+
+  def estimate_confidence(self):
+    """
+    Confidence of the latest estimate between 0 and 1, the confidence of the estimator lowered while the
+    signal power is less than CONFIDENCE_POWER_MARGIN decibels above power_thresh. Estimators without
+    a confidence score 0, so their notes are always smoothed by the NoteStabilizer
+    Returns:
+      confidence (float or np.ndarray): one per channel if there are several channels
+    """
+    with np.errstate(divide="ignore"):
+      power_margin = 10*np.log10(self.signal_power / self.power_thresh) / CONFIDENCE_POWER_MARGIN
+    return getattr(self.estimator, "confidence", 0.0) * np.clip(power_margin, 0.0, 1.0)
+
+  def report_note(self, channel, max_freq, input_power, confidence, detection_callback):
+    """
+    Passes the detected note of one channel to the detection callback once its NoteStabilizer settles on it
+    """
+    # check if the note is still playing
+    is_new_note = False
+    if input_power > self.power_thresh:
+        if not self.is_note_still_playing[channel]:
+            self.is_note_still_playing[channel] = True
+            is_new_note = True
+    else:
+        self.is_note_still_playing[channel] = False
+    self.latest_power[channel] = float(input_power)
+
+    # skip if signal power is too low
+    if max_freq is None:
+      self.metrics.count("silent_hops")
+      self.stabilizers[channel].reset()
+      self.latest_freq[channel] = None
+      detection_callback(None, False, channel)
+      return
+
+    closest_note = bisect.bisect_right(self.note_edges, max_freq) # midi note number
+    stabilizer = self.stabilizers[channel]
+    stable_note = stabilizer.update(closest_note, max_freq, confidence)
+    self.latest_freq[channel] = stabilizer.freq
+    if stable_note is None:
+      detection_callback(None, False, channel)
+    else:
+      detection_callback(stable_note, is_new_note, channel)
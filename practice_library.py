@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import numpy as np
+import pitch_detection as pd
+
+LIBRARY_PATH = "practice_library.db"
+LEGACY_LIST_PATH = "practice_list.json" # imported once into an empty library
+PAGE_SIZE = 100 # practices loaded at once by the practice list page
+RANDOM_ORDER_LENGTH = 1024 # targets of a random practice drawn at once
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS practices (
+  id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL,
+  description TEXT NOT NULL DEFAULT '',
+  note_list TEXT NOT NULL DEFAULT '[]',
+  has_alternate_names INTEGER NOT NULL DEFAULT 0,
+  is_random INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS practices_name ON practices (name);
+"""
+SCHEMA_VERSION = 1 # stored in PRAGMA user_version, 0 means the legacy list was not imported yet
+
+class PracticeLibrary:
+  """
+  Practices stored in SQLite, every change only touches its own row instead of rewriting the whole library.
+  The practices are listed by name in pages, so the library can grow to thousands of practices
+  """
+  def __init__(self, path=LIBRARY_PATH, legacy_list_path=LEGACY_LIST_PATH):
+    self.connection = sqlite3.connect(path)
+    self.connection.row_factory = sqlite3.Row
+    # readers are not blocked while a practice is saved, and a commit does not wait for a full sync
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    self.connection.execute("PRAGMA synchronous=NORMAL")
+    with self.connection:
+      self.connection.executescript(SCHEMA)
+    if self.connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+      self.import_json(legacy_list_path)
+
+  def import_json(self, path):
+    """
+    Imports the practices of a practice_list.json in one transaction and marks the library as imported,
+    so the json is only read the first time the library is opened
+    Parameters:
+      path (str): path of the json list, a missing file imports nothing
+    Returns:
+      count (int): number of imported practices
+    """
+    practices = []
+    if os.path.exists(path):
+      with open(path, "r") as f:
+        practices = json.load(f)
+    with self.connection:
+      self.connection.executemany("INSERT INTO practices (name, description, note_list, has_alternate_names, is_random) "
+                                  "VALUES (?, ?, ?, ?, ?)", [practice_row(practice) for practice in practices])
+      self.connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    return len(practices)
+
+  def count(self):
+    return self.connection.execute("SELECT COUNT(*) FROM practices").fetchone()[0]
+
+  def page(self, after=None, limit=PAGE_SIZE):
+    """
+    Lists the practices ordered by name, one page at a time. The page continues after the last
+    entry of the previous page, which the name index finds directly however deep the page is
+    Parameters:
+      after (tuple): (name, id) of the last practice of the previous page, None for the first page
+      limit (int): maximum number of practices
+    Returns:
+      page (list): (name, id) of the practices
+    """
+    if after is None:
+      rows = self.connection.execute("SELECT name, id FROM practices ORDER BY name, id LIMIT ?", (limit,))
+    else:
+      rows = self.connection.execute("SELECT name, id FROM practices WHERE (name, id) > (?, ?) "
+                                     "ORDER BY name, id LIMIT ?", (*after, limit))
+    return [tuple(row) for row in rows]
+
+  def get(self, practice_id):
+    """
+    Returns the practice with practice_id as a dict in the format of practice_list.json, None if it does not exist
+    """
+    row = self.connection.execute("SELECT * FROM practices WHERE id = ?", (practice_id,)).fetchone()
+    if row is None:
+      return None
+    return {
+      "name": row["name"],
+      "description": row["description"],
+      "note_list": json.loads(row["note_list"]),
+      "has_alternate_names": row["has_alternate_names"],
+      "is_random": row["is_random"]
+    }
+
+  def find(self, name):
+    """
+    Returns the ids of the practices called name
+    """
+    return [row[0] for row in self.connection.execute("SELECT id FROM practices WHERE name = ? ORDER BY id", (name,))]
+
+  def add(self, practice):
+    """
+    Adds a practice dict and returns its id
+    """
+    with self.connection:
+      cursor = self.connection.execute("INSERT INTO practices (name, description, note_list, has_alternate_names, is_random) "
+                                       "VALUES (?, ?, ?, ?, ?)", practice_row(practice))
+    return cursor.lastrowid
+
+  def update(self, practice_id, practice):
+    with self.connection:
+      self.connection.execute("UPDATE practices SET name = ?, description = ?, note_list = ?, has_alternate_names = ?, "
+                              "is_random = ? WHERE id = ?", (*practice_row(practice), practice_id))
+
+  def delete(self, practice_id):
+    with self.connection:
+      self.connection.execute("DELETE FROM practices WHERE id = ?", (practice_id,))
+
+  def close(self):
+    self.connection.close()
+
+def practice_row(practice):
+  """
+  Converts a practice dict to the column values of the practices table
+  """
+  return (practice.get("name"), practice.get("description", ""), json.dumps(practice.get("note_list", []), separators=(",", ":")),
+          int(practice.get("has_alternate_names", 0)), int(practice.get("is_random", 0)))
+
+class CompiledPractice:
+  """
+  Practice prepared for playing, the target notes are midi note numbers so checking a detected note is an integer
+  comparison, and the order of the targets is drawn in advance
+  """
+  def __init__(self, practice, rng=None):
+    """
+    Parameters:
+      practice (dict): practice in the format of practice_list.json
+      rng (np.random.Generator): draws the order of random practices
+    Raises:
+      ValueError: if a target note is not a note name
+    """
+    note_list = practice.get("note_list")
+    self.name = practice.get("name")
+    self.description = practice.get("description")
+    self.note_names = tuple(note.get("note") for note in note_list)
+    self.notes = np.array([pd.note_name_midi(note) for note in self.note_names], dtype=np.int16)
+    self.has_alternate_names = bool(practice.get("has_alternate_names"))
+    # name shown for every target, the alternate name if the practice has them
+    self.display_names = tuple(note.get("alternate_name") if self.has_alternate_names else note.get("note") for note in note_list)
+    self.is_random = bool(practice.get("is_random"))
+    self.rng = rng or np.random.default_rng()
+
+  def target_order(self, previous_idx=None):
+    """
+    Draws the next targets as indices into notes. Random practices never repeat a target right away, every step
+    adds a random offset between 1 and len(notes)-1, so no draw has to be rejected
+    Parameters:
+      previous_idx (int): last target of the previous order, the new order does not start with it
+    Returns:
+      order (list): target indices
+    """
+    num_notes = len(self.notes)
+    if not self.is_random or num_notes == 1:
+      start = 0 if previous_idx is None else previous_idx + 1
+      return [(start + i) % num_notes for i in range(num_notes)]
+    offsets = self.rng.integers(1, num_notes, RANDOM_ORDER_LENGTH)
+    if previous_idx is None: # the first practice target can be any note
+      previous_idx = self.rng.integers(num_notes)
+      offsets[0] = 0
+    return ((previous_idx + np.cumsum(offsets)) % num_notes).tolist()
+
+def parse_notes(text):
+  """
+  Parses comma separated note names
+  Parameters:
+    text (str): e.g. "A4, G#3"
+  Returns:
+    notes (list): note names without surrounding spaces
+  Raises:
+    ValueError: if one of them is not a note name
+  """
+  notes = [note.strip() for note in text.split(",") if note.strip()]
+  for note in notes:
+    pd.note_name_midi(note)
+  return notes
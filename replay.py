@@ -0,0 +1,87 @@
+"""
+Replays a recording through a whole practice without a window or an audio device. A virtual device plays
+the recording into the detection pipeline, and the detected notes advance the practice sessions of the
+interface like a player would. Run from the project directory:
+  python replay.py recording.wav "Practice name"          in real time
+  python replay.py recording.wav "Practice name" --fast   as fast as the detection keeps up
+Prints the targets every channel played, the speed of the replay and the latency of the detection
+"""
+import argparse
+import time
+import config
+import gui
+
+def replay(path, practice_name, settings=None, realtime=True, seed=None):
+  """
+  Plays a recording through the practice sessions of the interface
+  Parameters:
+    path (str): recording, see audio_source.load_recording
+    practice_name (str): name of a practice in the practice library
+    settings (dict): user settings, by default the settings file
+    realtime (bool): play the recording at its own pace, otherwise as fast as the detection keeps up
+    seed (int): seed of the order of random practices
+  Returns:
+    result (dict): the targets played per channel, the length of the recording and the duration of the replay in
+      seconds, the counters of the pipeline and the virtual device and the timings of the detection (see metrics.Metrics)
+  Raises:
+    ValueError: if there is no practice called practice_name
+  """
+  gui.load_audio_modules()
+  settings = {**(settings or config.load_settings()), "audio_source": "file", "audio_source_path": path,
+              "audio_source_realtime": realtime, "profiling": True, "profiling_dump_path": "", "session_log_path": ""}
+  if not realtime:
+    settings["overflow_policy"] = "block" # the virtual device waits for the detection instead of losing blocks
+
+  library = gui.pl.PracticeLibrary()
+  try:
+    practice_ids = library.find(practice_name)
+    if not practice_ids:
+      raise ValueError(f"There is no practice called {practice_name}")
+    gui.current_practice = library.get(practice_ids[0])
+  finally:
+    library.close()
+  gui.compiled_practice = gui.pl.CompiledPractice(gui.current_practice, gui.np.random.default_rng(seed))
+  gui.practice_sessions = [gui.PracticeSession(channel) for channel in range(settings["channels"])]
+
+  replay_start = time.perf_counter()
+  gui.start_stream_thread(settings)
+  stream_thread = gui.stream_thread
+  while stream_thread.stream is None and stream_thread.is_alive(): # the stream is opened on the stream thread
+    time.sleep(0.01)
+  stream = stream_thread.stream
+  try:
+    if stream is None:
+      raise RuntimeError(f"{path} could not be played")
+    stream.wait()
+    stream_thread.pipeline.drain()
+    replay_duration = time.perf_counter() - replay_start
+    return {
+      "targets_played": [session.num_hits for session in gui.practice_sessions],
+      "recording_duration": stream.duration,
+      "replay_duration": replay_duration,
+      "pipeline": stream_thread.pipeline.stats(),
+      "overflows": stream.overflows,
+      "lost_samples": stream.lost_samples,
+      "metrics": stream_thread.detector.metrics.snapshot()
+    }
+  finally:
+    gui.stop_stream_thread()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Plays a recording through a practice without a window or an audio device")
+  parser.add_argument("path", help="PCM .wav file at the sample frequency of the settings, or .npy file of samples")
+  parser.add_argument("practice", help="name of the practice")
+  parser.add_argument("--fast", action="store_true", help="play as fast as the detection keeps up instead of in real time")
+  parser.add_argument("--seed", type=int, help="seed of the order of random practices")
+  args = parser.parse_args()
+  result = replay(args.path, args.practice, realtime=not args.fast, seed=args.seed)
+  for channel, num_targets in enumerate(result["targets_played"]):
+    print(f"channel {channel+1}: {num_targets} targets played")
+  speed = result["recording_duration"] / result["replay_duration"]
+  print(f"{result['recording_duration']:.1f} s replayed in {result['replay_duration']:.1f} s ({speed:.1f}x real time), "
+        f"{result['pipeline']['processed_hops']} hops, {result['pipeline']['dropped_blocks']} dropped blocks, "
+        f"{result['overflows']} input overflows")
+  for name in ("detection_latency", "queue_wait", "hop"):
+    timing = result["metrics"]["timings"].get(name, {"count": 0})
+    if timing["count"]:
+      print(f"{name}: p50 {timing['p50']*1000:.2f} ms, p90 {timing['p90']*1000:.2f} ms, max {timing['max']*1000:.2f} ms")
@@ -0,0 +1,176 @@
+"""
+Headless detection server, captures audio and publishes the detected notes to any number of clients
+without the Tk interface. Run from the project directory:
+  python server.py                          listen on 127.0.0.1:8765
+  python server.py --unix /tmp/pitchpal.sock
+Every event is one line of compact json:
+  {"note":"A4","midi_note":69,"frequency":440.3,"cents":1.2,"power":0.0012,"timestamp":1700000000.0,"is_new_note":true,"channel":0}
+A note of null means the channel went silent
+"""
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import audio_source
+import pitch_detection as pd
+import pipeline
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_QUEUED_EVENTS = 256 # events that may wait for a slow client before its oldest ones are dropped
+
+class ClientConnection:
+  """
+  Connected client with its own bounded event queue, so a slow client only ever delays itself
+  """
+  def __init__(self, writer, max_queued_events=MAX_QUEUED_EVENTS):
+    self.writer = writer
+    self.queue = asyncio.Queue(max_queued_events)
+    self.dropped_events = 0
+
+  def put(self, line):
+    if self.queue.full():
+      self.queue.get_nowait() # drop the oldest event
+      self.dropped_events += 1
+    self.queue.put_nowait(line)
+
+  async def send_events(self):
+    while True:
+      line = await self.queue.get()
+      self.writer.write(line)
+      await self.writer.drain() # waits while the client does not keep up, the queue absorbs the events meanwhile
+
+class DetectionServer:
+  """
+  Publishes note events over TCP or a Unix socket. publish can be called from any thread,
+  it never blocks the detection
+  """
+  def __init__(self, max_queued_events=MAX_QUEUED_EVENTS):
+    self.max_queued_events = max_queued_events
+    self.clients = set()
+    self.loop = None
+    self.server = None
+    self.is_silent = {} # channel -> whether the silence was already published
+
+  async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    """
+    Starts listening, on unix_path if given, otherwise on host and port
+    """
+    self.loop = asyncio.get_running_loop()
+    if unix_path:
+      self.server = await asyncio.start_unix_server(self.handle_client, unix_path)
+    else:
+      self.server = await asyncio.start_server(self.handle_client, host, port)
+    return self.server
+
+  async def handle_client(self, reader, writer):
+    client = ClientConnection(writer, self.max_queued_events)
+    self.clients.add(client)
+    sender = asyncio.create_task(client.send_events())
+    try:
+      # clients do not send anything, reading only tells when they disconnect
+      while await reader.read(1024):
+        pass
+    except ConnectionError:
+      pass # disconnected
+    finally: # also when the server cancels the handler on shutdown, the cancellation goes on to asyncio
+      self.clients.discard(client)
+      sender.cancel()
+      writer.close()
+
+  def close(self):
+    """
+    Stops listening and disconnects all clients
+    """
+    if self.server is not None:
+      self.server.close()
+    for client in list(self.clients):
+      client.writer.close()
+
+  def broadcast(self, line):
+    """
+    Queues an encoded event for every client, runs on the event loop
+    """
+    for client in self.clients:
+      client.put(line)
+
+  def publish(self, event):
+    """
+    Publishes an event dict to all clients, thread-safe
+    """
+    line = (json.dumps(event, separators=(",", ":")) + "\n").encode()
+    try:
+      self.loop.call_soon_threadsafe(self.broadcast, line)
+    except RuntimeError: # the event loop is already closed
+      pass
+
+  def detection_callback(self, detector):
+    """
+    Returns a detection callback for the DetectionPipeline of detector which publishes its notes
+    """
+    def callback(closest_note, is_new_note=False, channel=0):
+      if closest_note is None:
+        if not self.is_silent.get(channel):
+          self.is_silent[channel] = True
+          self.publish(note_event(None, None, detector, False, channel))
+        return
+      self.is_silent[channel] = False
+      self.publish(note_event(closest_note, detector.latest_freq[channel], detector, is_new_note, channel))
+    return callback
+
+def note_event(closest_note, freq, detector, is_new_note=False, channel=0):
+  """
+  Builds the event of one detection
+  Parameters:
+    closest_note (int): midi note number of the detected note, None if the channel is silent
+    freq (float): detected frequency in hertz
+    detector (pitch_detection.PitchDetector): detector which made the detection
+    is_new_note (bool): whether the note was just struck
+    channel (int): input channel
+  Returns:
+    event (dict): note name, midi note number, frequency, cents off the note, power of the latest block, unix timestamp, is_new_note and channel
+  """
+  note, cents = None, None
+  if closest_note is not None:
+    note = pd.NOTE_NAMES[closest_note]
+    closest_pitch = detector.concert_pitch * 2**((closest_note - pd.CONCERT_PITCH_MIDI)/12)
+    cents = round(1200*float(np.log2(freq/closest_pitch)), 2)
+    freq = round(float(freq), 3)
+  return {"note": note, "midi_note": closest_note, "frequency": freq, "cents": cents, "power": detector.latest_power[channel],
+          "timestamp": time.time(), "is_new_note": is_new_note, "channel": channel}
+
+async def serve(settings, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, max_queued_events=MAX_QUEUED_EVENTS):
+  """
+  Captures audio with the detection pipeline and serves the note events until cancelled
+  """
+  server = DetectionServer(max_queued_events)
+  listener = await server.start(host, port, unix_path)
+  detector = pd.PitchDetector(settings)
+  detection_pipeline = pipeline.DetectionPipeline(detector, server.detection_callback(detector), settings["sample_freq"],
+                                                  settings["max_queued_blocks"], settings["overflow_policy"],
+                                                  settings["window_step"], settings["adaptive_hop"])
+  detection_pipeline.start()
+  try:
+    # sounddevice is only imported by its audio source, the rest of the module works without PortAudio
+    with audio_source.open_input_stream(settings, detection_pipeline.audio_callback) as stream:
+      print(f"Serving note events on {unix_path or f'{host}:{port}'}, input latency {stream.latency*1000:.1f} ms")
+      async with listener:
+        await listener.serve_forever()
+  finally:
+    detection_pipeline.stop()
+    server.close()
+    detector.metrics.dump()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Publishes the detected notes to local clients")
+  parser.add_argument("--host", default=DEFAULT_HOST)
+  parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+  parser.add_argument("--unix", help="path of a Unix socket to listen on instead of TCP")
+  parser.add_argument("--max-queued-events", type=int, default=MAX_QUEUED_EVENTS,
+                      help="events that may wait for a slow client before its oldest ones are dropped")
+  args = parser.parse_args()
+  try:
+    asyncio.run(serve(pd.load_settings(), args.host, args.port, args.unix, args.max_queued_events))
+  except KeyboardInterrupt:
+    pass
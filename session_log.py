@@ -0,0 +1,166 @@
+import queue
+import threading
+import numpy as np
+import pitch_detection as pd
+
+FLUSH_INTERVAL = 1.0 # seconds the writer waits for more attempts before it writes a batch
+MAX_BATCH_SIZE = 1024 # attempts written at once at most
+
+# one fixed size record per attempt, the log file is just these records appended one after another,
+# so months of practice load into one structured array with a single read
+RECORD_DTYPE = np.dtype([
+  ("timestamp", "<f8"), # unix time of the attempt
+  ("session", "<f8"), # unix time the practice was started, groups the attempts of one practice
+  ("channel", "<i2"), # input channel of the player
+  ("target", "<i2"), # midi note number of the target note
+  ("played", "<i2"), # midi note number of the played note
+  ("cents", "<f4"), # cents off the target note, nan if the frequency is unknown
+  ("time_to_correct", "<f4"), # seconds since the target was shown, nan unless the attempt was correct
+  ("is_new_note", "?"), # whether the note was just struck
+  ("is_correct", "?") # whether the played note was the target
+])
+
+class SessionLogger:
+  """
+  Records the practice attempts in an append-only log. log only queues the attempt, a background
+  thread writes them in batches, so the detection never waits for the disk
+  """
+  def __init__(self, path, flush_interval=FLUSH_INTERVAL, max_batch_size=MAX_BATCH_SIZE):
+    self.path = path
+    self.flush_interval = flush_interval
+    self.max_batch_size = max_batch_size
+    self.attempts = queue.SimpleQueue()
+    self.num_written = 0
+    self.writer = threading.Thread(target=self.write_attempts, daemon=True)
+    self.writer.start()
+
+  def log(self, timestamp, session, channel, target, played, cents, time_to_correct, is_new_note, is_correct):
+    """
+    Queues one attempt, see RECORD_DTYPE for the fields
+    """
+    self.attempts.put((timestamp, session, channel, target, played, cents, time_to_correct, is_new_note, is_correct))
+
+  def write_attempts(self):
+    with open(self.path, "ab") as f:
+      is_closed = False
+      while not is_closed:
+        batch = []
+        try:
+          batch.append(self.attempts.get(timeout=self.flush_interval))
+          while len(batch) < self.max_batch_size:
+            batch.append(self.attempts.get_nowait())
+        except queue.Empty:
+          pass
+        if batch and batch[-1] is None: # close was called
+          batch.pop()
+          is_closed = True
+        if batch:
+          np.array(batch, dtype=RECORD_DTYPE).tofile(f)
+          f.flush()
+          self.num_written += len(batch)
+
+  def close(self):
+    """
+    Writes the queued attempts and stops the writer thread
+    """
+    self.attempts.put(None)
+    self.writer.join()
+
+def cents_off(freq, target, concert_pitch=pd.CONCERT_PITCH):
+  """
+  Returns how many cents freq is off the target note, nan if freq is None
+  Parameters:
+    freq (float): played frequency in hertz
+    target (int): midi note number of the target note
+    concert_pitch (float): pitch of a4 in hertz
+  """
+  if freq is None:
+    return np.nan
+  target_pitch = concert_pitch * 2**((target - pd.CONCERT_PITCH_MIDI)/12)
+  return 1200*np.log2(freq/target_pitch)
+
+def load_log(path, since=None):
+  """
+  Loads the attempts of a log file
+  Parameters:
+    path (str): path of the log file
+    since (float): only attempts from this unix time on, all if None
+  Returns:
+    records (np.ndarray): structured array with RECORD_DTYPE
+  """
+  # an attempt cut off by a crash at the end of the file is ignored
+  records = np.fromfile(path, dtype=np.uint8)
+  records = records[:len(records) - len(records) % RECORD_DTYPE.itemsize].view(RECORD_DTYPE)
+  if since is not None:
+    records = records[records["timestamp"] >= since]
+  return records
+
+def group_medians(groups, values, num_groups):
+  """
+  Median of the values of every group in one sort, nan for groups without values
+  """
+  order = np.lexsort((values, groups))
+  groups, values = groups[order], values[order]
+  counts = np.bincount(groups, minlength=num_groups)
+  starts = np.cumsum(counts) - counts
+  medians = np.full(num_groups, np.nan)
+  has_values = counts > 0
+  lower = starts[has_values] + (counts[has_values] - 1) // 2
+  upper = starts[has_values] + counts[has_values] // 2
+  medians[has_values] = (values[lower] + values[upper]) / 2
+  return medians
+
+def note_statistics(records):
+  """
+  Accuracy and reaction time of every target note, computed for all records at once
+  Parameters:
+    records (np.ndarray): attempts as returned by load_log
+  Returns:
+    statistics (np.ndarray): structured array with one row per target note, ordered by the note.
+      note (midi note number), attempts, correct, accuracy (share of the attempts that were correct),
+      mean_abs_cents (intonation of the correct attempts), mean_time_to_correct and median_time_to_correct
+  """
+  notes, groups = np.unique(records["target"], return_inverse=True)
+  num_notes = len(notes)
+  is_correct = records["is_correct"]
+  attempts = np.bincount(groups, minlength=num_notes)
+  correct = np.bincount(groups, weights=is_correct, minlength=num_notes)
+
+  # intonation and reaction time only count the correct attempts where they are known
+  has_cents = is_correct & ~np.isnan(records["cents"])
+  abs_cents = np.bincount(groups[has_cents], weights=np.abs(records["cents"][has_cents]), minlength=num_notes)
+  num_cents = np.bincount(groups[has_cents], minlength=num_notes)
+  has_time = is_correct & ~np.isnan(records["time_to_correct"])
+  times = records["time_to_correct"][has_time].astype(np.float64)
+  total_time = np.bincount(groups[has_time], weights=times, minlength=num_notes)
+  num_times = np.bincount(groups[has_time], minlength=num_notes)
+
+  statistics = np.zeros(num_notes, dtype=[("note", int), ("attempts", int), ("correct", int), ("accuracy", float),
+                                          ("mean_abs_cents", float), ("mean_time_to_correct", float),
+                                          ("median_time_to_correct", float)])
+  statistics["note"] = notes
+  statistics["attempts"] = attempts
+  statistics["correct"] = correct
+  with np.errstate(invalid="ignore", divide="ignore"): # notes that were never played correctly get nan
+    statistics["accuracy"] = correct / attempts
+    statistics["mean_abs_cents"] = abs_cents / num_cents
+    statistics["mean_time_to_correct"] = total_time / num_times
+  statistics["median_time_to_correct"] = group_medians(groups[has_time], times, num_notes)
+  return statistics
+
+if __name__ == "__main__":
+  import argparse
+  import datetime
+  parser = argparse.ArgumentParser(description="Prints the accuracy and reaction time of every practiced note")
+  parser.add_argument("path", nargs="?", default=pd.load_settings()["session_log_path"])
+  parser.add_argument("--days", type=float, help="only the attempts of the last days")
+  args = parser.parse_args()
+  since = None
+  if args.days is not None:
+    since = (datetime.datetime.now() - datetime.timedelta(days=args.days)).timestamp()
+  records = load_log(args.path, since)
+  print(f"{len(records)} attempts in {len(np.unique(records['session']))} practices")
+  print(f"{'note':>5} {'attempts':>8} {'accuracy':>8} {'cents':>6} {'mean s':>7} {'median s':>8}")
+  for row in note_statistics(records):
+    print(f"{pd.midi_note_name(row['note']):>5} {row['attempts']:>8} {row['accuracy']:>8.1%} {row['mean_abs_cents']:>6.1f} "
+          f"{row['mean_time_to_correct']:>7.2f} {row['median_time_to_correct']:>8.2f}")
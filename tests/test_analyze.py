@@ -0,0 +1,35 @@
+"""
+Offline analysis of whole recordings
+"""
+import numpy as np
+import pitch_detection as pd
+from benchmark import generate_signal
+
+SAMPLE_FREQ = 48000
+
+def harmonic_tone(freq, duration=2.0):
+  return generate_signal("harmonic", freq, int(duration * SAMPLE_FREQ), SAMPLE_FREQ, np.random.default_rng(0))
+
+def test_notes_follow_the_concert_pitch():
+  freq = 440 * 2**(0.55/12) # above the edge between A4 and A#4 at 440 Hz, below it at 442 Hz
+  samples = harmonic_tone(freq)
+  notes = pd.analyze(samples, SAMPLE_FREQ)["note"]
+  assert set(notes[notes >= 0]) == {70}
+  notes = pd.analyze(samples, SAMPLE_FREQ, concert_pitch=442)["note"]
+  assert set(notes[notes >= 0]) == {69}
+
+  # the same note as the real-time detection
+  detector = pd.PitchDetector({**pd.DEFAULT_SETTINGS, "concert_pitch": 442})
+  reports = []
+  for start in range(0, len(samples), detector.settings["window_step"]):
+    block = samples[start:start + detector.settings["window_step"], np.newaxis]
+    detector.callback(block, None, len(block), None, None, lambda note, is_new_note, channel: reports.append(note))
+  assert reports[-1] == 69
+
+def test_frequencies_below_min_freq_are_not_reported():
+  analysis = pd.analyze(harmonic_tone(110), SAMPLE_FREQ, min_freq=200)
+  assert np.all(analysis["note"] == -1)
+  assert np.all(np.isnan(analysis["frequency"]))
+  analysis = pd.analyze(harmonic_tone(110), SAMPLE_FREQ)
+  assert np.all(analysis["note"] >= -1)
+  assert np.all(analysis["frequency"][analysis["note"] >= 0] >= pd.MIN_FREQ)
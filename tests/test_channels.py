@@ -0,0 +1,58 @@
+"""
+Changing the number of input channels while blocks of the old stream are still queued
+"""
+import numpy as np
+import pitch_detection as pd
+from pipeline import DetectionPipeline
+
+SAMPLE_FREQ = 48000
+BLOCK_SIZE = 1000
+
+def tone(freq, num_samples, channels):
+  t = np.arange(num_samples) / SAMPLE_FREQ
+  samples = sum(0.3 / harmonic * np.sin(2*np.pi*harmonic*freq*t) for harmonic in range(1, 4))
+  return np.repeat(samples[:, np.newaxis], channels, axis=1).astype(np.float32)
+
+def play(pipeline, samples):
+  for start in range(0, len(samples), BLOCK_SIZE):
+    pipeline.audio_callback(samples[start:start + BLOCK_SIZE], BLOCK_SIZE, None, None)
+
+def test_reconfigure_channels_mid_stream():
+  settings = {**pd.DEFAULT_SETTINGS, "channels": 1, "profiling": True, "adaptive_hop": False}
+  detector = pd.PitchDetector(settings)
+  notes = []
+  pipeline = DetectionPipeline(detector, lambda note, is_new_note, channel: notes.append((channel, note)), SAMPLE_FREQ,
+                               max_queued_blocks=1000, overflow_policy="block", hop_size=settings["window_step"],
+                               adaptive_hop=False)
+  pipeline.start()
+  try:
+    play(pipeline, tone(440, SAMPLE_FREQ, 1))
+    assert pipeline.drain(timeout=30)
+    detector.reconfigure({"channels": 2})
+    play(pipeline, tone(440, settings["window_step"], 1)) # queued by the old stream after the change
+    play(pipeline, tone(440, SAMPLE_FREQ, 2))
+    assert pipeline.drain(timeout=30)
+    assert pipeline.thread.is_alive()
+    assert detector.channels == 2
+    assert (1, 69) in notes
+    assert detector.metrics.snapshot()["counters"]["mismatched_blocks"] == 1
+
+    notes.clear()
+    detector.reconfigure({"channels": 1})
+    play(pipeline, tone(440, settings["window_step"], 2))
+    play(pipeline, tone(440, SAMPLE_FREQ, 1))
+    assert pipeline.drain(timeout=30)
+    assert pipeline.thread.is_alive()
+    assert detector.channels == 1
+    assert (0, 69) in notes
+    assert all(channel == 0 for channel, _ in notes)
+  finally:
+    pipeline.stop()
+
+def test_coalesce_drops_blocks_of_the_old_stream():
+  detector = pd.PitchDetector({**pd.DEFAULT_SETTINGS, "channels": 2})
+  pipeline = DetectionPipeline(detector, lambda *args: None, SAMPLE_FREQ, max_queued_blocks=1, overflow_policy="coalesce")
+  pipeline.audio_callback(np.zeros((BLOCK_SIZE, 1), dtype=np.float32), BLOCK_SIZE, None, None)
+  pipeline.audio_callback(np.zeros((BLOCK_SIZE, 2), dtype=np.float32), BLOCK_SIZE, None, None)
+  assert pipeline.dropped_blocks == 1
+  assert pipeline.queue[0].samples.shape == (BLOCK_SIZE, 2)
@@ -0,0 +1,17 @@
+"""
+Profiling dumps at exit
+"""
+import json
+import metrics
+
+def test_only_the_live_metrics_are_dumped_at_exit(tmp_path):
+  path = tmp_path / "profile.json"
+  old = metrics.Metrics(True, str(path))
+  old.count("old_session")
+  live = metrics.Metrics(True, str(path))
+  live.count("new_session")
+  metrics.Metrics() # a detector without profiling leaves the dump alone
+  assert metrics.live_metrics is live
+  metrics.dump_live_metrics()
+  with open(path) as f:
+    assert json.load(f)["counters"] == {"new_session": 1}
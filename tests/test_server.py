@@ -0,0 +1,88 @@
+"""
+Loopback clients of the detection server, the audio comes from a recording played by the file audio source
+"""
+import asyncio
+import json
+import os
+import socket
+import numpy as np
+import pytest
+import pitch_detection as pd
+import server
+
+SAMPLE_FREQ = 48000
+
+def write_tone(path, freq, duration):
+  t = np.arange(int(duration * SAMPLE_FREQ)) / SAMPLE_FREQ
+  samples = sum(0.3 / harmonic * np.sin(2*np.pi*harmonic*freq*t) for harmonic in range(1, 4))
+  np.save(path, samples[:, np.newaxis].astype(np.float32))
+
+async def wait_for_socket(path, timeout=5.0):
+  for _ in range(int(timeout / 0.01)):
+    if os.path.exists(path):
+      return
+    await asyncio.sleep(0.01)
+  raise TimeoutError(f"{path} was not created")
+
+async def receive_notes(unix_path, num_clients, num_notes):
+  await wait_for_socket(unix_path)
+  connections = [await asyncio.open_unix_connection(unix_path) for _ in range(num_clients)]
+  events = [[] for _ in connections]
+  async def read(reader, client_events):
+    while len([event for event in client_events if event["note"] is not None]) < num_notes:
+      client_events.append(json.loads(await reader.readline()))
+  await asyncio.wait_for(asyncio.gather(*(read(reader, client_events) for (reader, _), client_events in zip(connections, events))), 10)
+  for _, writer in connections:
+    writer.close()
+  return events
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+def test_clients_receive_the_notes_of_a_tone(tmp_path):
+  recording_path = str(tmp_path / "a4.npy")
+  write_tone(recording_path, 440, 3.0)
+  unix_path = str(tmp_path / "pitchpal.sock")
+  settings = {**pd.DEFAULT_SETTINGS, "audio_source": "file", "audio_source_path": recording_path, "audio_source_realtime": True,
+              "profiling": False}
+
+  async def run():
+    serve_task = asyncio.create_task(server.serve(settings, unix_path=unix_path))
+    try:
+      return await receive_notes(unix_path, num_clients=2, num_notes=3)
+    finally:
+      serve_task.cancel()
+      await asyncio.gather(serve_task, return_exceptions=True)
+
+  for client_events in asyncio.run(run()):
+    notes = [event for event in client_events if event["note"] is not None]
+    assert all(event["note"] == "A4" and event["midi_note"] == 69 for event in notes)
+    assert all(abs(event["cents"]) < 5 and event["channel"] == 0 for event in notes)
+    assert set(notes[0]) == {"note", "midi_note", "frequency", "cents", "power", "timestamp", "is_new_note", "channel"}
+
+def test_slow_client_drops_its_oldest_events():
+  async def run():
+    client = server.ClientConnection(writer=None, max_queued_events=2)
+    for line in (b"1\n", b"2\n", b"3\n"):
+      client.put(line)
+    return client.dropped_events, [client.queue.get_nowait() for _ in range(client.queue.qsize())]
+  assert asyncio.run(run()) == (1, [b"2\n", b"3\n"])
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+def test_cancelled_client_handlers_stay_cancelled(tmp_path):
+  unix_path = str(tmp_path / "server.sock")
+
+  async def run():
+    detection_server = server.DetectionServer()
+    handlers = []
+    async def handle_client(reader, writer):
+      handlers.append(asyncio.current_task())
+      await detection_server.handle_client(reader, writer)
+    await asyncio.start_unix_server(handle_client, unix_path)
+    _, writer = await asyncio.open_unix_connection(unix_path)
+    while not detection_server.clients:
+      await asyncio.sleep(0.01)
+    handlers[0].cancel()
+    with pytest.raises(asyncio.CancelledError):
+      await handlers[0]
+    assert not detection_server.clients
+    writer.close()
+  asyncio.run(run())
@@ -0,0 +1,31 @@
+"""
+The sliding DFT against the FFT of the same window
+"""
+import numpy as np
+import pitch_detection as pd
+
+def sliding_detector(window_step, precision="float64"):
+  settings = {**pd.DEFAULT_SETTINGS, "spectrum_engine": "sliding_dft", "window_step": window_step, "precision": precision}
+  return pd.PitchDetector(settings)
+
+def test_short_hops_slide_the_spectrum_of_the_fft():
+  detector = sliding_detector(24)
+  engine = detector.estimator.fft_engine
+  samples = np.random.default_rng(0).standard_normal(2*detector.window_size + 240)
+  for start in range(0, len(samples), 24):
+    detector.push_samples(samples[start:start + 24])
+  assert not engine.needs_resync
+  sliding_spec = engine.magnitude_spectrum(detector.window_samples).copy()
+  fft_spec = pd.FFTEngine(detector.window_size, precision="float64").magnitude_spectrum(detector.window_samples)
+  num_tracked = engine.num_bins - 1
+  np.testing.assert_allclose(sliding_spec[:num_tracked], fft_spec[:num_tracked], rtol=1e-7, atol=1e-7 * fft_spec.max())
+
+def test_long_hops_are_left_to_the_fft():
+  detector = sliding_detector(3000, "float32")
+  engine = detector.estimator.fft_engine
+  assert engine.max_hop < 3000
+  samples = np.random.default_rng(0).standard_normal(detector.window_size + 3000).astype(np.float32)
+  detector.push_samples(samples[:detector.window_size])
+  detector.push_samples(samples[detector.window_size:])
+  assert engine.needs_resync
+  assert np.shares_memory(engine.magnitude_spectrum(detector.window_samples), engine.fft_engine.magnitude_spec)